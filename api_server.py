@@ -0,0 +1,280 @@
+import os
+import re
+import uuid
+from itertools import chain as chain_iterators
+from tempfile import NamedTemporaryFile
+from typing import List, Optional, Tuple
+
+from fastapi import FastAPI, File, HTTPException, Query, Request, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+from document_processor import extract_pages_from_pdf
+from embedding_manager import (
+    initialize_chroma_db,
+    add_documents_to_vectorstore,
+    load_existing_vectorstore,
+    build_search_filter,
+    get_document_index
+)
+from chat_handler import (
+    get_conversation_chain,
+    ask_question,
+    stream_answer,
+    restore_chat_history,
+    set_retrieval_scope
+)
+from conversation_store import get_conversation_store
+from request_coalescer import coalescer
+from scheduler import SchedulerError, SchedulerQueueFull
+from storage_maintenance import start_background_maintenance
+from warmup import start_warmup, WARMUP_SESSIONS
+from utils import ensure_directories
+
+app = FastAPI(title="MedStudy Assistant API")
+
+# Conversation state lives in the store and collections are reopened when
+# another worker changed them, so any worker on this host can serve any turn
+conversation_store = get_conversation_store()
+
+_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Seconds clients are asked to wait when the model call scheduler is saturated
+RETRY_AFTER_SECONDS = 5
+
+
+class Scope(BaseModel):
+    # Unset fields search everything
+    documents: Optional[List[str]] = None
+    page_range: Optional[Tuple[int, int]] = None
+    sections: Optional[List[str]] = None
+
+
+class RetrieveRequest(BaseModel):
+    query: str
+    k: int = 5
+    scope: Optional[Scope] = None
+
+
+class ChatRequest(BaseModel):
+    collection_id: str
+    question: str
+    conversation_id: Optional[str] = None
+    stream: bool = False
+    scope: Optional[Scope] = None
+
+
+@app.exception_handler(SchedulerError)
+async def scheduler_error_handler(request: Request, exc: SchedulerError):
+    # A full queue is the client's cue to back off; a timeout means the
+    # service could not keep up
+    status_code = 429 if isinstance(exc, SchedulerQueueFull) else 503
+    return JSONResponse(
+        status_code=status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
+
+
+def _check_id(value, name):
+    # Collection ids become directory names under chroma_db/
+    if not _ID_PATTERN.match(value):
+        raise HTTPException(status_code=400, detail=f"Invalid {name}")
+
+
+def _ingest(collection_id, pdf_files):
+    """
+    Extract text from uploaded PDFs and add it to a collection.
+    """
+    temp_file_paths = []
+    try:
+        for file_name, content in pdf_files:
+            with NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+                tmp_file.write(content)
+                temp_file_paths.append((file_name, tmp_file.name))
+
+        document_pages = []
+        document_names = []
+        for file_name, file_path in temp_file_paths:
+            pages = extract_pages_from_pdf(file_path)
+            if any(pages):
+                document_pages.append(pages)
+                document_names.append(file_name)
+
+        vectorstore = initialize_chroma_db(collection_id)
+        if vectorstore is None:
+            return False, 0
+        success = add_documents_to_vectorstore(vectorstore, document_pages, collection_id, document_names)
+        return success, len(document_pages)
+    finally:
+        for _, file_path in temp_file_paths:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+
+def _load_chain(collection_id, conversation_id, scope=None):
+    """
+    Build a conversation chain for one turn from the stored chat history.
+    """
+    chain = get_conversation_chain(collection_id)
+    if chain is None:
+        return None
+    restore_chat_history(chain, conversation_store.get_messages(conversation_id))
+    if scope is not None:
+        set_retrieval_scope(chain, scope.documents, scope.page_range, scope.sections)
+    return chain
+
+
+@app.on_event("startup")
+def startup():
+    ensure_directories()
+    start_background_maintenance()
+    for collection_id in WARMUP_SESSIONS:
+        start_warmup(collection_id)
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.post("/collections")
+async def create_collection():
+    return {"collection_id": str(uuid.uuid4())}
+
+
+@app.post("/collections/{collection_id}/documents")
+async def upload_documents(
+    collection_id: str,
+    files: List[UploadFile] = File(...),
+    summaries: bool = Query(False, description="Build section and document summaries in the background")
+):
+    _check_id(collection_id, "collection id")
+    pdf_files = [(upload.filename or f"document_{i}", await upload.read()) for i, upload in enumerate(files)]
+
+    success, processed = await run_in_threadpool(_ingest, collection_id, pdf_files)
+    if not success:
+        raise HTTPException(status_code=500, detail="Failed to process documents")
+
+    # Summaries, if requested, are built before the caches are warmed up
+    start_warmup(collection_id, build_summaries=summaries)
+
+    return {"collection_id": collection_id, "documents_processed": processed}
+
+
+@app.get("/collections/{collection_id}/documents")
+async def list_documents(collection_id: str):
+    _check_id(collection_id, "collection id")
+    vectorstore = await run_in_threadpool(load_existing_vectorstore, collection_id)
+    if vectorstore is None:
+        raise HTTPException(status_code=404, detail="Collection not found")
+
+    # Documents, page ranges and sections that can be used as a scope
+    return {"documents": await run_in_threadpool(get_document_index, vectorstore)}
+
+
+@app.post("/collections/{collection_id}/retrieve")
+async def retrieve(collection_id: str, request: RetrieveRequest):
+    _check_id(collection_id, "collection id")
+    vectorstore = await run_in_threadpool(load_existing_vectorstore, collection_id)
+    if vectorstore is None:
+        raise HTTPException(status_code=404, detail="Collection not found")
+
+    search_filter = None
+    if request.scope is not None:
+        search_filter = build_search_filter(
+            request.scope.documents, request.scope.page_range, request.scope.sections
+        )
+
+    docs = await run_in_threadpool(
+        vectorstore.similarity_search, request.query, request.k, filter=search_filter
+    )
+    return {
+        "documents": [
+            {"content": doc.page_content, "metadata": doc.metadata}
+            for doc in docs
+        ]
+    }
+
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    _check_id(request.collection_id, "collection id")
+    conversation_id = request.conversation_id or str(uuid.uuid4())
+    _check_id(conversation_id, "conversation id")
+
+    chain = await run_in_threadpool(_load_chain, request.collection_id, conversation_id, request.scope)
+    if chain is None:
+        raise HTTPException(status_code=404, detail="Collection not found")
+
+    if request.stream:
+        def stream_and_store():
+            tokens = []
+            for token in stream_answer(chain, request.question, request.collection_id, conversation_id):
+                tokens.append(token)
+                yield token
+            conversation_store.append_messages(conversation_id, [
+                {"role": "user", "content": request.question},
+                {"role": "assistant", "content": "".join(tokens)}
+            ])
+
+        # Wait for the first token before responding, so an overloaded
+        # scheduler still gets a proper error status; the rest of the sync
+        # generator is iterated in Starlette's threadpool
+        tokens = stream_and_store()
+        first = await run_in_threadpool(next, tokens, None)
+        return StreamingResponse(
+            chain_iterators([] if first is None else [first], tokens),
+            media_type="text/plain",
+            headers={"X-Conversation-Id": conversation_id}
+        )
+
+    answer = await run_in_threadpool(
+        ask_question, chain, request.question, request.collection_id, conversation_id
+    )
+    await run_in_threadpool(conversation_store.append_messages, conversation_id, [
+        {"role": "user", "content": request.question},
+        {"role": "assistant", "content": answer}
+    ])
+    return {"conversation_id": conversation_id, "answer": answer}
+
+
+@app.get("/conversations/{conversation_id}")
+async def get_conversation(conversation_id: str):
+    _check_id(conversation_id, "conversation id")
+    messages = await run_in_threadpool(conversation_store.get_messages, conversation_id)
+    return {"conversation_id": conversation_id, "messages": messages}
+
+
+@app.delete("/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: str):
+    _check_id(conversation_id, "conversation id")
+    await run_in_threadpool(conversation_store.clear, conversation_id)
+    return {"conversation_id": conversation_id, "deleted": True}
+
+
+@app.get("/stats/coalescing")
+async def coalescing_stats(limit: int = Query(10, ge=1, le=100)):
+    # Per worker process; each worker coalesces its own in-flight requests
+    return {
+        "summary": coalescer.get_summary(),
+        "top_keys": [
+            {"kind": key[0], "collection_id": key[1], "scope": key[2], "question": key[3], **stats}
+            for key, stats in coalescer.get_top_keys(limit)
+        ]
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # Workers share nothing but files on this host (the conversation store,
+    # the scheduler budget and chroma_db/), so they scale out to more
+    # processes, but not to more hosts
+    uvicorn.run(
+        "api_server:app",
+        host=os.environ.get("MEDSTUDY_API_HOST", "0.0.0.0"),
+        port=int(os.environ.get("MEDSTUDY_API_PORT", 8000)),
+        workers=int(os.environ.get("MEDSTUDY_API_WORKERS", 4))
+    )
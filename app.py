@@ -3,13 +3,20 @@ import streamlit as st
 from tempfile import NamedTemporaryFile
 import time
 
-from document_processor import extract_text_from_pdf
+from document_processor import extract_pages_from_pdf
 from embedding_manager import (
     initialize_chroma_db,
     add_documents_to_vectorstore,
-    load_existing_vectorstore
+    load_existing_vectorstore,
+    get_document_index
 )
-from chat_handler import get_conversation_chain
+from embedding_backends import get_backend
+from chat_handler import get_conversation_chain, stream_answer, set_retrieval_scope
+from request_coalescer import coalescer
+from scheduler import get_scheduler
+from query_cache import get_cache_stats
+from warmup import start_warmup, EXAMPLE_QUESTIONS
+from storage_maintenance import start_background_maintenance, touch_collection, get_collection_size, format_size
 from utils import check_api_key, get_session_id, ensure_directories
 
 # Page configuration
@@ -30,10 +37,15 @@ if "file_paths" not in st.session_state:
     st.session_state.file_paths = []
 if "files_processed" not in st.session_state:
     st.session_state.files_processed = False
+if "document_index" not in st.session_state:
+    st.session_state.document_index = None
 
 # Ensure necessary directories exist
 ensure_directories()
 
+# Expire idle session collections in the background (once per process)
+start_background_maintenance()
+
 # Get unique session ID
 # First check if we have a fixed session ID from script processing
 if os.path.exists("session_id.txt"):
@@ -46,6 +58,10 @@ else:
 
 st.session_state.vectorstore_exists = os.path.exists(f"chroma_db/{session_id}")
 
+# Warm up the caches of existing documents (once per process)
+if st.session_state.vectorstore_exists:
+    start_warmup(session_id)
+
 # Main page layout
 st.title("MedStudy Assistant 🩺")
 
@@ -76,6 +92,12 @@ with st.sidebar:
         help="Upload PDF files containing your lecture notes or textbook chapters"
     )
     
+    build_summaries = st.checkbox(
+        "Prepare summaries for broad questions",
+        value=True,
+        help="Summarizes each section and document in the background after processing, so questions like \"summarize this lecture\" are answered from the whole text"
+    )
+    
     process_button = st.button("Process Documents")
     
     if process_button and uploaded_files:
@@ -88,27 +110,34 @@ with st.sidebar:
                 for uploaded_file in uploaded_files:
                     with NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
                         tmp_file.write(uploaded_file.read())
-                        temp_file_paths.append(tmp_file.name)
+                        temp_file_paths.append((uploaded_file.name, tmp_file.name))
                 
-                # Extract text
-                document_texts = []
-                for file_path in temp_file_paths:
-                    text = extract_text_from_pdf(file_path)
-                    if text:
-                        document_texts.append(text)
+                # Extract text page by page so chunks keep their page numbers
+                document_pages = []
+                document_names = []
+                for file_name, file_path in temp_file_paths:
+                    pages = extract_pages_from_pdf(file_path)
+                    if any(pages):
+                        document_pages.append(pages)
+                        document_names.append(file_name)
                     
                 # Initialize vector store
                 vectorstore = initialize_chroma_db(session_id)
                 
                 # Add documents to the vector store
-                add_documents_to_vectorstore(vectorstore, document_texts, session_id)
+                added = add_documents_to_vectorstore(vectorstore, document_pages, session_id, document_names)
+                
+                # Summarize and warm up the caches in the background, off the interactive path
+                if added:
+                    start_warmup(session_id, build_summaries=build_summaries)
                 
                 # Clean up temp files
-                for file_path in temp_file_paths:
+                for _, file_path in temp_file_paths:
                     if os.path.exists(file_path):
                         os.remove(file_path)
                 
                 st.session_state.files_processed = True
+                st.session_state.document_index = None
                 st.session_state.vectorstore_exists = True
                 
                 # Initialize conversation chain
@@ -124,6 +153,40 @@ with st.sidebar:
         if st.session_state.conversation is None:
             st.session_state.conversation = get_conversation_chain(session_id)
 
+    # Search scope
+    if st.session_state.vectorstore_exists and st.session_state.conversation is not None:
+        if st.session_state.document_index is None:
+            st.session_state.document_index = get_document_index(
+                st.session_state.conversation.retriever.vectorstore
+            )
+        document_index = st.session_state.document_index
+        
+        with st.expander("Search Scope"):
+            scope_documents = st.multiselect(
+                "Documents",
+                options=sorted(document_index),
+                help="Only search the selected documents (all if none selected)"
+            )
+            scoped = [document_index[name] for name in (scope_documents or document_index)]
+            
+            page_bounds = [entry["pages"] for entry in scoped if entry["pages"]]
+            scope_pages = None
+            if page_bounds:
+                first_page = min(first for first, _ in page_bounds)
+                last_page = max(last for _, last in page_bounds)
+                if last_page > first_page:
+                    selected_pages = st.slider("Pages", first_page, last_page, (first_page, last_page))
+                    if selected_pages != (first_page, last_page):
+                        scope_pages = selected_pages
+            
+            scope_sections = st.multiselect(
+                "Sections",
+                options=list(dict.fromkeys(section for entry in scoped for section in entry["sections"])),
+                help="Only search the selected sections (all if none selected)"
+            )
+        
+        set_retrieval_scope(st.session_state.conversation, scope_documents, scope_pages, scope_sections)
+
     # Clear chat history button
     if st.button("Clear Chat History"):
         st.session_state.chat_history = []
@@ -135,6 +198,7 @@ with st.sidebar:
         st.session_state.chat_history = []
         st.session_state.conversation = None
         st.session_state.files_processed = False
+        st.session_state.document_index = None
         
         # Remove vectorstore directory
         if os.path.exists(f"chroma_db/{session_id}"):
@@ -176,12 +240,9 @@ elif not st.session_state.vectorstore_exists:
     # Show examples
     st.header("Example Questions You Can Ask:")
     example_cols = st.columns(2)
-    with example_cols[0]:
-        st.markdown("- What are the key symptoms of Crohn's disease?")
-        st.markdown("- Explain the cardiac conduction system step by step.")
-    with example_cols[1]:
-        st.markdown("- Compare and contrast Type 1 and Type 2 diabetes.")
-        st.markdown("- Summarize the mechanism of action for ACE inhibitors.")
+    for i, question in enumerate(EXAMPLE_QUESTIONS):
+        with example_cols[i * 2 // len(EXAMPLE_QUESTIONS)]:
+            st.markdown(f"- {question}")
 else:
     # Initialize conversation if needed
     if st.session_state.conversation is None:
@@ -195,6 +256,18 @@ else:
         st.write(f"Files processed: {st.session_state.files_processed}")
         st.write(f"Conversation initialized: {st.session_state.conversation is not None}")
         st.write(f"Chat history items: {len(st.session_state.chat_history)}")
+        st.write(f"Request coalescing: {coalescer.get_summary()}")
+        top_keys = coalescer.get_top_keys()
+        if top_keys:
+            st.write("Most coalesced requests:")
+            st.table([
+                {"kind": key[0], "question": key[3], "scope": key[2], **stats}
+                for key, stats in top_keys
+            ])
+        st.write(f"Model call scheduler: {get_scheduler().get_stats()}")
+        st.write(f"Caches: {get_cache_stats()}")
+        st.write(f"Embedding backend: {get_backend().name} ({get_backend().model})")
+        st.write(f"Vector store size: {format_size(get_collection_size(session_id))}")
         
         if os.path.exists(f"chroma_db/{session_id}"):
             try:
@@ -216,6 +289,7 @@ else:
     # Chat input
     if prompt := st.chat_input("Ask a question about your medical notes..."):
         st.session_state.chat_history.append({"role": "user", "content": prompt})
+        touch_collection(session_id)
         
         with st.chat_message("user"):
             st.write(prompt)
@@ -229,24 +303,18 @@ else:
                 if st.session_state.conversation is None:
                     # Try to recreate the conversation chain
                     st.session_state.conversation = get_conversation_chain(session_id)
-                    
-                    if st.session_state.conversation is None:
-                        error_msg = "Cannot create conversation chain. Please make sure you've processed documents first."
-                        message_placeholder.error(error_msg)
-                        st.session_state.chat_history.append({"role": "assistant", "content": error_msg})
-                    else:
-                        with st.spinner("Thinking..."):
-                            response = st.session_state.conversation({"question": prompt})
-                            full_response = response["answer"]
-                        
-                        message_placeholder.write(full_response)
-                        st.session_state.chat_history.append({"role": "assistant", "content": full_response})
+                
+                if st.session_state.conversation is None:
+                    error_msg = "Cannot create conversation chain. Please make sure you've processed documents first."
+                    message_placeholder.error(error_msg)
+                    st.session_state.chat_history.append({"role": "assistant", "content": error_msg})
                 else:
-                    with st.spinner("Thinking..."):
-                        response = st.session_state.conversation({"question": prompt})
-                        full_response = response["answer"]
-                    
-                    message_placeholder.write(full_response)
+                    # Identical in-flight questions share one answer stream. Model
+                    # calls are shared fairly per browser session, also when every
+                    # student uses the fixed session_id.txt collection
+                    full_response = message_placeholder.write_stream(
+                        stream_answer(st.session_state.conversation, prompt, session_id, user_id=get_session_id())
+                    )
                     st.session_state.chat_history.append({"role": "assistant", "content": full_response})
             except Exception as e:
                 error_msg = f"Error generating response: {str(e)}"
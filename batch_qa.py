@@ -0,0 +1,349 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from langchain.schema.document import Document
+from langchain.schema.messages import HumanMessage, SystemMessage
+
+from chat_handler import get_llm, MEDICAL_SYSTEM_PROMPT
+from context_packer import count_tokens, pack_context
+from document_processor import extract_text_from_pdf, split_text_into_chunks
+from embedding_manager import load_existing_vectorstore
+from request_coalescer import normalize_question
+from scheduler import get_scheduler, PRIORITY_BACKGROUND
+
+MODE_INSTRUCTIONS = {
+    "flashcard": 'one flashcard per request, as an object with "front" and "back"',
+    "quiz": 'one multiple-choice question per request, as an object with "question", '
+            '"options" (a list of 4 strings), "answer" and "explanation"',
+    "summary": 'one concise summary per request, as an object with "summary"',
+    "answer": 'one answer per request, as an object with "answer"',
+}
+
+DOCUMENT_PROMPTS = {
+    "flashcard": "Create a flashcard about the most important fact in passage {number}.",
+    "quiz": "Create a quiz question that tests understanding of passage {number}.",
+    "summary": "Summarize passage {number}.",
+    "answer": "Explain the key concept in passage {number}.",
+}
+
+# Tokens reserved for each generated item when admitting a call
+ITEM_TOKEN_ESTIMATE = 200
+
+
+def _item_id(mode, prompt):
+    return hashlib.sha1(f"{mode}\n{prompt}".encode("utf-8")).hexdigest()[:16]
+
+
+def _doc_key(doc):
+    return (doc.metadata.get("source"), doc.metadata.get("chunk"), doc.page_content[:50])
+
+
+def load_checkpoint(path):
+    """
+    Load the results already written by an earlier run.
+
+    Args:
+        path (str): Output JSONL file
+
+    Returns:
+        dict: Mapping of item id to result record
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A run interrupted mid-write leaves a partial last line
+                continue
+            done[record["id"]] = record
+    return done
+
+
+def _drop_partial_line(path):
+    # Appending after a partial last line would glue the next record onto it
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def items_from_prompts(prompts, mode):
+    """
+    Create batch items from a list of prompts.
+
+    Args:
+        prompts (list): Prompt strings
+        mode (str): Generation mode
+
+    Returns:
+        list: Item dicts with id and prompt
+    """
+    items = []
+    seen = set()
+    for prompt in prompts:
+        item_id = _item_id(mode, normalize_question(prompt))
+        if item_id in seen:
+            continue
+        seen.add(item_id)
+        items.append({"id": item_id, "prompt": prompt})
+    return items
+
+
+def groups_from_document(text, mode, count, items_per_call=5, source="document"):
+    """
+    Create batch groups directly from a document's chunks.
+
+    Chunks are picked evenly across the document, and each chunk is the
+    context for one item, so no retrieval is needed.
+
+    Args:
+        text (str): Document text
+        mode (str): Generation mode
+        count (int): Number of items to generate
+        items_per_call (int): Items generated by one model call
+        source (str): Name of the document
+
+    Returns:
+        list: Groups of items with their context documents
+    """
+    chunks = split_text_into_chunks(text)
+    if not chunks:
+        return []
+
+    count = min(count, len(chunks))
+    step = len(chunks) / count
+    picked = sorted({int(i * step) for i in range(count)})
+
+    groups = []
+    for start in range(0, len(picked), items_per_call):
+        items = []
+        docs = []
+        for number, index in enumerate(picked[start:start + items_per_call], start=1):
+            prompt = DOCUMENT_PROMPTS[mode].format(number=number)
+            items.append({"id": _item_id(mode, f"{source}:{index}"), "prompt": prompt, "chunk": index})
+            # No chunk id, so packing keeps the numbered passages apart
+            # instead of merging neighbouring chunks
+            docs.append(Document(
+                page_content=f"Passage {number}:\n{chunks[index]}",
+                metadata={"source": source, "passage": index}
+            ))
+        groups.append({"items": items, "docs": docs})
+    return groups
+
+
+def group_by_context(items, vectorstore, k=5, max_group_size=5, min_overlap=0.6):
+    """
+    Retrieve context for every item and group items that share it.
+
+    Identical prompts are retrieved once, all prompts are embedded in one
+    batched call, and items whose retrieved chunks overlap by at least
+    min_overlap (Jaccard) share a group and one model call.
+
+    Args:
+        items (list): Item dicts with id and prompt
+        vectorstore (Chroma): Vector store to search
+        k (int): Chunks retrieved per prompt
+        max_group_size (int): Maximum items per group
+        min_overlap (float): Minimum overlap of retrieved chunks to share a group
+
+    Returns:
+        list: Groups of items with their context documents
+    """
+    unique_prompts = list(dict.fromkeys(normalize_question(item["prompt"]) for item in items))
+    vectors = vectorstore.embeddings.embed_documents(unique_prompts)
+    retrieved = {
+        prompt: vectorstore.similarity_search_by_vector(vector, k=k)
+        for prompt, vector in zip(unique_prompts, vectors)
+    }
+
+    groups = []
+    for item in items:
+        docs = retrieved[normalize_question(item["prompt"])]
+        keys = {_doc_key(doc) for doc in docs}
+
+        best = None
+        best_overlap = min_overlap
+        for group in groups:
+            if len(group["items"]) >= max_group_size:
+                continue
+            overlap = len(keys & group["keys"]) / len(keys | group["keys"]) if keys else 0
+            if overlap >= best_overlap:
+                best, best_overlap = group, overlap
+
+        if best is None:
+            groups.append({"items": [item], "docs": list(docs), "keys": set(keys)})
+        else:
+            best["items"].append(item)
+            for doc in docs:
+                if _doc_key(doc) not in best["keys"]:
+                    best["docs"].append(doc)
+            best["keys"] |= keys
+
+    for group in groups:
+        del group["keys"]
+    return groups
+
+
+def _parse_results(text, expected):
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.index("\n") + 1:] if "\n" in text else text
+    results = json.loads(text)
+    if not isinstance(results, list) or len(results) != expected:
+        raise ValueError(f"Expected a JSON list of {expected} results")
+    return results
+
+
+def generate_group(llm, group, mode, user_id="batch", context_tokens=3000):
+    """
+    Generate results for all items of a group in one model call.
+
+    Args:
+        llm (ChatOpenAI): Language model
+        group (dict): Items and their shared context documents
+        mode (str): Generation mode
+        user_id (str): User the calls are scheduled for
+        context_tokens (int): Token budget for the shared context
+
+    Returns:
+        list: Result records for the group's items
+    """
+    items = group["items"]
+    requests = "\n".join(f"{number}. {item['prompt']}" for number, item in enumerate(items, start=1))
+    docs = pack_context(group["docs"], requests, max_tokens=context_tokens)
+    context = "\n\n".join(doc.page_content for doc in docs)
+
+    messages = [
+        SystemMessage(content=MEDICAL_SYSTEM_PROMPT + "\n----------------\n" + context),
+        HumanMessage(content=(
+            f"Answer these {len(items)} requests using only the context above:\n{requests}\n\n"
+            f"Return only a JSON array with {MODE_INSTRUCTIONS[mode]}, in the same order as the requests."
+        ))
+    ]
+
+    tokens = count_tokens(messages[0].content + messages[1].content) + ITEM_TOKEN_ESTIMATE * len(items)
+    with get_scheduler().slot(tokens, PRIORITY_BACKGROUND, user_id):
+        response = llm.invoke(messages)
+
+    results = _parse_results(response.content, len(items))
+    return [
+        {"id": item["id"], "prompt": item["prompt"], "mode": mode, "result": result}
+        for item, result in zip(items, results)
+    ]
+
+
+def run_batch(groups, mode, output_path, parallelism=4, user_id="batch"):
+    """
+    Generate all groups concurrently, checkpointing results as they finish.
+
+    Items already present in the output file are skipped, so an interrupted
+    run resumes where it stopped.
+
+    Args:
+        groups (list): Groups of items with their context documents
+        mode (str): Generation mode
+        output_path (str): Output JSONL file, also used as the checkpoint
+        parallelism (int): Maximum concurrent model calls
+        user_id (str): User the calls are scheduled for
+
+    Returns:
+        dict: Counts of generated, skipped and failed items
+    """
+    done = load_checkpoint(output_path)
+    pending = []
+    skipped = 0
+    for group in groups:
+        items = [item for item in group["items"] if item["id"] not in done]
+        skipped += len(group["items"]) - len(items)
+        if items:
+            pending.append({"items": items, "docs": group["docs"]})
+
+    total = sum(len(group["items"]) for group in pending)
+    print(f"{skipped} items already done, {total} to generate in {len(pending)} calls")
+
+    _drop_partial_line(output_path)
+    llm = get_llm()
+    write_lock = threading.Lock()
+    generated = 0
+    failed = 0
+
+    with open(output_path, "a", encoding="utf-8") as output, ThreadPoolExecutor(max_workers=parallelism) as pool:
+        futures = {pool.submit(generate_group, llm, group, mode, user_id): group for group in pending}
+        for future in as_completed(futures):
+            group = futures[future]
+            try:
+                records = future.result()
+            except Exception as e:
+                failed += len(group["items"])
+                print(f"Error generating {len(group['items'])} items: {str(e)}")
+                continue
+
+            with write_lock:
+                for record in records:
+                    output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+                os.fsync(output.fileno())
+            generated += len(records)
+            print(f"Generated {generated}/{total} items")
+
+    return {"generated": generated, "skipped": skipped, "failed": failed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate flashcards, quizzes, summaries or answers in bulk")
+    parser.add_argument("--mode", choices=sorted(MODE_INSTRUCTIONS), default="flashcard")
+    parser.add_argument("--output", required=True, help="Output JSONL file; rerun with the same file to resume")
+    parser.add_argument("--pdf", help="Generate items directly from a PDF")
+    parser.add_argument("--count", type=int, default=200, help="Number of items to generate from the PDF")
+    parser.add_argument("--prompts", help="File with one prompt per line, answered from a processed session")
+    parser.add_argument("--session", help="Session whose documents answer the prompts")
+    parser.add_argument("--parallelism", type=int, default=4, help="Maximum concurrent model calls")
+    parser.add_argument("--items-per-call", type=int, default=5, help="Items generated by one model call")
+    args = parser.parse_args()
+
+    if not os.environ.get("OPENAI_API_KEY"):
+        print("Error: OPENAI_API_KEY environment variable must be set")
+        sys.exit(1)
+
+    if args.pdf:
+        text = extract_text_from_pdf(args.pdf)
+        if not text:
+            print(f"Failed to extract text from {args.pdf}")
+            sys.exit(1)
+        groups = groups_from_document(
+            text, args.mode, args.count, args.items_per_call, source=os.path.basename(args.pdf)
+        )
+    elif args.prompts and args.session:
+        with open(args.prompts, "r", encoding="utf-8") as f:
+            prompts = [line.strip() for line in f if line.strip()]
+        vectorstore = load_existing_vectorstore(args.session, priority=PRIORITY_BACKGROUND)
+        if vectorstore is None:
+            print(f"No vector store found for session {args.session}")
+            sys.exit(1)
+        groups = group_by_context(
+            items_from_prompts(prompts, args.mode), vectorstore, max_group_size=args.items_per_call
+        )
+    else:
+        parser.error("use --pdf, or --prompts together with --session")
+
+    result = run_batch(groups, args.mode, args.output, args.parallelism)
+    print(f"Done: {result['generated']} generated, {result['skipped']} skipped, {result['failed']} failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from langchain_community.vectorstores import Chroma
+
+from embedding_manager import load_existing_vectorstore
+from quantized_store import QuantizedVectorStore, QUANTIZED_DIMENSIONS, QUANTIZED_REDUCTION, RESCORE_FACTOR
+from scheduler import PRIORITY_BACKGROUND
+from storage_maintenance import get_collection_size, format_size
+
+
+def synthetic_corpus(count, dimensions, topics=200, seed=0):
+    """
+    Create normalized vectors clustered around topics, like chunk embeddings.
+
+    Args:
+        count (int): Number of chunks
+        dimensions (int): Embedding dimensions
+        topics (int): Number of clusters
+        seed (int): Random seed
+
+    Returns:
+        tuple: (vectors, texts, metadatas)
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(topics, dimensions)).astype(np.float32)
+    labels = rng.integers(0, topics, size=count)
+    vectors = centers[labels] + rng.normal(scale=0.8, size=(count, dimensions)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    texts = [f"chunk {i} about topic {label}" for i, label in enumerate(labels)]
+    metadatas = [{"source": f"document_{label % 20}.pdf", "chunk": i} for i, label in enumerate(labels)]
+    return vectors, texts, metadatas
+
+
+def session_corpus(session_id):
+    """
+    Read the stored vectors of a processed session, without calling the API.
+
+    Args:
+        session_id (str): Unique session identifier
+
+    Returns:
+        tuple: (vectors, texts, metadatas)
+    """
+    vectorstore = load_existing_vectorstore(session_id, priority=PRIORITY_BACKGROUND)
+    if vectorstore is None:
+        raise ValueError(f"No vector store found for session {session_id}")
+    stored = vectorstore.get(include=["embeddings", "documents", "metadatas"])
+    return np.asarray(stored["embeddings"], dtype=np.float32), stored["documents"], stored["metadatas"]
+
+
+def make_queries(vectors, count, seed=1):
+    # Perturbed chunk vectors stand in for questions about those chunks
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.choice(len(vectors), size=min(count, len(vectors)), replace=False)]
+    queries = picked + rng.normal(scale=0.3 / np.sqrt(vectors.shape[1]), size=picked.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_neighbours(vectors, queries, k):
+    neighbours = []
+    for query in queries:
+        distances = np.square(vectors - query).sum(axis=1)
+        neighbours.append(set(np.argsort(distances)[:k].tolist()))
+    return neighbours
+
+
+def build_chroma(root, vectors, texts, metadatas, batch_size=1000):
+    store = Chroma(collection_name="medical_documents", persist_directory=os.path.join(root, "chroma"))
+    for start in range(0, len(texts), batch_size):
+        end = start + batch_size
+        store._collection.add(
+            ids=[str(i) for i in range(start, min(end, len(texts)))],
+            embeddings=vectors[start:end].tolist(),
+            documents=texts[start:end],
+            metadatas=metadatas[start:end]
+        )
+    return store
+
+
+def build_quantized(vectors, texts, metadatas, dimensions, reduction, rescore_factor):
+    store = QuantizedVectorStore("quantized", None, dimensions, reduction, rescore_factor)
+    store.add_embeddings(texts, vectors, metadatas, ids=[str(i) for i in range(len(texts))])
+    store.persist()
+    return store
+
+
+def measure(name, open_store, queries, truth, k):
+    """
+    Load a layout from disk and time its searches.
+
+    Returns:
+        dict: Load time, latency percentiles and recall@k
+    """
+    started = time.perf_counter()
+    store = open_store()
+    # The first search includes reading the index into memory
+    store.similarity_search_by_vector_with_relevance_scores(queries[0].tolist(), k=k)
+    load_time = time.perf_counter() - started
+
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        results = store.similarity_search_by_vector_with_relevance_scores(query.tolist(), k=k)
+        latencies.append(time.perf_counter() - started)
+        hits += len(expected & {int(doc.metadata["row"]) for doc, _ in results})
+
+    return {
+        "layout": name,
+        "load_seconds": load_time,
+        "p50_ms": np.percentile(latencies, 50) * 1000,
+        "p95_ms": np.percentile(latencies, 95) * 1000,
+        "recall": hits / (len(truth) * k),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Chroma and quantized vector storage")
+    parser.add_argument("--session", help="Benchmark the vectors of a processed session")
+    parser.add_argument("--chunks", type=int, default=20000, help="Synthetic corpus size")
+    parser.add_argument("--dimensions", type=int, default=1536, help="Synthetic embedding dimensions")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--reduced-dimensions", type=int, default=QUANTIZED_DIMENSIONS)
+    parser.add_argument("--reduction", choices=["pca", "truncate"], default=QUANTIZED_REDUCTION)
+    parser.add_argument("--rescore-factor", type=int, default=RESCORE_FACTOR)
+    args = parser.parse_args()
+
+    if args.session:
+        vectors, texts, metadatas = session_corpus(args.session)
+    else:
+        vectors, texts, metadatas = synthetic_corpus(args.chunks, args.dimensions)
+    # Row numbers identify results in both layouts
+    metadatas = [dict(metadata, row=i) for i, metadata in enumerate(metadatas)]
+    print(f"Corpus: {len(texts)} chunks of {vectors.shape[1]} dimensions")
+
+    queries = make_queries(vectors, args.queries)
+    truth = exact_neighbours(vectors, queries, args.k)
+
+    workdir = os.getcwd()
+    root = tempfile.mkdtemp(prefix="medstudy_storage_benchmark_")
+    os.chdir(root)
+    os.makedirs("chroma_db")
+    try:
+        print("Building Chroma collection...")
+        build_chroma(os.path.join(root, "chroma_db"), vectors, texts, metadatas)
+        print("Building quantized collection...")
+        build_quantized(vectors, texts, metadatas, args.reduced_dimensions, args.reduction, args.rescore_factor)
+
+        # Open each layout fresh, as a new process would
+        from chromadb.api.client import SharedSystemClient
+        SharedSystemClient.clear_system_cache()
+
+        results = [
+            measure("chroma", lambda: Chroma(
+                collection_name="medical_documents", persist_directory=os.path.join(root, "chroma_db", "chroma")
+            ), queries, truth, args.k),
+            measure("quantized", lambda: QuantizedVectorStore(
+                "quantized", None, rescore_factor=args.rescore_factor
+            ), queries, truth, args.k),
+        ]
+        results[0]["size"] = get_collection_size("chroma")
+        results[1]["size"] = get_collection_size("quantized")
+        index_size = os.path.getsize(os.path.join("chroma_db", "quantized", "quantized_index.npz"))
+    finally:
+        os.chdir(workdir)
+        shutil.rmtree(root, ignore_errors=True)
+
+    print()
+    print(f"{'layout':<10} {'size':>10} {'load':>8} {'p50':>9} {'p95':>9} {'recall@' + str(args.k):>9}")
+    for result in results:
+        print(
+            f"{result['layout']:<10} {format_size(result['size']):>10} {result['load_seconds']:>7.2f}s "
+            f"{result['p50_ms']:>7.2f}ms {result['p95_ms']:>7.2f}ms {result['recall']:>9.3f}"
+        )
+    print(f"Quantized search index: {format_size(index_size)} "
+          f"(full vectors are memory-mapped and only read for re-scoring)")
+
+
+if __name__ == "__main__":
+    main()
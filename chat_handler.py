@@ -1,8 +1,51 @@
+import os
+import json
+import queue
+import threading
 import streamlit as st
 from langchain_openai import ChatOpenAI
 from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain.callbacks.base import BaseCallbackHandler
 from langchain.memory import ConversationBufferMemory
-from embedding_manager import load_existing_vectorstore
+from langchain.prompts import ChatPromptTemplate
+from embedding_manager import load_existing_vectorstore, build_search_filter
+from request_coalescer import coalescer, normalize_question
+from scheduler import get_scheduler, PRIORITY_INTERACTIVE
+from query_cache import retrieval_cache, answer_cache, cache_key
+from context_packer import count_tokens, pack_context
+from summary_index import route_query, retrieve_summaries, LEVEL_DOCUMENT, LEVEL_SECTION
+
+# Tokens reserved for the generated answer when admitting an LLM call
+ANSWER_TOKEN_ESTIMATE = 500
+
+# Token budget for retrieved context in each answer prompt
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("MEDSTUDY_CONTEXT_TOKENS", 1500))
+
+# Keep only the query-relevant sentences of each retrieved chunk
+EXTRACT_RELEVANT_SENTENCES = os.environ.get("MEDSTUDY_EXTRACT_SENTENCES", "0") == "1"
+
+MEDICAL_SYSTEM_PROMPT = """
+You are MedStudy Assistant, a helpful AI tutor specialized in medical education. 
+You're here to help medical students understand complex concepts, explain medical 
+terminology clearly, and provide accurate information based on their uploaded materials.
+
+When answering questions:
+1. Respond in a friendly, supportive tone like a knowledgeable peer or tutor
+2. Use clear, concise explanations with medical accuracy
+3. Include relevant anatomical or physiological details when appropriate
+4. Structure complex answers with bullet points or numbered lists when helpful
+5. Only provide information from the retrieved context - don't make up information
+6. If you don't know the answer or can't find it in the context, be honest and suggest alternatives
+
+The retrieved context below contains information from the student's own lecture notes and textbooks.
+Use this information to provide personalized, accurate responses.
+"""
+
+QA_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", MEDICAL_SYSTEM_PROMPT + "\n----------------\n{context}"),
+    ("human", "{question}")
+])
 
 def get_llm():
     """
@@ -16,24 +59,26 @@ def get_llm():
     return ChatOpenAI(
         model="gpt-4o",
         temperature=0.3,
+        streaming=True,
         verbose=True
     )
 
-def get_conversation_chain(session_id):
+def get_conversation_chain(session_id, priority=PRIORITY_INTERACTIVE):
     """
     Create a conversational chain with retrieval capabilities.
     
     Args:
         session_id (str): Unique session identifier
+        priority (int): Scheduler priority for query embeddings
         
     Returns:
         ConversationalRetrievalChain: Configured conversation chain
     """
     try:
         # Load vector store
-        vectorstore = load_existing_vectorstore(session_id)
+        vectorstore = load_existing_vectorstore(session_id, priority=priority)
         
-        if not vectorstore:
+        if vectorstore is None:
             st.error("No vector store found. Please process documents first.")
             return None
         
@@ -52,34 +97,284 @@ def get_conversation_chain(session_id):
             search_type="similarity"
         )
         
-        # Create conversation chain
+        # Create conversation chain with the medical context system prompt
         chain = ConversationalRetrievalChain.from_llm(
             llm=llm,
             retriever=retriever,
             memory=memory,
             verbose=True,
-            return_source_documents=False
+            return_source_documents=False,
+            combine_docs_chain_kwargs={"prompt": QA_PROMPT}
         )
         
-        # Add medical context system prompt
-        chain.combine_docs_chain.llm_chain.prompt.messages[0].content = """
-        You are MedStudy Assistant, a helpful AI tutor specialized in medical education. 
-        You're here to help medical students understand complex concepts, explain medical 
-        terminology clearly, and provide accurate information based on their uploaded materials.
-        
-        When answering questions:
-        1. Respond in a friendly, supportive tone like a knowledgeable peer or tutor
-        2. Use clear, concise explanations with medical accuracy
-        3. Include relevant anatomical or physiological details when appropriate
-        4. Structure complex answers with bullet points or numbered lists when helpful
-        5. Only provide information from the retrieved context - don't make up information
-        6. If you don't know the answer or can't find it in the context, be honest and suggest alternatives
-        
-        The retrieved context below contains information from the student's own lecture notes and textbooks.
-        Use this information to provide personalized, accurate responses.
-        """
-        
         return chain
     except Exception as e:
         st.error(f"Error creating conversation chain: {str(e)}")
         return None
+
+class _TokenQueueHandler(BaseCallbackHandler):
+    """
+    Callback handler that forwards streamed LLM tokens to a queue.
+    """
+
+    def __init__(self, token_queue):
+        self.token_queue = token_queue
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.token_queue.put(token)
+
+def get_standalone_question(chain, question, session_id="default", user_id=None):
+    """
+    Condense a follow-up question and the chat history into a standalone question.
+    
+    Args:
+        chain (ConversationalRetrievalChain): Conversation chain
+        question (str): Question asked by the user
+        session_id (str): Session the question is asked in
+        user_id (str): User the model call is scheduled for, defaults to session_id
+        
+    Returns:
+        str: Standalone question, or the question itself on the first turn
+    """
+    chat_history = chain.memory.load_memory_variables({})[chain.memory.memory_key]
+    get_chat_history = chain.get_chat_history or _get_chat_history
+    chat_history_str = get_chat_history(chat_history)
+    
+    if not chat_history_str:
+        return question
+    
+    tokens = count_tokens(chat_history_str + question) + ANSWER_TOKEN_ESTIMATE
+    with get_scheduler().slot(tokens, PRIORITY_INTERACTIVE, user_id or session_id):
+        return chain.question_generator.invoke(
+            {"question": question, "chat_history": chat_history_str}
+        )[chain.question_generator.output_key]
+
+def set_retrieval_scope(chain, documents=None, page_range=None, sections=None):
+    """
+    Restrict a conversation chain's retrieval to documents, pages or sections.
+    
+    Args:
+        chain (ConversationalRetrievalChain): Conversation chain
+        documents (list): Document names to search, or None for all
+        page_range (tuple): (first_page, last_page) to search, or None for all
+        sections (list): Section headings to search, or None for all
+    """
+    search_filter = build_search_filter(documents, page_range, sections)
+    if search_filter is None:
+        chain.retriever.search_kwargs.pop("filter", None)
+    else:
+        chain.retriever.search_kwargs["filter"] = search_filter
+
+def _coalescing_key(kind, session_id, standalone_question, chain, priority):
+    # Sessions sharing a collection directory and retrieval scope share in-flight
+    # work. Priorities are kept apart, so a student never waits on background
+    # work such as a warm-up that only runs when chat is idle
+    scope = json.dumps(chain.retriever.search_kwargs.get("filter"), sort_keys=True)
+    return (kind, session_id, scope, normalize_question(standalone_question), priority)
+
+def _cache_key(chain, standalone_question, session_id):
+    return cache_key(session_id, chain.retriever.search_kwargs.get("filter"), standalone_question)
+
+def retrieve_documents(chain, standalone_question, session_id, priority=PRIORITY_INTERACTIVE):
+    """
+    Retrieve context for a standalone question, reusing cached results and
+    sharing the search with identical in-flight retrievals.
+    
+    Args:
+        chain (ConversationalRetrievalChain): Conversation chain for the session
+        standalone_question (str): Standalone question to search for
+        session_id (str): Session whose collection is searched
+        priority (int): Scheduler priority the chain's embeddings were opened with
+        
+    Returns:
+        list: Retrieved Document objects
+    """
+    key = _cache_key(chain, standalone_question, session_id)
+    docs = retrieval_cache.get(key)
+    if docs is None:
+        docs = coalescer.do(
+            _coalescing_key("retrieve", session_id, standalone_question, chain, priority),
+            lambda: _route_retrieval(chain, standalone_question, session_id, priority)
+        )
+        retrieval_cache.put(key, docs)
+    return docs
+
+def _route_retrieval(chain, standalone_question, session_id, priority):
+    """
+    Answer whole-document questions from the summary layer, and add section
+    summaries to the chunks retrieved for other broad questions.
+    """
+    level = route_query(standalone_question)
+    search_filter = chain.retriever.search_kwargs.get("filter")
+    if level == LEVEL_DOCUMENT:
+        summaries = retrieve_summaries(
+            session_id, standalone_question, level, search_filter=search_filter, priority=priority
+        )
+        if summaries:
+            return summaries
+    
+    # Chunks are also the fallback when the collection has no summaries yet
+    docs = chain.retriever.invoke(standalone_question)
+    if level == LEVEL_SECTION:
+        docs = docs + retrieve_summaries(
+            session_id, standalone_question, level, search_filter=search_filter, k=2, priority=priority
+        )
+    return docs
+
+def _generate_answer(chain, standalone_question, session_id, callbacks=None, priority=PRIORITY_INTERACTIVE,
+                     user_id=None):
+    """
+    Retrieve context for a standalone question and generate the answer.
+    """
+    # Keyed before retrieval, so an answer racing an ingestion is not
+    # cached as current
+    key = _cache_key(chain, standalone_question, session_id)
+    docs = pack_context(
+        retrieve_documents(chain, standalone_question, session_id, priority),
+        standalone_question,
+        max_tokens=CONTEXT_TOKEN_BUDGET,
+        extract_sentences=EXTRACT_RELEVANT_SENTENCES
+    )
+    
+    context = "".join(doc.page_content for doc in docs)
+    tokens = count_tokens(MEDICAL_SYSTEM_PROMPT + context + standalone_question) + ANSWER_TOKEN_ESTIMATE
+    with get_scheduler().slot(tokens, priority, user_id or session_id):
+        answer = chain.combine_docs_chain.invoke(
+            {"input_documents": docs, "question": standalone_question},
+            config={"callbacks": callbacks}
+        )[chain.combine_docs_chain.output_key]
+    
+    if answer:
+        answer_cache.put(key, answer)
+    return answer
+
+def answer_standalone_question(chain, standalone_question, session_id, priority=PRIORITY_INTERACTIVE, user_id=None):
+    """
+    Answer a standalone question without touching the conversation memory,
+    reusing a cached answer and sharing the work with identical in-flight
+    questions.
+    
+    Args:
+        chain (ConversationalRetrievalChain): Conversation chain for the session
+        standalone_question (str): Standalone question
+        session_id (str): Session whose collection is searched
+        priority (int): Scheduler priority for the model call
+        user_id (str): User the model call is scheduled for, defaults to session_id
+        
+    Returns:
+        str: Generated answer
+    """
+    answer = answer_cache.get(_cache_key(chain, standalone_question, session_id))
+    if answer is not None:
+        return answer
+    return coalescer.do(
+        _coalescing_key("answer", session_id, standalone_question, chain, priority),
+        lambda: _generate_answer(chain, standalone_question, session_id, priority=priority, user_id=user_id)
+    )
+
+def _stream_answer_tokens(chain, standalone_question, session_id, user_id=None):
+    """
+    Generate the answer in a worker thread and yield its tokens as they arrive.
+    """
+    token_queue = queue.Queue()
+    done = object()
+    results = []
+    errors = []
+    
+    def run():
+        try:
+            results.append(_generate_answer(
+                chain,
+                standalone_question,
+                session_id,
+                callbacks=[_TokenQueueHandler(token_queue)],
+                user_id=user_id
+            ))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            token_queue.put(done)
+    
+    threading.Thread(target=run, daemon=True).start()
+    
+    streamed = False
+    while True:
+        token = token_queue.get()
+        if token is done:
+            break
+        streamed = True
+        yield token
+    
+    if errors:
+        raise errors[0]
+    if not streamed and results:
+        # Models that don't stream only report the finished answer
+        yield results[0]
+
+def ask_question(chain, question, session_id, user_id=None):
+    """
+    Answer a question, reusing a cached answer and sharing the work with
+    identical in-flight questions.
+    
+    Args:
+        chain (ConversationalRetrievalChain): Conversation chain for the session
+        question (str): Question asked by the user
+        session_id (str): Session whose collection is searched
+        user_id (str): User the model calls are scheduled for, e.g. the
+            browser session or conversation; defaults to session_id
+        
+    Returns:
+        str: Generated answer
+    """
+    standalone_question = get_standalone_question(chain, question, session_id, user_id)
+    answer = answer_standalone_question(chain, standalone_question, session_id, user_id=user_id)
+    chain.memory.save_context({"question": question}, {"answer": answer})
+    return answer
+
+def stream_answer(chain, question, session_id, user_id=None):
+    """
+    Stream the answer to a question, sharing the token stream with identical
+    in-flight questions.
+    
+    Args:
+        chain (ConversationalRetrievalChain): Conversation chain for the session
+        question (str): Question asked by the user
+        session_id (str): Session whose collection is searched
+        user_id (str): User the model calls are scheduled for, e.g. the
+            browser session or conversation; defaults to session_id
+        
+    Yields:
+        str: Answer tokens
+    """
+    standalone_question = get_standalone_question(chain, question, session_id, user_id)
+    
+    # Warmed-up and repeated questions are answered from the cache at once
+    cached = answer_cache.get(_cache_key(chain, standalone_question, session_id))
+    if cached is not None:
+        yield cached
+        chain.memory.save_context({"question": question}, {"answer": cached})
+        return
+    
+    tokens = []
+    for token in coalescer.stream(
+        _coalescing_key("answer", session_id, standalone_question, chain, PRIORITY_INTERACTIVE),
+        lambda: _stream_answer_tokens(chain, standalone_question, session_id, user_id)
+    ):
+        tokens.append(token)
+        yield token
+    chain.memory.save_context({"question": question}, {"answer": "".join(tokens)})
+
+def restore_chat_history(chain, messages):
+    """
+    Load previously stored chat history into a conversation chain's memory.
+    
+    Args:
+        chain (ConversationalRetrievalChain): Conversation chain
+        messages (list): Message dicts with "role" and "content"
+    """
+    chat_memory = chain.memory.chat_memory
+    for message in messages:
+        if message["role"] == "user":
+            chat_memory.add_user_message(message["content"])
+        else:
+            chat_memory.add_ai_message(message["content"])
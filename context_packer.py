@@ -0,0 +1,216 @@
+import re
+from functools import lru_cache
+import tiktoken
+from langchain.schema.document import Document
+from scheduler import estimate_tokens
+
+# Shortest shared text treated as chunk overlap rather than coincidence
+MIN_OVERLAP_CHARS = 20
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "explain",
+    "for", "from", "how", "in", "is", "it", "of", "on", "or", "the", "to", "what",
+    "when", "which", "who", "why", "with"
+}
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # tiktoken downloads its encodings on first use; without network
+        # access (or a TIKTOKEN_CACHE_DIR) counts fall back to an estimate
+        return None
+
+
+def count_tokens(text, model="gpt-4o"):
+    """
+    Count the tokens a text uses for a model.
+
+    Args:
+        text (str): Text to count
+        model (str): Model whose tokenizer is used
+
+    Returns:
+        int: Number of tokens, estimated if the tokenizer is unavailable
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text))
+
+
+def truncate_to_tokens(text, max_tokens, model="gpt-4o"):
+    """
+    Cut a text down to at most max_tokens tokens.
+
+    Args:
+        text (str): Text to truncate
+        max_tokens (int): Token limit
+        model (str): Model whose tokenizer is used
+
+    Returns:
+        str: Truncated text
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        # Inverse of estimate_tokens
+        return text if estimate_tokens(text) <= max_tokens else text[:max(max_tokens - 1, 0) * 4]
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def trim_overlap(previous, text):
+    """
+    Remove the start of text that repeats the end of previous.
+
+    Chunks are split with an overlap, so neighbouring chunks share up to
+    chunk_overlap characters.
+
+    Args:
+        previous (str): Text that comes first
+        text (str): Text that may start with the end of previous
+
+    Returns:
+        str: text without the repeated part
+    """
+    longest = min(len(previous), len(text))
+    for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(text[:size]):
+            return text[size:]
+    return text
+
+
+def merge_adjacent_chunks(docs):
+    """
+    Merge retrieved chunks that are neighbours in the same source document.
+
+    Merged chunks take the rank of their best-ranked member, and the text
+    repeated by the chunk overlap is kept only once.
+
+    Args:
+        docs (list): Retrieved Document objects, best match first
+
+    Returns:
+        list: Merged Document objects, best match first
+    """
+    # Best rank of each chunk per source; chunks without an id stand alone
+    groups = []
+    chunks_by_source = {}
+    for rank, doc in enumerate(docs):
+        chunk = doc.metadata.get("chunk")
+        if chunk is None:
+            groups.append((rank, [doc]))
+            continue
+        chunks_by_source.setdefault(doc.metadata.get("source"), {}).setdefault(chunk, (rank, doc))
+
+    # Split each source's chunks into contiguous runs, whatever order they
+    # were retrieved in
+    for chunks in chunks_by_source.values():
+        runs = []
+        for chunk in sorted(chunks):
+            if runs and chunk == runs[-1][-1] + 1:
+                runs[-1].append(chunk)
+            else:
+                runs.append([chunk])
+        for run in runs:
+            groups.append((min(chunks[chunk][0] for chunk in run), [chunks[chunk][1] for chunk in run]))
+
+    merged = []
+    for rank, members in sorted(groups, key=lambda group: group[0]):
+        content = members[0].page_content
+        for member in members[1:]:
+            content += trim_overlap(content, member.page_content)
+
+        metadata = dict(members[0].metadata)
+        if len(members) > 1:
+            metadata["chunk_end"] = members[-1].metadata.get("chunk")
+        merged.append(Document(page_content=content, metadata=metadata))
+
+    return merged
+
+
+def _terms(text):
+    return {word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS}
+
+
+def extract_relevant_sentences(text, question, max_sentences=6):
+    """
+    Keep only the sentences of a text that share terms with the question.
+
+    Args:
+        text (str): Chunk text
+        question (str): Question the context is for
+        max_sentences (int): Maximum number of sentences to keep
+
+    Returns:
+        str: Relevant sentences in their original order, or the text itself
+            if no sentence matches
+    """
+    query_terms = _terms(question)
+    sentences = [sentence.strip() for sentence in _SENTENCE_SPLIT.split(text) if sentence.strip()]
+    scored = [
+        (len(query_terms & _terms(sentence)), position)
+        for position, sentence in enumerate(sentences)
+    ]
+    best = sorted((item for item in scored if item[0] > 0), key=lambda item: (-item[0], item[1]))
+    if not best:
+        return text
+
+    keep = sorted(position for _, position in best[:max_sentences])
+    return " ".join(sentences[position] for position in keep)
+
+
+def pack_context(docs, question, max_tokens=1500, extract_sentences=False, model="gpt-4o"):
+    """
+    Pack retrieved chunks into a token budget for the prompt.
+
+    Chunks are merged with their neighbours, duplicates are dropped, and
+    chunks are added best match first until the budget is used up. The last
+    chunk that does not fit is cut to the remaining budget.
+
+    Args:
+        docs (list): Retrieved Document objects, best match first
+        question (str): Question the context is for
+        max_tokens (int): Token budget for all chunks together
+        extract_sentences (bool): Keep only query-relevant sentences of each chunk
+        model (str): Model whose tokenizer is used
+
+    Returns:
+        list: Document objects that fit within the budget
+    """
+    packed = []
+    used = 0
+    contents = []
+
+    for doc in merge_adjacent_chunks(docs):
+        content = doc.page_content
+        if extract_sentences:
+            content = extract_relevant_sentences(content, question)
+
+        # Skip chunks already contained in packed context
+        if any(content in existing for existing in contents):
+            continue
+
+        remaining = max_tokens - used
+        if remaining <= 0:
+            break
+
+        tokens = count_tokens(content, model)
+        if tokens > remaining:
+            content = truncate_to_tokens(content, remaining, model)
+            tokens = remaining
+
+        contents.append(content)
+        packed.append(Document(page_content=content, metadata=doc.metadata))
+        used += tokens
+
+    return packed
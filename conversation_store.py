@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ConversationStore:
+    """
+    Interface for storing chat history outside the serving process.
+
+    Messages are dicts with "role" ("user" or "assistant") and "content",
+    the same format as the chat history kept by the Streamlit app.
+    """
+
+    def get_messages(self, conversation_id):
+        """
+        Get all messages of a conversation in order.
+
+        Args:
+            conversation_id (str): Conversation identifier
+
+        Returns:
+            list: Message dicts, empty if the conversation does not exist
+        """
+        raise NotImplementedError
+
+    def append_messages(self, conversation_id, messages):
+        """
+        Append messages to a conversation.
+
+        Args:
+            conversation_id (str): Conversation identifier
+            messages (list): Message dicts to append
+        """
+        raise NotImplementedError
+
+    def clear(self, conversation_id):
+        """
+        Delete all messages of a conversation.
+
+        Args:
+            conversation_id (str): Conversation identifier
+        """
+        raise NotImplementedError
+
+
+class InMemoryConversationStore(ConversationStore):
+    """
+    Conversation store kept in process memory, for a single worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conversations = {}
+
+    def get_messages(self, conversation_id):
+        with self._lock:
+            return [dict(message) for message in self._conversations.get(conversation_id, [])]
+
+    def append_messages(self, conversation_id, messages):
+        with self._lock:
+            self._conversations.setdefault(conversation_id, []).extend(
+                {"role": message["role"], "content": message["content"]} for message in messages
+            )
+
+    def clear(self, conversation_id):
+        with self._lock:
+            self._conversations.pop(conversation_id, None)
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    Conversation store backed by a SQLite file shared by all worker processes
+    on a host.
+    """
+
+    def __init__(self, path="conversations.db"):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    conversation_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_id, id)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # A connection per call keeps the store safe to use from any thread
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_messages(self, conversation_id):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY id",
+                (conversation_id,)
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def append_messages(self, conversation_id, messages):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO messages (conversation_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                [(conversation_id, message["role"], message["content"], now) for message in messages]
+            )
+
+    def clear(self, conversation_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+
+
+def get_conversation_store():
+    """
+    Create the conversation store configured for this deployment.
+
+    MEDSTUDY_CONVERSATION_STORE selects the backend: "memory" for an
+    in-process store, or "sqlite" (the default) with the database path in
+    MEDSTUDY_CONVERSATION_DB.
+
+    Returns:
+        ConversationStore: Configured conversation store
+    """
+    backend = os.environ.get("MEDSTUDY_CONVERSATION_STORE", "sqlite")
+    if backend == "memory":
+        return InMemoryConversationStore()
+    if backend == "sqlite":
+        return SQLiteConversationStore(os.environ.get("MEDSTUDY_CONVERSATION_DB", "conversations.db"))
+    raise ValueError(f"Unknown conversation store: {backend}")
@@ -2,10 +2,11 @@ import os
 import sys
 import numpy as np
 import streamlit as st
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain.schema.document import Document
-from document_processor import extract_text_from_pdf, split_text_into_chunks
+from document_processor import extract_pages_from_pdf
+from embedding_backends import get_backend
+from embedding_manager import get_embeddings, build_chunk_documents, open_document_store
+from scheduler import PRIORITY_BACKGROUND
+from query_cache import invalidate_session
 from utils import check_api_key, ensure_directories
 from chat_handler import get_conversation_chain
 
@@ -19,8 +20,8 @@ def direct_load():
     # Ensure directories exist
     ensure_directories()
     
-    # Check if OpenAI API key is available
-    if not check_api_key():
+    # Check if OpenAI API key is available; local embeddings need none
+    if get_backend().remote and not check_api_key():
         print("Error: OpenAI API key is not available")
         return False
     
@@ -37,7 +38,7 @@ def direct_load():
     try:
         # Initialize embeddings
         print("Initializing embeddings...")
-        embeddings = OpenAIEmbeddings()
+        embeddings = get_embeddings(PRIORITY_BACKGROUND, session_id)
         
         # Create directory for vectorstore
         print(f"Creating directory: chroma_db/{session_id}")
@@ -45,38 +46,25 @@ def direct_load():
         
         # Initialize vector store
         print("Initializing vector store...")
-        vectorstore = Chroma(
-            collection_name="medical_documents",
-            embedding_function=embeddings,
-            persist_directory=f"chroma_db/{session_id}"
-        )
+        vectorstore = open_document_store(session_id, embeddings, create=True)
         
         # Process each PDF
         all_documents = []
         for i, pdf_file in enumerate(pdf_files):
             pdf_path = os.path.join(pdf_dir, pdf_file)
             print(f"Extracting text from {pdf_file}...")
-            text = extract_text_from_pdf(pdf_path)
+            pages = extract_pages_from_pdf(pdf_path)
             
-            if not text:
+            if not any(pages):
                 print(f"Failed to extract text from {pdf_file}")
                 continue
                 
-            print(f"Successfully extracted {len(text)} characters from {pdf_file}")
+            print(f"Successfully extracted {sum(len(page) for page in pages)} characters from {pdf_file}")
             
-            # Split text into chunks
+            # Split text into chunks with source, page and section metadata
             print(f"Splitting text into chunks...")
-            chunks = split_text_into_chunks(text)
-            print(f"Created {len(chunks)} chunks")
-            
-            # Create Document objects
-            documents = [
-                Document(
-                    page_content=chunk,
-                    metadata={"source": pdf_file, "chunk": j}
-                )
-                for j, chunk in enumerate(chunks)
-            ]
+            documents = build_chunk_documents(pages, pdf_file)
+            print(f"Created {len(documents)} chunks")
             
             all_documents.extend(documents)
         
@@ -93,6 +81,7 @@ def direct_load():
         # Persist the vector store
         print("Persisting vector store...")
         vectorstore.persist()
+        invalidate_session(session_id)
         
         # Save the session ID
         with open("session_id.txt", "w") as f:
@@ -1,4 +1,6 @@
 import os
+import re
+from bisect import bisect_right
 import streamlit as st
 from PyPDF2 import PdfReader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -26,6 +28,174 @@ def extract_text_from_pdf(pdf_path):
         st.error(f"Error extracting text from PDF: {str(e)}")
         return ""
 
+def extract_pages_from_pdf(pdf_path):
+    """
+    Extract the text of each page of a PDF file.
+    
+    Args:
+        pdf_path (str): Path to the PDF file
+        
+    Returns:
+        list: Text of each page, in page order
+    """
+    try:
+        pdf_reader = PdfReader(pdf_path)
+        return [page.extract_text() or "" for page in pdf_reader.pages]
+    except Exception as e:
+        st.error(f"Error extracting text from PDF: {str(e)}")
+        return []
+
+# Numbered headings: dotted numbering ("2.3 Cardiac Output"), a number with
+# a dot ("3. Heart Failure") or a chapter/section number ("Chapter 3")
+_DOTTED_HEADING = re.compile(r"^\d+(\.\d+)+\.?\s+(?P<title>.+)$")
+_DOT_HEADING = re.compile(r"^\d+\.\s+(?P<title>.+)$")
+_CHAPTER_HEADING = re.compile(r"^(chapter|section|part)\s+\d+(\.\d+)*[.:]?(\s+(?P<title>.+))?$", re.IGNORECASE)
+
+# Words that may stay lower-case in a title ("Drugs for Heart Failure")
+_TITLE_SMALL_WORDS = {
+    "a", "an", "and", "as", "at", "by", "for", "from", "in", "into", "of", "on",
+    "or", "the", "to", "versus", "vs", "with", "without"
+}
+
+# Dosing and measurement units, which mark a numbered line as text ("2.5 mg")
+_UNITS = {
+    "mg", "mcg", "µg", "ug", "g", "kg", "ml", "l", "dl", "mmol", "mol", "mmhg",
+    "iu", "unit", "units", "meq", "cm", "mm", "bpm", "%", "day", "days", "hour",
+    "hours", "week", "weeks", "month", "months", "year", "years"
+}
+
+# Longest title a numbered heading can have, in words
+MAX_HEADING_WORDS = 10
+
+def _title_words(title):
+    words = title.split()
+    if not words or len(words) > MAX_HEADING_WORDS:
+        return None
+    if any(word.strip("()[],:;").lower() in _UNITS or "/" in word for word in words):
+        return None
+    return words
+
+def _starts_upper(word):
+    letters = [char for char in word if char.isalpha()]
+    return bool(letters) and letters[0].isupper()
+
+def _is_title(title, title_case=False):
+    """
+    Check whether the text after a heading number reads like a short title.
+    
+    Args:
+        title (str): Text following the number
+        title_case (bool): Require every word except small words to be
+            capitalised, not just the first
+        
+    Returns:
+        bool: True if the text is a plausible heading title
+    """
+    words = _title_words(title)
+    if words is None or not _starts_upper(words[0]):
+        return False
+    if not title_case:
+        return True
+    # Lower-case continuation text ("3. patients developed ...") is prose
+    return all(
+        _starts_upper(word) or word.lower() in _TITLE_SMALL_WORDS or not word[0].isalpha()
+        for word in words[1:]
+    )
+
+def detect_section_heading(line):
+    """
+    Check whether a line looks like a section heading.
+    
+    Numbered lines only count when the number is followed by a short,
+    capitalised title, so dosing lines ("120 mg twice daily") and sentences
+    starting with a number ("3 patients developed ...") are not headings.
+    
+    Args:
+        line (str): A single line of text
+        
+    Returns:
+        str: The heading text, or None if the line is not a heading
+    """
+    line = line.strip()
+    if not line or len(line) > 80 or line.endswith((".", ",", ";")):
+        return None
+    
+    match = _DOTTED_HEADING.match(line)
+    if match:
+        return line if _is_title(match.group("title")) else None
+    
+    match = _DOT_HEADING.match(line)
+    if match:
+        return line if _is_title(match.group("title"), title_case=True) else None
+    
+    match = _CHAPTER_HEADING.match(line)
+    if match:
+        title = match.group("title")
+        return line if title is None or _is_title(title) else None
+    
+    # Short all-caps lines ("PHARMACOLOGY")
+    letters = [char for char in line if char.isalpha()]
+    if len(letters) >= 4 and all(char.isupper() for char in letters):
+        return line
+    
+    return None
+
+def split_pages_into_chunks(pages, chunk_size=1000, chunk_overlap=100):
+    """
+    Split a document's pages into chunks, keeping track of where each chunk
+    came from.
+    
+    Args:
+        pages (list): Text of each page
+        chunk_size (int): Size of each chunk
+        chunk_overlap (int): Overlap between chunks
+        
+    Returns:
+        list: Dicts with the chunk "text", "page_start" and "page_end"
+            (1-based) and the "section" heading it falls under ("" if none)
+    """
+    # Join pages on line breaks so headings at the top of a page are found
+    text = ""
+    page_offsets = []
+    for page_text in pages:
+        page_offsets.append(len(text))
+        text += page_text + "\n"
+    
+    headings = []
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        heading = detect_section_heading(line)
+        if heading:
+            headings.append((offset, heading))
+        offset += len(line)
+    heading_offsets = [heading_offset for heading_offset, _ in headings]
+    
+    try:
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=["\n\n", "\n", ". ", " ", ""],
+            add_start_index=True
+        )
+        split_documents = text_splitter.create_documents([text])
+    except Exception as e:
+        st.error(f"Error splitting text: {str(e)}")
+        return []
+    
+    chunks = []
+    for doc in split_documents:
+        start = doc.metadata["start_index"]
+        end = start + max(len(doc.page_content) - 1, 0)
+        heading_index = bisect_right(heading_offsets, start) - 1
+        chunks.append({
+            "text": doc.page_content,
+            "page_start": bisect_right(page_offsets, start),
+            "page_end": bisect_right(page_offsets, end),
+            "section": headings[heading_index][1] if heading_index >= 0 else ""
+        })
+    
+    return chunks
+
 def split_text_into_chunks(text, chunk_size=1000, chunk_overlap=100):
     """
     Split text into chunks for processing.
@@ -0,0 +1,213 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_openai import OpenAIEmbeddings
+from langchain.schema.embeddings import Embeddings
+
+# Backend used for new collections and for queries
+EMBEDDING_BACKEND = os.environ.get("MEDSTUDY_EMBEDDING_BACKEND", "openai")
+
+# Model names of the two backends
+OPENAI_EMBEDDING_MODEL = os.environ.get("MEDSTUDY_OPENAI_EMBEDDING_MODEL", "text-embedding-ada-002")
+LOCAL_EMBEDDING_MODEL = os.environ.get("MEDSTUDY_LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+
+# Worker threads and texts per batch for local inference
+LOCAL_EMBEDDING_WORKERS = int(os.environ.get("MEDSTUDY_EMBEDDING_WORKERS", min(4, os.cpu_count() or 1)))
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.environ.get("MEDSTUDY_EMBEDDING_BATCH_SIZE", 64))
+
+# Collection metadata keys recording how a collection was embedded
+BACKEND_KEY = "embedding_backend"
+MODEL_KEY = "embedding_model"
+
+
+class EmbeddingBackendMismatch(ValueError):
+    """
+    Raised when a collection was embedded with a different backend or model
+    than the one configured for queries.
+    """
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    CPU embeddings computed in-process with sentence-transformers.
+
+    The model is loaded once per process and shared. Documents are split into
+    batches that are encoded in parallel by a worker pool; each batch is one
+    vectorized forward pass, and torch releases the GIL while it runs.
+    """
+
+    _models = {}
+    _models_lock = threading.Lock()
+    _pool = None
+
+    def __init__(self, model_name=LOCAL_EMBEDDING_MODEL, batch_size=LOCAL_EMBEDDING_BATCH_SIZE,
+                 workers=LOCAL_EMBEDDING_WORKERS):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.workers = workers
+
+    @property
+    def model(self):
+        with LocalEmbeddings._models_lock:
+            if self.model_name not in LocalEmbeddings._models:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ImportError:
+                    raise ImportError(
+                        "The local embedding backend needs sentence-transformers. "
+                        "Install it with: pip install sentence-transformers"
+                    )
+                LocalEmbeddings._models[self.model_name] = SentenceTransformer(self.model_name, device="cpu")
+            if LocalEmbeddings._pool is None:
+                LocalEmbeddings._pool = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="local-embeddings"
+                )
+            return LocalEmbeddings._models[self.model_name]
+
+    def _encode(self, texts):
+        vectors = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        return vectors.tolist()
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        model = self.model
+        if len(texts) <= self.batch_size:
+            return self._encode(texts)
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        vectors = []
+        for batch_vectors in LocalEmbeddings._pool.map(self._encode, batches):
+            vectors.extend(batch_vectors)
+        return vectors
+
+    def embed_query(self, text):
+        return self._encode([text])[0]
+
+
+class EmbeddingBackend:
+    """
+    A source of embeddings and the metadata that identifies its vectors.
+
+    Attributes:
+        name (str): Backend name stored in collection metadata
+        model (str): Model name stored in collection metadata
+        remote (bool): Whether calls go to the OpenAI API and its rate limits
+    """
+
+    name = None
+    remote = False
+
+    def __init__(self, model):
+        self.model = model
+
+    def create(self):
+        """
+        Create the embedding function.
+
+        Returns:
+            Embeddings: Embedding function of this backend
+        """
+        raise NotImplementedError
+
+    def metadata(self):
+        """
+        Returns:
+            dict: Collection metadata recording this backend
+        """
+        return {BACKEND_KEY: self.name, MODEL_KEY: self.model}
+
+
+class OpenAIBackend(EmbeddingBackend):
+    name = "openai"
+    remote = True
+
+    def __init__(self, model=OPENAI_EMBEDDING_MODEL):
+        super().__init__(model)
+
+    def create(self):
+        return OpenAIEmbeddings(model=self.model)
+
+
+class LocalBackend(EmbeddingBackend):
+    name = "local"
+    remote = False
+
+    def __init__(self, model=LOCAL_EMBEDDING_MODEL):
+        super().__init__(model)
+
+    def create(self):
+        return LocalEmbeddings(self.model)
+
+
+BACKENDS = {
+    OpenAIBackend.name: OpenAIBackend,
+    LocalBackend.name: LocalBackend,
+}
+
+
+def get_backend(name=None):
+    """
+    Get an embedding backend.
+
+    Args:
+        name (str): "openai" or "local", defaults to MEDSTUDY_EMBEDDING_BACKEND
+
+    Returns:
+        EmbeddingBackend: The backend
+    """
+    name = name or EMBEDDING_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{name}', expected one of: {', '.join(sorted(BACKENDS))}")
+    return BACKENDS[name]()
+
+
+def check_collection_backend(collection, backend):
+    """
+    Make sure a Chroma collection is queried with the backend that embedded it.
+
+    An empty collection without a recorded backend is stamped with this one.
+    Collections created before backends were recorded hold OpenAI vectors.
+
+    Args:
+        collection (chromadb.Collection): Collection to check
+        backend (EmbeddingBackend): Backend about to be used
+
+    Raises:
+        EmbeddingBackendMismatch: If the collection was embedded differently
+    """
+    metadata = dict(collection.metadata or {})
+    if BACKEND_KEY not in metadata:
+        if collection.count() == 0:
+            metadata.update(backend.metadata())
+            collection.modify(metadata=metadata)
+            return
+        metadata.update(OpenAIBackend().metadata())
+
+    check_backend_metadata(metadata, backend)
+
+
+def check_backend_metadata(metadata, backend):
+    """
+    Compare the backend recorded for stored vectors with the configured one.
+
+    Args:
+        metadata (dict): Recorded BACKEND_KEY and MODEL_KEY
+        backend (EmbeddingBackend): Backend about to be used
+
+    Raises:
+        EmbeddingBackendMismatch: If the vectors were embedded differently
+    """
+    if metadata[BACKEND_KEY] != backend.name or metadata[MODEL_KEY] != backend.model:
+        raise EmbeddingBackendMismatch(
+            f"Documents were embedded with the {metadata[BACKEND_KEY]} backend ({metadata[MODEL_KEY]}), "
+            f"but the {backend.name} backend ({backend.model}) is configured. Set "
+            f"MEDSTUDY_EMBEDDING_BACKEND={metadata[BACKEND_KEY]} or process the documents again."
+        )
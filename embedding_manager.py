@@ -1,12 +1,193 @@
 import os
+import threading
 import uuid
+import chromadb
 import streamlit as st
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain.schema.document import Document
-from document_processor import split_text_into_chunks
+from langchain.schema.embeddings import Embeddings
+from document_processor import split_text_into_chunks, split_pages_into_chunks
+from embedding_backends import get_backend, check_collection_backend
+from sharded_store import ShardedVectorStore, is_sharded, SHARDED_COLLECTIONS
+from quantized_store import QuantizedVectorStore, is_quantized, QUANTIZED_COLLECTIONS
+from storage_maintenance import touch_collection
+from query_cache import embedding_cache, get_generation, invalidate_session
+from scheduler import get_scheduler, estimate_tokens, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
 from utils import check_api_key
 
+DOCUMENT_COLLECTION = "medical_documents"
+
+# Vector stores opened by load_existing_vectorstore, shared by all
+# conversations on a collection: session_id -> {priority: (generation, store)}
+_vectorstores = {}
+_vectorstores_lock = threading.Lock()
+
+# Generation each session's Chroma client was opened at in this process
+_client_generations = {}
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that sends every request through the shared scheduler.
+    
+    Documents are embedded in batches that each wait for their own slot, so
+    interactive queries can be served in between the batches of a large
+    ingestion.
+    """
+    
+    def __init__(self, embeddings, priority=PRIORITY_INTERACTIVE, user_id="default", batch_size=100):
+        self.embeddings = embeddings
+        self.priority = priority
+        self.user_id = user_id
+        self.batch_size = batch_size
+    
+    def embed_documents(self, texts):
+        scheduler = get_scheduler()
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i + self.batch_size]
+            tokens = sum(estimate_tokens(text) for text in batch)
+            with scheduler.slot(tokens, self.priority, self.user_id):
+                vectors.extend(self.embeddings.embed_documents(batch))
+        return vectors
+    
+    def embed_query(self, text):
+        with get_scheduler().slot(estimate_tokens(text), self.priority, self.user_id):
+            return self.embeddings.embed_query(text)
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that remembers query embeddings, so repeated and
+    warmed-up questions are not embedded again.
+    """
+    
+    def __init__(self, embeddings, backend_id):
+        self.embeddings = embeddings
+        self.backend_id = backend_id
+    
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+    
+    def embed_query(self, text):
+        key = (self.backend_id, text)
+        vector = embedding_cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            embedding_cache.put(key, vector)
+        return vector
+
+def get_embeddings(priority=PRIORITY_INTERACTIVE, user_id="default"):
+    """
+    Get the embedding model of the configured backend.
+    
+    OpenAI calls go through the shared scheduler; the local backend runs
+    in-process and is not rate limited.
+    
+    Args:
+        priority (int): PRIORITY_INTERACTIVE for queries, PRIORITY_BACKGROUND for ingestion
+        user_id (str): User the calls are made for
+        
+    Returns:
+        Embeddings: Scheduled OpenAI embeddings or local embeddings, with
+            query embeddings cached
+    """
+    backend = get_backend()
+    embeddings = backend.create()
+    if backend.remote:
+        embeddings = ScheduledEmbeddings(embeddings, priority=priority, user_id=user_id)
+    return CachedQueryEmbeddings(embeddings, (backend.name, backend.model))
+
+def open_collection(session_id, embeddings, collection_name=DOCUMENT_COLLECTION):
+    """
+    Open a collection of a session's vector store, checking that it was
+    embedded with the configured backend.
+    
+    Args:
+        session_id (str): Unique session identifier
+        embeddings (Embeddings): Embedding function from get_embeddings
+        collection_name (str): Chroma collection name
+        
+    Returns:
+        Chroma: Vector store
+        
+    Raises:
+        EmbeddingBackendMismatch: If the collection was embedded with another backend
+    """
+    vectorstore = Chroma(
+        collection_name=collection_name,
+        embedding_function=embeddings,
+        persist_directory=f"chroma_db/{session_id}"
+    )
+    check_collection_backend(vectorstore._collection, get_backend())
+    return vectorstore
+
+def collection_exists(session_id, collection_name):
+    """
+    Check whether a session's Chroma database has a collection, without
+    creating it.
+    
+    Args:
+        session_id (str): Unique session identifier
+        collection_name (str): Chroma collection name
+        
+    Returns:
+        bool: Whether the collection exists
+    """
+    path = f"chroma_db/{session_id}"
+    if not os.path.exists(os.path.join(path, "chroma.sqlite3")):
+        return False
+    # Same settings as Chroma(persist_directory=...), so the client is shared
+    client = chromadb.Client(chromadb.config.Settings(is_persistent=True, persist_directory=path))
+    return any(collection.name == collection_name for collection in client.list_collections())
+
+def open_document_store(session_id, embeddings, create=False):
+    """
+    Open the document collection of a session in whichever layout it uses.
+    
+    Args:
+        session_id (str): Unique session identifier
+        embeddings (Embeddings): Embedding function from get_embeddings
+        create (bool): Whether a new collection may be created; new
+            collections are quantized when MEDSTUDY_QUANTIZED_COLLECTIONS=1,
+            or sharded when MEDSTUDY_SHARDED_COLLECTIONS=1
+        
+    Returns:
+        Chroma, ShardedVectorStore or QuantizedVectorStore: Vector store
+    """
+    path = f"chroma_db/{session_id}"
+    is_new = not os.path.exists(os.path.join(path, "chroma.sqlite3"))
+    if is_quantized(session_id) or (create and is_new and QUANTIZED_COLLECTIONS):
+        return QuantizedVectorStore(session_id, embeddings)
+    if is_sharded(session_id) or (create and is_new and SHARDED_COLLECTIONS):
+        return ShardedVectorStore(session_id, embeddings)
+    return open_collection(session_id, embeddings)
+
+def _close_chroma_client(path, stop=True):
+    from chromadb.api.client import SharedSystemClient
+    system = SharedSystemClient._identifier_to_system.pop(path, None)
+    if system is not None and stop:
+        system.stop()
+
+def refresh_chroma_client(session_id):
+    """
+    Make the next Chroma store opened for a session read its index from disk
+    again if the documents changed since the last one was opened.
+    
+    Chroma keeps one client per directory in each process, and that client
+    keeps searching the index it loaded first, so vectors another worker
+    added would otherwise never be found. The old client is not stopped,
+    because conversations may still hold stores opened with it; they are
+    rebuilt on their next turn.
+    
+    Args:
+        session_id (str): Unique session identifier
+    """
+    generation = get_generation(session_id)
+    with _vectorstores_lock:
+        previous = _client_generations.get(session_id)
+        _client_generations[session_id] = generation
+    if previous is not None and previous != generation:
+        _close_chroma_client(f"chroma_db/{session_id}", stop=False)
+
 def initialize_chroma_db(session_id):
     """
     Initialize a ChromaDB vector store.
@@ -15,96 +196,217 @@ def initialize_chroma_db(session_id):
         session_id (str): Unique session identifier
         
     Returns:
-        Chroma: Initialized vector store
+        VectorStore: Initialized vector store
     """
-    # Check if OpenAI API key is available
-    if not check_api_key():
+    # Check if OpenAI API key is available; local embeddings need none
+    if get_backend().remote and not check_api_key():
         st.error("OpenAI API key is not set. Please set it to initialize the vector store.")
         return None
     
     try:
-        # Create embeddings with OpenAI
-        embeddings = OpenAIEmbeddings()
+        # Create embeddings; ingestion runs as background work
+        embeddings = get_embeddings(PRIORITY_BACKGROUND, session_id)
         
         # Create directory for vectorstore if it doesn't exist
-        os.makedirs(f"chroma_db/{session_id}", exist_ok=True)
+        path = f"chroma_db/{session_id}"
+        if not os.path.exists(path):
+            # A removed collection's database may still be open in Chroma's
+            # client cache, which would then write to the deleted file
+            _close_chroma_client(path)
+        os.makedirs(path, exist_ok=True)
+        
+        # The collection may have been removed and created again
+        with _vectorstores_lock:
+            _vectorstores.pop(session_id, None)
+            _client_generations.pop(session_id, None)
         
         # Initialize vector store
-        vectorstore = Chroma(
-            collection_name="medical_documents",
-            embedding_function=embeddings,
-            persist_directory=f"chroma_db/{session_id}"
-        )
+        vectorstore = open_document_store(session_id, embeddings, create=True)
+        
+        # Record the access so idle collections can be expired
+        touch_collection(session_id)
         
         return vectorstore
     except Exception as e:
         st.error(f"Error initializing vector store: {str(e)}")
         return None
 
-def add_documents_to_vectorstore(vectorstore, texts, session_id):
+def build_chunk_documents(content, source):
+    """
+    Split a document into chunk Documents with scoping metadata.
+    
+    Args:
+        content (str or list): Document text, or the text of each page
+        source (str): Document name stored as the "source" metadata
+        
+    Returns:
+        list: Document objects with source, chunk, page_start, page_end and
+            section metadata (page and section only when pages are given)
+    """
+    if isinstance(content, str):
+        return [
+            Document(
+                page_content=chunk,
+                metadata={"source": source, "chunk": j}
+            )
+            for j, chunk in enumerate(split_text_into_chunks(content))
+        ]
+    
+    return [
+        Document(
+            page_content=chunk["text"],
+            metadata={
+                "source": source,
+                "chunk": j,
+                "page_start": chunk["page_start"],
+                "page_end": chunk["page_end"],
+                "section": chunk["section"]
+            }
+        )
+        for j, chunk in enumerate(split_pages_into_chunks(content))
+    ]
+
+def add_documents_to_vectorstore(vectorstore, texts, session_id, document_names=None):
     """
     Add documents to the vector store.
     
     Args:
         vectorstore (Chroma): Vector store instance
-        texts (list): List of text documents
+        texts (list): List of text documents, each a string or a list of page texts
         session_id (str): Unique session identifier
+        document_names (list): Name of each document, used to scope retrieval
         
     Returns:
         bool: True if successful, False otherwise
     """
-    if not vectorstore:
+    if vectorstore is None:
         return False
     
     try:
         # Process each text document
+        documents = []
         for i, text in enumerate(texts):
-            # Split text into chunks
-            chunks = split_text_into_chunks(text)
-            
-            # Create Document objects
-            documents = [
-                Document(
-                    page_content=chunk,
-                    metadata={"source": f"document_{i}", "chunk": j}
-                )
-                for j, chunk in enumerate(chunks)
-            ]
+            source = document_names[i] if document_names else f"document_{i}"
             
-            # Add documents to vector store
-            vectorstore.add_documents(documents)
+            # Split text into chunks with source, page and section metadata
+            documents.extend(build_chunk_documents(text, source))
+        
+        # Add all documents at once, so a sharded store writes its shards in parallel
+        vectorstore.add_documents(documents)
         
         # Persist the vector store
         vectorstore.persist()
+        
+        # Cached retrievals and answers no longer cover all documents
+        invalidate_session(session_id)
         return True
     except Exception as e:
         st.error(f"Error adding documents to vector store: {str(e)}")
         return False
 
-def load_existing_vectorstore(session_id):
+def build_search_filter(documents=None, page_range=None, sections=None):
+    """
+    Build a Chroma metadata filter that scopes retrieval.
+    
+    Chroma applies the filter to its metadata index before scoring vectors,
+    so a scoped search only compares against the matching chunks.
+    
+    Args:
+        documents (list): Document names to search, or None for all
+        page_range (tuple): (first_page, last_page) to search, or None for all
+        sections (list): Section headings to search, or None for all
+        
+    Returns:
+        dict: Chroma "where" filter, or None if nothing is scoped
+    """
+    conditions = []
+    if documents:
+        conditions.append({"source": {"$in": list(documents)}})
+    if page_range:
+        first_page, last_page = page_range
+        # Chunks that overlap the range, including ones spanning its edges
+        conditions.append({"page_start": {"$lte": int(last_page)}})
+        conditions.append({"page_end": {"$gte": int(first_page)}})
+    if sections:
+        conditions.append({"section": {"$in": list(sections)}})
+    
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+def get_document_index(vectorstore):
+    """
+    Summarize the documents, pages and sections stored in a vector store.
+    
+    Args:
+        vectorstore (Chroma): Vector store instance
+        
+    Returns:
+        dict: Mapping of document name to its "pages" (first, last) or None,
+            and its "sections" in order of appearance
+    """
+    index = {}
+    for metadata in vectorstore.get(include=["metadatas"])["metadatas"]:
+        source = metadata.get("source")
+        if source is None:
+            continue
+        entry = index.setdefault(source, {"pages": None, "sections": [], "chunks": []})
+        entry["chunks"].append(metadata.get("chunk", 0))
+        
+        if "page_start" in metadata:
+            first, last = entry["pages"] or (metadata["page_start"], metadata["page_end"])
+            entry["pages"] = (min(first, metadata["page_start"]), max(last, metadata["page_end"]))
+        section = metadata.get("section")
+        if section:
+            entry["sections"].append((metadata.get("chunk", 0), section))
+    
+    for entry in index.values():
+        ordered = [section for _, section in sorted(entry.pop("sections"))]
+        entry["sections"] = list(dict.fromkeys(ordered))
+        entry["chunks"] = len(entry["chunks"])
+    
+    return index
+
+def load_existing_vectorstore(session_id, priority=PRIORITY_INTERACTIVE):
     """
     Load an existing vector store from disk.
     
+    The store is opened once and shared until the collection's documents
+    change.
+    
     Args:
         session_id (str): Unique session identifier
+        priority (int): Scheduler priority for query embeddings
         
     Returns:
-        Chroma: Loaded vector store or None if not found
+        VectorStore: Loaded vector store or None if not found
     """
     # Check if vector store exists
     if not os.path.exists(f"chroma_db/{session_id}"):
         return None
     
     try:
-        # Create embeddings with OpenAI
-        embeddings = OpenAIEmbeddings()
-        
-        # Load vector store
-        vectorstore = Chroma(
-            collection_name="medical_documents",
-            embedding_function=embeddings,
-            persist_directory=f"chroma_db/{session_id}"
-        )
+        generation = get_generation(session_id)
+        with _vectorstores_lock:
+            cached = _vectorstores.get(session_id, {}).get(priority)
+        
+        if cached is not None and cached[0] == generation:
+            vectorstore = cached[1]
+        else:
+            refresh_chroma_client(session_id)
+            
+            # Create embeddings; queries are interactive by default
+            embeddings = get_embeddings(priority, session_id)
+            
+            # Load vector store in whichever layout it uses
+            vectorstore = open_document_store(session_id, embeddings)
+            with _vectorstores_lock:
+                _vectorstores.setdefault(session_id, {})[priority] = (generation, vectorstore)
+        
+        # Record the access so idle collections can be expired
+        touch_collection(session_id)
         
         return vectorstore
     except Exception as e:
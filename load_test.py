@@ -0,0 +1,415 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import chat_handler
+import embedding_backends
+import embedding_manager
+from chat_handler import get_conversation_chain, stream_answer
+from embedding_manager import initialize_chroma_db, add_documents_to_vectorstore
+from query_cache import embedding_cache, retrieval_cache, answer_cache
+from request_coalescer import coalescer
+from scheduler import create_scheduler, get_scheduler, set_scheduler, SchedulerError
+from utils import ensure_directories
+
+DEFAULT_QUESTIONS = [
+    ("What are the key symptoms of Crohn's disease?", 4),
+    ("Explain the cardiac conduction system step by step.", 3),
+    ("Compare and contrast Type 1 and Type 2 diabetes.", 2),
+    ("Summarize the mechanism of action for ACE inhibitors.", 2),
+    ("What is the normal range for serum potassium?", 1),
+    ("How does the loop of Henle concentrate urine?", 1),
+]
+
+SAMPLE_PARAGRAPH = (
+    "The cardiac conduction system starts at the sinoatrial node, which sets the heart rate. "
+    "Impulses spread through the atria to the atrioventricular node, where conduction is delayed "
+    "so the ventricles can fill. The bundle of His and Purkinje fibres then carry the impulse "
+    "through the ventricles. ACE inhibitors lower blood pressure by blocking the conversion of "
+    "angiotensin I to angiotensin II. Crohn's disease presents with abdominal pain, diarrhoea and "
+    "weight loss, and can affect any part of the gastrointestinal tract.\n\n"
+)
+
+
+class SimulatedEmbeddings(Embeddings):
+    """
+    Local stand-in for OpenAIEmbeddings with deterministic vectors and
+    configurable latency.
+    """
+
+    def __init__(self, dimension=256, call_latency=0.15, per_text_latency=0.002):
+        self.dimension = dimension
+        self.call_latency = call_latency
+        self.per_text_latency = per_text_latency
+
+    def _vector(self, text):
+        # Hash words into buckets so similar texts get similar vectors
+        vector = [0.0] * self.dimension
+        for word in text.lower().split():
+            bucket = int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.dimension
+            vector[bucket] += 1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        time.sleep(self.call_latency + self.per_text_latency * len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.call_latency)
+        return self._vector(text)
+
+
+class SimulatedChatModel(BaseChatModel):
+    """
+    Local stand-in for ChatOpenAI that streams a canned answer with
+    configurable time to first token and per-token latency. Condense
+    prompts get the follow-up question back as a short standalone question.
+    """
+
+    first_token_latency: float = 0.6
+    token_latency: float = 0.02
+    answer_tokens: int = 120
+    streaming: bool = True
+
+    @property
+    def _llm_type(self):
+        return "simulated-chat"
+
+    def _tokens(self, messages):
+        prompt = messages[-1].content
+        if "Standalone question:" in prompt:
+            # Rewriting a follow-up is short, and a repeated question must
+            # condense to the same text for the answer cache to be realistic
+            question = prompt.rsplit("Follow Up Input:", 1)[-1].split("Standalone question:")[0]
+            return [f"{word} " for word in question.split()]
+        seed = hashlib.md5(messages[-1].content.encode("utf-8")).hexdigest()[:8]
+        return [f"token{seed}{i} " for i in range(self.answer_tokens)]
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_latency)
+        for token in self._tokens(messages):
+            time.sleep(self.token_latency)
+            if run_manager:
+                run_manager.on_llm_new_token(token)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.streaming:
+            # Like ChatOpenAI, stream through the callbacks and return the whole text
+            content = "".join(chunk.message.content for chunk in self._stream(messages, stop, run_manager))
+        else:
+            tokens = self._tokens(messages)
+            time.sleep(self.first_token_latency + self.token_latency * len(tokens))
+            content = "".join(tokens)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+
+@contextmanager
+def simulated_openai(embedding_latency=0.15, llm_first_token=0.6, llm_token_latency=0.02, api_check_latency=0.1):
+    """
+    Replace every OpenAI call on the ingestion and chat paths with local stand-ins.
+
+    Args:
+        embedding_latency (float): Seconds per embedding request
+        llm_first_token (float): Seconds until the first answer token
+        llm_token_latency (float): Seconds between answer tokens
+        api_check_latency (float): Seconds per API key check
+    """
+    def check_api_key():
+        time.sleep(api_check_latency)
+        return True
+
+    def get_llm():
+        return SimulatedChatModel(first_token_latency=llm_first_token, token_latency=llm_token_latency)
+
+    patches = [
+        (embedding_backends, "OpenAIEmbeddings", lambda **kwargs: SimulatedEmbeddings(call_latency=embedding_latency)),
+        (embedding_manager, "check_api_key", check_api_key),
+        (chat_handler, "get_llm", get_llm),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    for module, name, replacement in patches:
+        setattr(module, name, replacement)
+    try:
+        yield check_api_key
+    finally:
+        for module, name, original in originals:
+            setattr(module, name, original)
+
+
+def _rss_bytes():
+    # Resident memory of the whole process, including native allocations
+    # (Chroma's index, numpy) that Python's allocator does not see
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        # Without /proc only the peak is available, in KB (bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _disable_verbose(chain):
+    # The app's chains print every prompt, which would be measured as latency
+    for component in (chain, chain.question_generator, chain.combine_docs_chain,
+                      chain.combine_docs_chain.llm_chain):
+        component.verbose = False
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)
+    return ordered[max(index, 0)]
+
+
+def run_level(users, duration, questions, check_api_key, think_time=(2.0, 6.0), document_paragraphs=20, seed=0):
+    """
+    Run N simulated students for a fixed duration.
+
+    Each student processes a document into their own collection, then asks
+    questions from the weighted mix with random think times, re-checking the
+    API key on every turn as the Streamlit app does on each rerun. Every
+    level starts with empty caches and a fresh scheduler, so it does not
+    benefit from the work of the levels before it.
+
+    Args:
+        users (int): Number of concurrent simulated students
+        duration (float): Seconds each student keeps asking questions
+        questions (list): (question, weight) pairs
+        check_api_key (callable): API key check run on every turn
+        think_time (tuple): Minimum and maximum seconds between questions
+        document_paragraphs (int): Size of each student's document
+        seed (int): Random seed
+
+    Returns:
+        dict: Throughput, latency percentiles, process memory (RSS) per
+            session and in total, scheduler timeouts and rejections, and
+            other errors
+    """
+    texts = [question for question, _ in questions]
+    weights = [weight for _, weight in questions]
+    lock = threading.Lock()
+    turn_latencies = []
+    first_token_latencies = []
+    ingest_latencies = []
+    errors = []
+    chains = []
+    coalesced_before = coalescer.get_summary()["coalesced"]
+
+    for cache in (embedding_cache, retrieval_cache, answer_cache):
+        cache.clear()
+    set_scheduler(create_scheduler(path=f"scheduler_{users}_users.db"))
+
+    memory_before = _rss_bytes()
+    start_barrier = threading.Barrier(users)
+
+    def student(index):
+        rng = random.Random(seed * 1000 + index)
+        session_id = f"loadtest_{users}_{index}"
+        try:
+            start_barrier.wait()
+            started = time.perf_counter()
+            vectorstore = initialize_chroma_db(session_id)
+            add_documents_to_vectorstore(vectorstore, [SAMPLE_PARAGRAPH * document_paragraphs], session_id)
+            chain = get_conversation_chain(session_id)
+            if chain is None:
+                raise RuntimeError("Conversation chain could not be created")
+            _disable_verbose(chain)
+            with lock:
+                ingest_latencies.append(time.perf_counter() - started)
+                chains.append(chain)
+        except Exception as e:
+            with lock:
+                errors.append(f"ingest: {str(e)}")
+            return
+
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            question = rng.choices(texts, weights)[0]
+            started = time.perf_counter()
+            first_token = None
+            try:
+                check_api_key()
+                for _ in stream_answer(chain, question, session_id):
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                with lock:
+                    turn_latencies.append(time.perf_counter() - started)
+                    first_token_latencies.append(first_token or 0.0)
+            except SchedulerError:
+                # Counted in the scheduler stats
+                pass
+            except Exception as e:
+                with lock:
+                    errors.append(f"chat: {str(e)}")
+            time.sleep(rng.uniform(*think_time))
+
+    threads = [threading.Thread(target=student, args=(i,), daemon=True) for i in range(users)]
+    level_started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - level_started
+
+    memory_after = _rss_bytes()
+    scheduler_stats = get_scheduler().get_stats()
+
+    return {
+        "users": users,
+        "turns": len(turn_latencies),
+        "throughput_per_second": len(turn_latencies) / elapsed if elapsed else 0.0,
+        "turn_p50": _percentile(turn_latencies, 0.50),
+        "turn_p95": _percentile(turn_latencies, 0.95),
+        "turn_p99": _percentile(turn_latencies, 0.99),
+        "first_token_p50": _percentile(first_token_latencies, 0.50),
+        "first_token_p95": _percentile(first_token_latencies, 0.95),
+        "ingest_p50": _percentile(ingest_latencies, 0.50),
+        "ingest_p95": _percentile(ingest_latencies, 0.95),
+        "memory_per_session_kb": max(0, memory_after - memory_before) / 1024 / max(len(chains), 1),
+        "rss_mb": memory_after / 1024 / 1024,
+        "coalesced": coalescer.get_summary()["coalesced"] - coalesced_before,
+        "scheduler_timeouts": scheduler_stats["timed_out"],
+        "scheduler_rejections": scheduler_stats["rejected"],
+        "scheduler_wait_average": scheduler_stats["average_wait_seconds"],
+        "errors": len(errors),
+        "error_samples": errors[:5],
+    }
+
+
+def load_questions(path):
+    """
+    Load a question mix from a file.
+
+    Each line is a question, optionally prefixed with a weight and a tab.
+
+    Args:
+        path (str): Question file
+
+    Returns:
+        list: (question, weight) pairs
+    """
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            weight, _, question = line.partition("\t")
+            if question and weight.replace(".", "", 1).isdigit():
+                questions.append((question, float(weight)))
+            else:
+                questions.append((line, 1.0))
+    return questions
+
+
+def _format_seconds(value):
+    return "-" if value is None else f"{value:.2f}s"
+
+
+def print_curve(results):
+    """
+    Print the capacity curve as a table.
+
+    Args:
+        results (list): Result dicts from run_level
+    """
+    print(f"{'users':>6} {'turns':>6} {'turns/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} "
+          f"{'ttft p95':>9} {'ingest p95':>11} {'KB/sess':>8} {'RSS MB':>7} {'timeouts':>9} {'rejected':>9} {'errors':>7}")
+    for result in results:
+        print(
+            f"{result['users']:>6} {result['turns']:>6} {result['throughput_per_second']:>8.2f} "
+            f"{_format_seconds(result['turn_p50']):>8} {_format_seconds(result['turn_p95']):>8} "
+            f"{_format_seconds(result['turn_p99']):>8} {_format_seconds(result['first_token_p95']):>9} "
+            f"{_format_seconds(result['ingest_p95']):>11} {result['memory_per_session_kb']:>8.0f} {result['rss_mb']:>7.0f} "
+            f"{result['scheduler_timeouts']:>9} {result['scheduler_rejections']:>9} {result['errors']:>7}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the ingestion and chat paths with simulated students")
+    parser.add_argument("--levels", default="1,2,4,8,16,32", help="Comma-separated concurrent user counts")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds each level runs")
+    parser.add_argument("--think-min", type=float, default=2.0, help="Minimum seconds between questions")
+    parser.add_argument("--think-max", type=float, default=6.0, help="Maximum seconds between questions")
+    parser.add_argument("--questions", help="Question mix file (one per line, optional 'weight<TAB>question')")
+    parser.add_argument("--document-paragraphs", type=int, default=20, help="Size of each student's document")
+    parser.add_argument("--embedding-latency", type=float, default=0.15)
+    parser.add_argument("--llm-first-token", type=float, default=0.6)
+    parser.add_argument("--llm-token-latency", type=float, default=0.02)
+    parser.add_argument("--api-check-latency", type=float, default=0.1)
+    parser.add_argument("--label", default="current", help="Release label stored with the curve")
+    parser.add_argument("--output", help="JSON file the capacity curve is added to, keyed by label")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions) if args.questions else DEFAULT_QUESTIONS
+    levels = [int(level) for level in args.levels.split(",")]
+
+    # Collections are created relative to the working directory
+    output = os.path.abspath(args.output) if args.output else None
+    os.chdir(tempfile.mkdtemp(prefix="medstudy_loadtest_"))
+    ensure_directories()
+
+    results = []
+    with simulated_openai(
+        args.embedding_latency, args.llm_first_token, args.llm_token_latency, args.api_check_latency
+    ) as check_api_key:
+        for users in levels:
+            print(f"Running {users} concurrent users for {args.duration:.0f}s...")
+            results.append(run_level(
+                users,
+                args.duration,
+                questions,
+                check_api_key,
+                think_time=(args.think_min, args.think_max),
+                document_paragraphs=args.document_paragraphs
+            ))
+            print_curve(results[-1:])
+
+    print()
+    print_curve(results)
+
+    if output:
+        curves = {}
+        if os.path.exists(output):
+            with open(output, "r", encoding="utf-8") as f:
+                curves = json.load(f)
+        curves[args.label] = {"recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "levels": results}
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(curves, f, indent=2)
+        print(f"Capacity curve saved to {output} as '{args.label}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,12 @@
 import os
 import sys
 import uuid
-from document_processor import extract_text_from_pdf
+from document_processor import extract_pages_from_pdf
 from embedding_manager import initialize_chroma_db, add_documents_to_vectorstore
+from summary_index import build_summary_index
 from utils_script import ensure_directories, check_api_key
 
-def process_pdfs(pdf_dir):
+def process_pdfs(pdf_dir, build_summaries=False):
     # Ensure directories exist
     ensure_directories()
     
@@ -29,15 +30,17 @@ def process_pdfs(pdf_dir):
     
     print(f"Found {len(pdf_files)} PDF files")
     
-    # Process each PDF
+    # Process each PDF page by page so chunks keep their page numbers
     all_texts = []
+    document_names = []
     for pdf_file in pdf_files:
         pdf_path = os.path.join(pdf_dir, pdf_file)
         print(f"Extracting text from {pdf_file}...")
-        text = extract_text_from_pdf(pdf_path)
-        if text:
-            all_texts.append(text)
-            print(f"Successfully extracted text from {pdf_file} ({len(text)} characters)")
+        pages = extract_pages_from_pdf(pdf_path)
+        if any(pages):
+            all_texts.append(pages)
+            document_names.append(pdf_file)
+            print(f"Successfully extracted text from {pdf_file} ({len(pages)} pages, {sum(len(page) for page in pages)} characters)")
         else:
             print(f"Failed to extract text from {pdf_file}")
     
@@ -47,10 +50,13 @@ def process_pdfs(pdf_dir):
     
     # Add documents to vector store
     print("Adding documents to vector store...")
-    result = add_documents_to_vectorstore(vectorstore, all_texts, session_id)
+    result = add_documents_to_vectorstore(vectorstore, all_texts, session_id, document_names)
     
     if result:
         print("Successfully processed all documents")
+        if build_summaries:
+            print("Building summaries for broad questions...")
+            print(f"Added {build_summary_index(session_id)} summaries")
         # Write the session_id to a file so the app can use it
         with open("session_id.txt", "w") as f:
             f.write(session_id)
@@ -66,7 +72,7 @@ if __name__ == "__main__":
         sys.exit(1)
         
     pdf_dir = "pdf_files"
-    success = process_pdfs(pdf_dir)
+    success = process_pdfs(pdf_dir, build_summaries="--summaries" in sys.argv)
     
     if success:
         print("PDFs processed successfully!")
@@ -0,0 +1,418 @@
+import json
+import os
+import threading
+import uuid
+
+import numpy as np
+from langchain.schema.document import Document
+from langchain.schema.vectorstore import VectorStore
+
+from embedding_backends import get_backend, check_backend_metadata
+
+# Store new collections as reduced, quantized vectors
+QUANTIZED_COLLECTIONS = os.environ.get("MEDSTUDY_QUANTIZED_COLLECTIONS", "0") == "1"
+
+# Dimensions kept for the first-pass search
+QUANTIZED_DIMENSIONS = int(os.environ.get("MEDSTUDY_QUANTIZED_DIMENSIONS", 256))
+
+# "pca" projects onto the main components, "truncate" keeps the leading dimensions
+QUANTIZED_REDUCTION = os.environ.get("MEDSTUDY_QUANTIZED_REDUCTION", "pca")
+
+# Candidates re-scored with full vectors, as a multiple of k
+RESCORE_FACTOR = int(os.environ.get("MEDSTUDY_RESCORE_FACTOR", 10))
+
+# Files kept in the session directory; plain files, because storage
+# maintenance removes directories that are not Chroma segments
+MANIFEST_FILE = "quantized.json"
+CHUNKS_FILE = "quantized_chunks.jsonl"
+VECTORS_FILE = "quantized_vectors.f32"
+INDEX_FILE = "quantized_index.npz"
+
+# Rows scored at once, to bound the memory of dequantized blocks
+BLOCK_ROWS = 8192
+
+_COMPARISONS = {
+    "$eq": lambda value, operand: value == operand,
+    "$ne": lambda value, operand: value != operand,
+    "$gt": lambda value, operand: value > operand,
+    "$gte": lambda value, operand: value >= operand,
+    "$lt": lambda value, operand: value < operand,
+    "$lte": lambda value, operand: value <= operand,
+    "$in": lambda value, operand: value in operand,
+    "$nin": lambda value, operand: value not in operand,
+}
+
+
+def is_quantized(session_id):
+    """
+    Check whether a session's documents are stored as quantized vectors.
+
+    Args:
+        session_id (str): Unique session identifier
+
+    Returns:
+        bool: True if the collection has a quantized manifest
+    """
+    return os.path.exists(f"chroma_db/{session_id}/{MANIFEST_FILE}")
+
+
+def matches_filter(metadata, where):
+    """
+    Evaluate a Chroma "where" filter against one chunk's metadata.
+
+    Args:
+        metadata (dict): Chunk metadata
+        where (dict): Chroma filter
+
+    Returns:
+        bool: True if the chunk matches
+    """
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, part) for part in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, part) for part in condition):
+                return False
+        else:
+            # Like Chroma, a chunk without the field never matches
+            if key not in metadata:
+                return False
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for operator, operand in condition.items():
+                if not _COMPARISONS[operator](metadata[key], operand):
+                    return False
+    return True
+
+
+def fit_reduction(vectors, dimensions, method):
+    """
+    Fit the projection used for the first-pass search.
+
+    Args:
+        vectors (np.ndarray): Full vectors, one per row
+        dimensions (int): Dimensions to keep
+        method (str): "pca" or "truncate"
+
+    Returns:
+        tuple: (mean, components) so that reduced = (vector - mean) @ components
+    """
+    full_dimensions = vectors.shape[1]
+    dimensions = min(dimensions, full_dimensions)
+    if method == "truncate" or dimensions == full_dimensions:
+        return np.zeros(full_dimensions, dtype=np.float32), np.eye(full_dimensions, dimensions, dtype=np.float32)
+
+    mean = np.zeros(full_dimensions, dtype=np.float64)
+    for start in range(0, len(vectors), BLOCK_ROWS):
+        mean += np.asarray(vectors[start:start + BLOCK_ROWS], dtype=np.float64).sum(axis=0)
+    mean /= max(len(vectors), 1)
+
+    covariance = np.zeros((full_dimensions, full_dimensions), dtype=np.float64)
+    for start in range(0, len(vectors), BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + BLOCK_ROWS], dtype=np.float64) - mean
+        covariance += block.T @ block
+
+    # eigh returns eigenvalues in ascending order
+    _, eigenvectors = np.linalg.eigh(covariance)
+    components = eigenvectors[:, ::-1][:, :dimensions]
+    return mean.astype(np.float32), components.astype(np.float32)
+
+
+def quantize(vectors):
+    """
+    Quantize vectors to int8 with one scale per vector.
+
+    Args:
+        vectors (np.ndarray): Reduced vectors, one per row
+
+    Returns:
+        tuple: (codes, scales)
+    """
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class QuantizedVectorStore(VectorStore):
+    """
+    A session's document collection stored for fast loading and search.
+
+    The first pass scores every chunk with int8 codes of reduced vectors,
+    which are a fraction of the size of the full embeddings. The best
+    candidates are then re-scored exactly with the full float32 vectors,
+    read on demand from a memory-mapped file. Distances are squared L2,
+    like Chroma's default, so results and relevance scores are comparable.
+    """
+
+    def __init__(self, session_id, embeddings, dimensions=QUANTIZED_DIMENSIONS, reduction=QUANTIZED_REDUCTION,
+                 rescore_factor=RESCORE_FACTOR):
+        self.session_id = session_id
+        self.path = f"chroma_db/{session_id}"
+        self._embeddings = embeddings
+        self.rescore_factor = rescore_factor
+        self._lock = threading.RLock()
+        self._masks = {}
+
+        if is_quantized(session_id):
+            with open(os.path.join(self.path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+            check_backend_metadata(self.manifest, get_backend())
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            self.manifest = {"dimensions": dimensions, "reduction": reduction, "full_dimensions": None}
+            self.manifest.update(get_backend().metadata())
+            self._save_manifest()
+
+        self._load()
+
+    @property
+    def embeddings(self):
+        return self._embeddings
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _save_manifest(self):
+        temp_path = self._file(f"{MANIFEST_FILE}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(temp_path, self._file(MANIFEST_FILE))
+
+    def _load(self):
+        self.ids = []
+        self.texts = []
+        self.metadatas = []
+        offsets = [0]
+        if os.path.exists(self._file(CHUNKS_FILE)):
+            with open(self._file(CHUNKS_FILE), "rb") as f:
+                for line in f:
+                    try:
+                        chunk = json.loads(line)
+                    except ValueError:
+                        # A write interrupted mid-line leaves a partial last chunk
+                        break
+                    self.ids.append(chunk["id"])
+                    self.texts.append(chunk["text"])
+                    self.metadatas.append(chunk["metadata"])
+                    offsets.append(offsets[-1] + len(line))
+
+        full_dimensions = self.manifest["full_dimensions"]
+        count = 0
+        if full_dimensions and os.path.exists(self._file(VECTORS_FILE)):
+            count = min(len(self.ids), os.path.getsize(self._file(VECTORS_FILE)) // (4 * full_dimensions))
+        del self.ids[count:], self.texts[count:], self.metadatas[count:]
+
+        self._chunks_size = offsets[count]
+
+        self._vectors = None
+        if count:
+            self._vectors = np.memmap(self._file(VECTORS_FILE), dtype=np.float32, mode="r",
+                                      shape=(count, full_dimensions))
+
+        self._index = None
+        if os.path.exists(self._file(INDEX_FILE)):
+            index = dict(np.load(self._file(INDEX_FILE)))
+            if len(index["codes"]) == count:
+                self._index = index
+
+    def _grown(self):
+        vectors_size = len(self.ids) * 4 * self.manifest["full_dimensions"]
+        for name, size in ((VECTORS_FILE, vectors_size), (CHUNKS_FILE, self._chunks_size)):
+            if os.path.exists(self._file(name)) and os.path.getsize(self._file(name)) > size:
+                return True
+        return False
+
+    def _build_index(self):
+        """
+        Fit the reduction on all stored vectors and quantize them.
+        """
+        mean, components = fit_reduction(self._vectors, self.manifest["dimensions"], self.manifest["reduction"])
+        codes = []
+        scales = []
+        for start in range(0, len(self._vectors), BLOCK_ROWS):
+            block = (np.asarray(self._vectors[start:start + BLOCK_ROWS]) - mean) @ components
+            block_codes, block_scales = quantize(block)
+            codes.append(block_codes)
+            scales.append(block_scales)
+
+        codes = np.concatenate(codes)
+        scales = np.concatenate(scales)
+        # Squared norms of the dequantized vectors, for L2 distances
+        norms = np.square(codes.astype(np.float32) * scales[:, None]).sum(axis=1)
+
+        index = {"mean": mean, "components": components, "codes": codes, "scales": scales, "norms": norms}
+        temp_path = self._file("quantized_index.tmp.npz")
+        np.savez(temp_path, **index)
+        os.replace(temp_path, self._file(INDEX_FILE))
+        self._index = index
+        self._masks = {}
+
+    def _current_index(self):
+        with self._lock:
+            if self._vectors is None:
+                return None
+            if self._index is None:
+                self._build_index()
+            return self._index
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        """
+        Add chunks with precomputed embeddings.
+
+        The search index is rebuilt on the next search or persist().
+
+        Args:
+            texts (list): Chunk texts
+            embeddings (list): One full embedding per chunk
+            metadatas (list): One metadata dict per chunk
+            ids (list): Chunk ids, generated if not given
+
+        Returns:
+            list: Chunk ids
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = np.asarray(embeddings, dtype=np.float32)
+
+        with self._lock:
+            if self.manifest["full_dimensions"] is None:
+                self.manifest["full_dimensions"] = int(vectors.shape[1])
+                self._save_manifest()
+            elif vectors.shape[1] != self.manifest["full_dimensions"]:
+                raise ValueError(
+                    f"Embedding dimension {vectors.shape[1]} does not match the collection's "
+                    f"{self.manifest['full_dimensions']}"
+                )
+
+            # Files larger than expected were appended to since they were read,
+            # by another store object or an interrupted write. Reread them and
+            # cut off any partial write, so chunks and vectors stay aligned
+            if self._grown():
+                self._load()
+                vectors_size = len(self.ids) * 4 * self.manifest["full_dimensions"]
+                for name, size in ((VECTORS_FILE, vectors_size), (CHUNKS_FILE, self._chunks_size)):
+                    if os.path.exists(self._file(name)) and os.path.getsize(self._file(name)) > size:
+                        os.truncate(self._file(name), size)
+
+            # Vectors first: on open, chunks without a full vector are dropped
+            with open(self._file(VECTORS_FILE), "ab") as f:
+                f.write(vectors.tobytes())
+            lines = [
+                json.dumps({"id": chunk_id, "text": text, "metadata": metadata}, ensure_ascii=False).encode("utf-8") + b"\n"
+                for chunk_id, text, metadata in zip(ids, texts, metadatas)
+            ]
+            with open(self._file(CHUNKS_FILE), "ab") as f:
+                f.write(b"".join(lines))
+            self._chunks_size += sum(len(line) for line in lines)
+
+            self.ids.extend(ids)
+            self.texts.extend(texts)
+            self.metadatas.extend(metadatas)
+
+            # Reopen the memory map over the grown file
+            self._vectors = np.memmap(self._file(VECTORS_FILE), dtype=np.float32, mode="r",
+                                      shape=(len(self.ids), self.manifest["full_dimensions"]))
+            self._index = None
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        return self.add_embeddings(texts, self._embeddings.embed_documents(texts), metadatas, ids)
+
+    def _filter_mask(self, where):
+        if not where:
+            return None
+        key = json.dumps(where, sort_keys=True)
+        mask = self._masks.get(key)
+        if mask is None or len(mask) != len(self.metadatas):
+            mask = np.fromiter((matches_filter(metadata, where) for metadata in self.metadatas), dtype=bool,
+                               count=len(self.metadatas))
+            self._masks[key] = mask
+        return mask
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, filter=None, **kwargs):
+        index = self._current_index()
+        if index is None:
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        reduced = (query - index["mean"]) @ index["components"]
+
+        # First pass: approximate squared L2 in the reduced space, without
+        # the query's own norm, which is the same for every chunk
+        approximate = np.empty(len(index["codes"]), dtype=np.float32)
+        for start in range(0, len(approximate), BLOCK_ROWS):
+            block = index["codes"][start:start + BLOCK_ROWS].astype(np.float32) @ reduced
+            approximate[start:start + BLOCK_ROWS] = index["norms"][start:start + BLOCK_ROWS] - 2 * block * index["scales"][start:start + BLOCK_ROWS]
+
+        mask = self._filter_mask(filter)
+        if mask is not None:
+            approximate[~mask] = np.inf
+        available = int(np.isfinite(approximate).sum())
+        if available == 0:
+            return []
+
+        count = min(available, k * self.rescore_factor)
+        candidates = np.argpartition(approximate, count - 1)[:count]
+        candidates = np.sort(candidates[np.isfinite(approximate[candidates])])
+
+        # Second pass: exact distances from the memory-mapped full vectors
+        distances = np.square(np.asarray(self._vectors[candidates]) - query).sum(axis=1)
+        best = np.argsort(distances)[:k]
+        return [
+            (Document(page_content=self.texts[candidates[i]], metadata=self.metadatas[candidates[i]]),
+             float(distances[i]))
+            for i in best
+        ]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        embedding = self._embeddings.embed_query(query)
+        return self.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=filter, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        results = self.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=filter, **kwargs)
+        return [doc for doc, _ in results]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        results = self.similarity_search_with_score(query, k=k, filter=filter, **kwargs)
+        return [doc for doc, _ in results]
+
+    def _select_relevance_score_fn(self):
+        return self._euclidean_relevance_score_fn
+
+    def get(self, where=None, include=None, **kwargs):
+        """
+        Get stored chunks, like Chroma.get.
+
+        Returns:
+            dict: "ids" and the included "documents" and "metadatas"
+        """
+        include = include or ["documents", "metadatas"]
+        mask = self._filter_mask(where)
+        rows = range(len(self.ids)) if mask is None else np.flatnonzero(mask)
+        result = {"ids": [self.ids[i] for i in rows]}
+        if "documents" in include:
+            result["documents"] = [self.texts[i] for i in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self.metadatas[i] for i in rows]
+        if "embeddings" in include:
+            result["embeddings"] = [self._vectors[i].tolist() for i in rows]
+        return result
+
+    def persist(self):
+        # Build the index at ingestion time rather than on the first search
+        self._current_index()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, session_id=None, **kwargs):
+        store = cls(session_id or str(uuid.uuid4()), embedding, **kwargs)
+        store.add_texts(texts, metadatas)
+        return store
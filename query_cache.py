@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+from request_coalescer import normalize_question
+
+# Entries kept by each cache before the least recently used are dropped
+EMBEDDING_CACHE_SIZE = int(os.environ.get("MEDSTUDY_EMBEDDING_CACHE_SIZE", 2000))
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("MEDSTUDY_RETRIEVAL_CACHE_SIZE", 1000))
+ANSWER_CACHE_SIZE = int(os.environ.get("MEDSTUDY_ANSWER_CACHE_SIZE", 500))
+
+# Rewritten with a new generation whenever a collection's documents change
+GENERATION_FILE = ".cache_generation"
+
+# Answers saved with the collection, so they survive restarts
+ANSWERS_FILE = "answer_cache.json"
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache with hit and miss counts.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Args:
+            key: Cache key
+
+        Returns:
+            The cached value, or None on a miss
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def contains(self, key):
+        # Checked without counting a hit or miss
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def items(self):
+        with self._lock:
+            return list(self._entries.items())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Entries, hits, misses and hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+embedding_cache = LRUCache(EMBEDDING_CACHE_SIZE)
+retrieval_cache = LRUCache(RETRIEVAL_CACHE_SIZE)
+answer_cache = LRUCache(ANSWER_CACHE_SIZE)
+
+
+def get_generation(session_id):
+    """
+    Get the version of a collection's documents.
+
+    The version lives on disk, so every process serving the collection sees
+    a change made by any of them.
+
+    Args:
+        session_id (str): Unique session identifier
+
+    Returns:
+        str: Generation, empty if the documents never changed since caching began
+    """
+    try:
+        with open(f"chroma_db/{session_id}/{GENERATION_FILE}", "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def invalidate_session(session_id):
+    """
+    Mark a collection's documents as changed, so cached retrievals and
+    answers for it are no longer used.
+
+    Args:
+        session_id (str): Unique session identifier
+    """
+    path = f"chroma_db/{session_id}"
+    if not os.path.exists(path):
+        return
+    with open(os.path.join(path, GENERATION_FILE), "w") as f:
+        f.write(uuid.uuid4().hex)
+    if os.path.exists(os.path.join(path, ANSWERS_FILE)):
+        os.remove(os.path.join(path, ANSWERS_FILE))
+
+
+def cache_key(session_id, search_filter, question):
+    """
+    Build the retrieval and answer cache key of a standalone question.
+
+    Args:
+        session_id (str): Unique session identifier
+        search_filter (dict): Retrieval scope, or None
+        question (str): Standalone question
+
+    Returns:
+        tuple: Cache key
+    """
+    scope = json.dumps(search_filter, sort_keys=True)
+    return (session_id, get_generation(session_id), scope, normalize_question(question))
+
+
+def save_answers(session_id):
+    """
+    Save a collection's cached answers next to its documents.
+
+    Args:
+        session_id (str): Unique session identifier
+
+    Returns:
+        int: Number of answers saved
+    """
+    path = f"chroma_db/{session_id}"
+    if not os.path.exists(path):
+        return 0
+
+    generation = get_generation(session_id)
+    answers = [
+        {"scope": key[2], "question": key[3], "answer": answer}
+        for key, answer in answer_cache.items()
+        if key[0] == session_id and key[1] == generation
+    ]
+    temp_path = os.path.join(path, f"{ANSWERS_FILE}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"generation": generation, "answers": answers}, f, ensure_ascii=False)
+    os.replace(temp_path, os.path.join(path, ANSWERS_FILE))
+    return len(answers)
+
+
+def load_answers(session_id):
+    """
+    Load a collection's saved answers into the answer cache.
+
+    Answers saved before the documents last changed are ignored.
+
+    Args:
+        session_id (str): Unique session identifier
+
+    Returns:
+        int: Number of answers loaded
+    """
+    answers_path = f"chroma_db/{session_id}/{ANSWERS_FILE}"
+    if not os.path.exists(answers_path):
+        return 0
+
+    try:
+        with open(answers_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return 0
+
+    generation = get_generation(session_id)
+    if saved.get("generation") != generation:
+        return 0
+    for entry in saved["answers"]:
+        answer_cache.put((session_id, generation, entry["scope"], entry["question"]), entry["answer"])
+    return len(saved["answers"])
+
+
+def get_cache_stats():
+    """
+    Returns:
+        dict: Stats of the embedding, retrieval and answer caches
+    """
+    return {
+        "embeddings": embedding_cache.get_stats(),
+        "retrievals": retrieval_cache.get_stats(),
+        "answers": answer_cache.get_stats(),
+    }
@@ -1,10 +1,10 @@
 import os
 import sys
 import streamlit as st
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain.schema.document import Document
-from document_processor import extract_text_from_pdf, split_text_into_chunks
+from embedding_backends import get_backend
+from embedding_manager import get_embeddings, build_chunk_documents, open_document_store
+from scheduler import PRIORITY_BACKGROUND
+from query_cache import invalidate_session
 from utils import check_api_key, ensure_directories
 
 # Ensure environment variables are set
@@ -17,8 +17,8 @@ def quick_sample_load():
     # Ensure directories exist
     ensure_directories()
     
-    # Check if OpenAI API key is available
-    if not check_api_key():
+    # Check if OpenAI API key is available; local embeddings need none
+    if get_backend().remote and not check_api_key():
         print("Error: OpenAI API key is not available")
         return False
     
@@ -35,7 +35,7 @@ def quick_sample_load():
     try:
         # Initialize embeddings
         print("Initializing embeddings...")
-        embeddings = OpenAIEmbeddings()
+        embeddings = get_embeddings(PRIORITY_BACKGROUND, session_id)
         
         # Create directory for vectorstore
         print(f"Creating directory: chroma_db/{session_id}")
@@ -43,11 +43,7 @@ def quick_sample_load():
         
         # Initialize vector store
         print("Initializing vector store...")
-        vectorstore = Chroma(
-            collection_name="medical_documents",
-            embedding_function=embeddings,
-            persist_directory=f"chroma_db/{session_id}"
-        )
+        vectorstore = open_document_store(session_id, embeddings, create=True)
         
         # Process each PDF
         all_documents = []
@@ -62,35 +58,24 @@ def quick_sample_load():
             reader = PdfReader(pdf_path)
             # Take just the first 10 pages or all pages if less than 10
             max_pages = min(10, len(reader.pages))
-            text = ""
+            pages = []
             print(f"Processing {max_pages} pages out of {len(reader.pages)} total pages")
             
             for page_num in range(max_pages):
                 page = reader.pages[page_num]
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text
+                pages.append(page.extract_text() or "")
                 print(f"Processed page {page_num+1}/{max_pages}")
             
-            if not text:
+            if not any(pages):
                 print(f"Failed to extract text from {pdf_file}")
                 continue
                 
-            print(f"Successfully extracted {len(text)} characters from {pdf_file}")
+            print(f"Successfully extracted {sum(len(page) for page in pages)} characters from {pdf_file}")
             
-            # Split text into chunks
+            # Split text into chunks with source, page and section metadata
             print(f"Splitting text into chunks...")
-            chunks = split_text_into_chunks(text)
-            print(f"Created {len(chunks)} chunks")
-            
-            # Create Document objects
-            documents = [
-                Document(
-                    page_content=chunk,
-                    metadata={"source": pdf_file, "chunk": j}
-                )
-                for j, chunk in enumerate(chunks)
-            ]
+            documents = build_chunk_documents(pages, pdf_file)
+            print(f"Created {len(documents)} chunks")
             
             all_documents.extend(documents)
         
@@ -107,6 +92,7 @@ def quick_sample_load():
         # Persist the vector store
         print("Persisting vector store...")
         vectorstore.persist()
+        invalidate_session(session_id)
         
         # Save the session ID
         with open("session_id.txt", "w") as f:
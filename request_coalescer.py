@@ -0,0 +1,209 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Keys whose per-key metrics are kept; older keys only count in the totals
+MAX_TRACKED_KEYS = int(os.environ.get("MEDSTUDY_COALESCER_TRACKED_KEYS", 1000))
+
+
+class _InFlightCall:
+    """
+    State shared between the caller that runs a computation and the callers
+    that wait on it.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.tokens = []
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class RequestCoalescer:
+    """
+    Single-flight coalescing of identical in-flight requests.
+
+    The first caller for a key (the leader) runs the computation. Callers that
+    arrive with the same key while it is still running share its result, or
+    its token stream, instead of repeating the work.
+    """
+
+    def __init__(self, max_tracked_keys=MAX_TRACKED_KEYS):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.max_tracked_keys = max_tracked_keys
+        self._stats = OrderedDict()
+        self._totals = {"requests": 0, "executions": 0, "coalesced": 0}
+
+    def _count(self, key, *fields):
+        # Called with the lock held; the least recently used keys are dropped
+        stats = self._stats.pop(key, None) or {"requests": 0, "executions": 0, "coalesced": 0}
+        self._stats[key] = stats
+        while len(self._stats) > self.max_tracked_keys:
+            self._stats.popitem(last=False)
+        for field in fields:
+            stats[field] += 1
+            self._totals[field] += 1
+
+    def _join(self, key):
+        """
+        Register a caller for a key.
+
+        Returns:
+            tuple: (call, is_leader)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._count(key, "requests", "coalesced")
+                return call, False
+
+            self._count(key, "requests", "executions")
+            call = _InFlightCall()
+            self._calls[key] = call
+            return call, True
+
+    def _finish(self, key, call, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        with call.condition:
+            call.result = result
+            call.error = error
+            call.done = True
+            call.condition.notify_all()
+
+    def do(self, key, fn):
+        """
+        Run fn once for all concurrent callers of the same key.
+
+        Args:
+            key (hashable): Identity of the request
+            fn (callable): Computation to run if no identical call is in flight
+
+        Returns:
+            Any: Result of fn, shared between all coalesced callers
+        """
+        call, is_leader = self._join(key)
+
+        if is_leader:
+            try:
+                result = fn()
+            except Exception as e:
+                self._finish(key, call, error=e)
+                raise
+            self._finish(key, call, result=result)
+            return result
+
+        with call.condition:
+            while not call.done:
+                call.condition.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stream(self, key, producer):
+        """
+        Share a token stream between all concurrent callers of the same key.
+
+        The leader starts the producer in its own thread, and every caller,
+        the leader included, only reads the tokens it collects. A caller that
+        stops reading (a closed tab, a dropped connection) does not interrupt
+        the stream for the others. Callers that join late first receive the
+        tokens already produced and then follow the live stream.
+
+        Args:
+            key (hashable): Identity of the request
+            producer (callable): Returns an iterator of string tokens
+
+        Yields:
+            str: Tokens of the shared stream
+        """
+        call, is_leader = self._join(key)
+
+        if is_leader:
+            threading.Thread(
+                target=self._produce, args=(key, call, producer), name="coalesced-stream", daemon=True
+            ).start()
+
+        position = 0
+        while True:
+            with call.condition:
+                while position >= len(call.tokens) and not call.done:
+                    call.condition.wait()
+                pending = call.tokens[position:]
+                finished = call.done
+                error = call.error
+            for token in pending:
+                yield token
+            position += len(pending)
+            if finished and position >= len(call.tokens):
+                break
+        if error is not None:
+            raise error
+        if position == 0 and call.result:
+            # The leader was a non-streaming call, so emit its result whole
+            yield call.result
+
+    def _produce(self, key, call, producer):
+        try:
+            for token in producer():
+                with call.condition:
+                    call.tokens.append(token)
+                    call.condition.notify_all()
+        except Exception as e:
+            self._finish(key, call, error=e)
+            return
+        self._finish(key, call, result="".join(call.tokens))
+
+    def get_stats(self):
+        """
+        Get per-key coalescing metrics of the most recently used keys.
+
+        Returns:
+            dict: Mapping of key to requests, executions and coalesced counts
+        """
+        with self._lock:
+            return {key: dict(stats) for key, stats in self._stats.items()}
+
+    def get_top_keys(self, limit=10):
+        """
+        Get the keys that avoided the most duplicate work.
+
+        Args:
+            limit (int): Maximum number of keys
+
+        Returns:
+            list: (key, stats) pairs with at least one coalesced call, most
+                coalesced calls first
+        """
+        stats = [(key, value) for key, value in self.get_stats().items() if value["coalesced"]]
+        return sorted(stats, key=lambda item: item[1]["coalesced"], reverse=True)[:limit]
+
+    def get_summary(self):
+        """
+        Get coalescing metrics aggregated over all keys.
+
+        Returns:
+            dict: Total requests, executions, coalesced calls and in-flight keys
+        """
+        with self._lock:
+            return dict(self._totals, in_flight=len(self._calls))
+
+
+# Shared by every session served from this process
+coalescer = RequestCoalescer()
+
+
+def normalize_question(question):
+    """
+    Normalize a question so trivially different phrasings share a key.
+
+    Args:
+        question (str): Question text
+
+    Returns:
+        str: Lower-cased question with collapsed whitespace and no trailing punctuation
+    """
+    return " ".join(question.lower().split()).rstrip("?!. ")
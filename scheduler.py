@@ -0,0 +1,561 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# Lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class SchedulerError(Exception):
+    """
+    Base class for admission control errors.
+    """
+
+
+class SchedulerQueueFull(SchedulerError):
+    """
+    Raised when a priority class already has too many waiting calls.
+    """
+
+
+class SchedulerTimeout(SchedulerError):
+    """
+    Raised when a call waited longer than its timeout for admission.
+    """
+
+
+class _TokenBucket:
+    """
+    Token bucket refilled continuously up to a per-minute budget.
+    """
+
+    def __init__(self, per_minute, available=None, updated=None):
+        self.capacity = float(per_minute)
+        self.available = float(per_minute) if available is None else available
+        self.rate = per_minute / 60.0
+        self.updated = time.time() if updated is None else updated
+
+    def refill(self, now):
+        self.available = min(self.capacity, self.available + max(0.0, now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until(self, amount):
+        missing = amount - self.available
+        return max(0.0, missing / self.rate)
+
+
+class SchedulerBudget:
+    """
+    Interface for the rate budgets and slot counts that calls are admitted
+    against.
+
+    Each call is registered with enqueue() when it starts waiting, moved to
+    the active slots by a successful try_start(), and removed by finish()
+    when it completes or gives up. Interactive calls waiting anywhere hold
+    back background calls, and background calls can never take the slots
+    reserved for interactive chat.
+
+    Attributes:
+        poll_interval (float): Seconds between admission retries when slots
+            can be freed by other processes, or None if every release
+            happens in this process and wakes the waiters
+    """
+
+    poll_interval = None
+
+    def __init__(self, requests_per_minute, tokens_per_minute, max_concurrency, reserved_interactive):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.reserved_interactive = min(reserved_interactive, max_concurrency - 1)
+
+    def _admit(self, priority, tokens, active, queued_interactive, requests, token_bucket):
+        """
+        Decide whether a call can start, given the current usage.
+
+        Returns:
+            tuple: (admitted, seconds until the budgets can admit it or None)
+        """
+        if active >= self.max_concurrency:
+            return False, None
+        if priority != PRIORITY_INTERACTIVE:
+            if queued_interactive or active >= self.max_concurrency - self.reserved_interactive:
+                return False, None
+        if requests.available < 1 or token_bucket.available < tokens:
+            return False, max(requests.seconds_until(1), token_bucket.seconds_until(tokens))
+        requests.available -= 1
+        token_bucket.available -= tokens
+        return True, None
+
+    def enqueue(self, call_id, priority):
+        raise NotImplementedError
+
+    def try_start(self, call_id, tokens, priority):
+        """
+        Start a waiting call if the budgets and slots allow it.
+
+        Args:
+            call_id (str): Call registered with enqueue()
+            tokens (int): Estimated tokens used by the call
+            priority (int): PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND
+
+        Returns:
+            tuple: (started, seconds until the budgets can admit it or None)
+        """
+        raise NotImplementedError
+
+    def finish(self, call_id):
+        raise NotImplementedError
+
+    def get_usage(self):
+        """
+        Returns:
+            dict: Active and queued calls per priority
+        """
+        raise NotImplementedError
+
+
+class InMemoryBudget(SchedulerBudget):
+    """
+    Budget kept in process memory, for a deployment with a single process.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, max_concurrency, reserved_interactive):
+        super().__init__(requests_per_minute, tokens_per_minute, max_concurrency, reserved_interactive)
+        self._lock = threading.Lock()
+        self._requests = _TokenBucket(requests_per_minute)
+        self._tokens = _TokenBucket(tokens_per_minute)
+        self._calls = {}
+
+    def _count(self, state, priority):
+        return sum(1 for call in self._calls.values() if call == (state, priority))
+
+    def enqueue(self, call_id, priority):
+        with self._lock:
+            self._calls[call_id] = ("queued", priority)
+
+    def try_start(self, call_id, tokens, priority):
+        with self._lock:
+            now = time.time()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            active = sum(1 for state, _ in self._calls.values() if state == "active")
+            started, retry_after = self._admit(
+                priority, tokens, active, self._count("queued", PRIORITY_INTERACTIVE), self._requests, self._tokens
+            )
+            if started:
+                self._calls[call_id] = ("active", priority)
+            return started, retry_after
+
+    def finish(self, call_id):
+        with self._lock:
+            self._calls.pop(call_id, None)
+
+    def get_usage(self):
+        with self._lock:
+            return {
+                state: {priority: self._count(state, priority) for priority in (PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND)}
+                for state in ("active", "queued")
+            }
+
+
+class SQLiteBudget(SchedulerBudget):
+    """
+    Budget shared by every process on a host through a SQLite file.
+
+    The Streamlit app, each API worker and the loading scripts admit their
+    calls against the same buckets and slots, so together they stay within
+    the account's rate limits and a bulk ingestion in one process still
+    yields to chat in another. Calls of processes that exited are removed.
+    """
+
+    poll_interval = 0.1
+
+    # Calls registered longer ago than this are assumed lost
+    LEASE_SECONDS = 900
+    CLEANUP_INTERVAL = 5.0
+
+    def __init__(self, requests_per_minute, tokens_per_minute, max_concurrency, reserved_interactive,
+                 path="scheduler.db"):
+        super().__init__(requests_per_minute, tokens_per_minute, max_concurrency, reserved_interactive)
+        self.path = path
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+        # One connection per scheduler, used under the lock; transactions are explicit
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS calls (
+                id TEXT PRIMARY KEY,
+                pid INTEGER NOT NULL,
+                priority INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                updated REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, available REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so reading the usage
+        # and taking a slot cannot interleave with another process
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _cleanup(self, conn, now):
+        if now - self._last_cleanup < self.CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        conn.execute("DELETE FROM calls WHERE updated < ?", (now - self.LEASE_SECONDS,))
+        for (pid,) in conn.execute("SELECT DISTINCT pid FROM calls").fetchall():
+            if not _process_alive(pid):
+                conn.execute("DELETE FROM calls WHERE pid = ?", (pid,))
+
+    def _bucket(self, conn, name, per_minute):
+        row = conn.execute("SELECT available, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return _TokenBucket(per_minute)
+        return _TokenBucket(per_minute, available=row[0], updated=row[1])
+
+    def enqueue(self, call_id, priority):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO calls (id, pid, priority, state, updated) VALUES (?, ?, ?, 'queued', ?)",
+                (call_id, os.getpid(), priority, time.time())
+            )
+
+    def try_start(self, call_id, tokens, priority):
+        with self._transaction() as conn:
+            now = time.time()
+            self._cleanup(conn, now)
+            active = conn.execute("SELECT COUNT(*) FROM calls WHERE state = 'active'").fetchone()[0]
+            queued_interactive = conn.execute(
+                "SELECT COUNT(*) FROM calls WHERE state = 'queued' AND priority = ?", (PRIORITY_INTERACTIVE,)
+            ).fetchone()[0]
+            requests = self._bucket(conn, "requests", self.requests_per_minute)
+            token_bucket = self._bucket(conn, "tokens", self.tokens_per_minute)
+            requests.refill(now)
+            token_bucket.refill(now)
+
+            started, retry_after = self._admit(priority, tokens, active, queued_interactive, requests, token_bucket)
+            if started:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO buckets (name, available, updated) VALUES (?, ?, ?)",
+                    [("requests", requests.available, now), ("tokens", token_bucket.available, now)]
+                )
+                conn.execute("UPDATE calls SET state = 'active', updated = ? WHERE id = ?", (now, call_id))
+            return started, retry_after
+
+    def finish(self, call_id):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM calls WHERE id = ?", (call_id,))
+
+    def get_usage(self):
+        usage = {state: {PRIORITY_INTERACTIVE: 0, PRIORITY_BACKGROUND: 0} for state in ("active", "queued")}
+        with self._lock:
+            rows = self._conn.execute("SELECT state, priority, COUNT(*) FROM calls GROUP BY state, priority").fetchall()
+        for state, priority, count in rows:
+            usage[state][priority] = count
+        return usage
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class _Waiter:
+    def __init__(self, tokens, priority, user_id):
+        self.call_id = uuid.uuid4().hex
+        self.tokens = tokens
+        self.priority = priority
+        self.user_id = user_id
+        self.granted = False
+        self.enqueued = time.monotonic()
+
+
+class ModelCallScheduler:
+    """
+    Admission control for outbound model calls.
+
+    Every LLM and embedding request acquires a slot before it is sent. Slots
+    are granted within request-per-minute and token-per-minute budgets and a
+    concurrency limit, which can be shared between processes (see
+    SchedulerBudget). Interactive calls are always served before background
+    calls, users within a priority class are served round-robin, and
+    background work can never take the slots reserved for interactive chat.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=500,
+        tokens_per_minute=30000,
+        max_concurrency=8,
+        reserved_interactive=2,
+        max_queue_size=100,
+        default_timeout=60.0,
+        budget=None
+    ):
+        self.max_queue_size = max_queue_size
+        self.default_timeout = default_timeout
+        self.budget = budget or InMemoryBudget(
+            requests_per_minute, tokens_per_minute, max_concurrency, reserved_interactive
+        )
+
+        self._condition = threading.Condition()
+        # priority -> user_id -> deque of waiters; the OrderedDict order is
+        # the round-robin order of users
+        self._queues = {PRIORITY_INTERACTIVE: OrderedDict(), PRIORITY_BACKGROUND: OrderedDict()}
+        self._queued = {PRIORITY_INTERACTIVE: 0, PRIORITY_BACKGROUND: 0}
+        self._stats = {
+            "granted": 0,
+            "rejected": 0,
+            "timed_out": 0,
+            "total_wait": 0.0,
+        }
+
+    def _dispatch(self):
+        """
+        Grant slots to waiters in priority and round-robin order.
+
+        Must be called with the condition held.
+
+        Returns:
+            float: Seconds until the budgets can admit the next waiter, or None
+        """
+        now = time.monotonic()
+
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            while users:
+                user_id, waiters = next(iter(users.items()))
+                waiter = waiters[0]
+                started, retry_after = self.budget.try_start(waiter.call_id, waiter.tokens, priority)
+                if not started:
+                    return retry_after
+
+                waiters.popleft()
+                self._queued[priority] -= 1
+                # Move the user to the back so other users get the next turn
+                del users[user_id]
+                if waiters:
+                    users[user_id] = waiters
+
+                waiter.granted = True
+                # Wake the granted waiter, which may not be the dispatching thread
+                self._condition.notify_all()
+                self._stats["granted"] += 1
+                self._stats["total_wait"] += now - waiter.enqueued
+
+            # Lower priorities only run when no higher priority call is waiting
+            if users:
+                return None
+        return None
+
+    def acquire(self, tokens=1, priority=PRIORITY_INTERACTIVE, user_id="default", timeout=None):
+        """
+        Wait for permission to send a model call.
+
+        Args:
+            tokens (int): Estimated tokens used by the call
+            priority (int): PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND
+            user_id (str): User the call is made for, used for fair sharing
+            timeout (float): Seconds to wait before giving up
+
+        Returns:
+            str: Identifier of the granted slot, to be passed to release()
+
+        Raises:
+            SchedulerQueueFull: If the priority class queue is full
+            SchedulerTimeout: If no slot was granted within the timeout
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        # A single call can never need more than the whole budget
+        tokens = min(max(int(tokens), 1), int(self.budget.tokens_per_minute))
+        deadline = time.monotonic() + timeout
+
+        with self._condition:
+            if self._queued[priority] >= self.max_queue_size:
+                self._stats["rejected"] += 1
+                raise SchedulerQueueFull(
+                    f"Too many pending model calls ({self._queued[priority]}); please try again shortly"
+                )
+
+            waiter = _Waiter(tokens, priority, user_id)
+            self.budget.enqueue(waiter.call_id, priority)
+            self._queues[priority].setdefault(user_id, deque()).append(waiter)
+            self._queued[priority] += 1
+
+            while True:
+                retry_after = self._dispatch()
+                if waiter.granted:
+                    return waiter.call_id
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(waiter)
+                    self._stats["timed_out"] += 1
+                    raise SchedulerTimeout(f"Model call was not admitted within {timeout:g}s")
+
+                wait = remaining if retry_after is None else min(remaining, retry_after)
+                if self.budget.poll_interval is not None:
+                    # Slots freed by other processes don't wake this one
+                    wait = min(wait, self.budget.poll_interval)
+                self._condition.wait(wait)
+
+    def _remove(self, waiter):
+        users = self._queues[waiter.priority]
+        waiters = users.get(waiter.user_id)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            self._queued[waiter.priority] -= 1
+            if not waiters:
+                del users[waiter.user_id]
+        self.budget.finish(waiter.call_id)
+        # Lower-priority waiters may have been held back behind this one
+        self._condition.notify_all()
+
+    def release(self, slot):
+        """
+        Return a slot acquired with acquire().
+
+        Args:
+            slot (str): Slot identifier returned by acquire()
+        """
+        with self._condition:
+            self.budget.finish(slot)
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, tokens=1, priority=PRIORITY_INTERACTIVE, user_id="default", timeout=None):
+        """
+        Context manager that holds a slot for the duration of a model call.
+        """
+        granted = self.acquire(tokens, priority, user_id, timeout)
+        try:
+            yield
+        finally:
+            self.release(granted)
+
+    def get_stats(self):
+        """
+        Get admission statistics.
+
+        Returns:
+            dict: Active and queued calls per priority across every process
+                sharing the budget, and this process's grants, rejections,
+                timeouts and average queue wait
+        """
+        usage = self.budget.get_usage()
+        with self._condition:
+            granted = self._stats["granted"]
+            return {
+                "active_interactive": usage["active"][PRIORITY_INTERACTIVE],
+                "active_background": usage["active"][PRIORITY_BACKGROUND],
+                "queued_interactive": usage["queued"][PRIORITY_INTERACTIVE],
+                "queued_background": usage["queued"][PRIORITY_BACKGROUND],
+                "granted": granted,
+                "rejected": self._stats["rejected"],
+                "timed_out": self._stats["timed_out"],
+                "average_wait_seconds": self._stats["total_wait"] / granted if granted else 0.0,
+            }
+
+
+def estimate_tokens(text):
+    """
+    Roughly estimate the number of tokens in a text.
+
+    Args:
+        text (str): Text to estimate
+
+    Returns:
+        int: Estimated token count (about four characters per token)
+    """
+    return len(text) // 4 + 1
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def create_scheduler(path=None, **kwargs):
+    """
+    Create a scheduler with the budget configured for this deployment.
+
+    Budgets can be set with the MEDSTUDY_REQUESTS_PER_MINUTE,
+    MEDSTUDY_TOKENS_PER_MINUTE and MEDSTUDY_MAX_CONCURRENCY environment
+    variables to match the OpenAI account's rate limits.
+    MEDSTUDY_SCHEDULER_BACKEND selects where the budget is kept: "sqlite"
+    (the default) shares it between all processes through the database in
+    MEDSTUDY_SCHEDULER_DB, "memory" keeps it in this process.
+
+    Args:
+        path (str): SQLite database of the shared budget, overriding
+            MEDSTUDY_SCHEDULER_DB
+        **kwargs: ModelCallScheduler options, e.g. a different budget
+
+    Returns:
+        ModelCallScheduler: New scheduler
+    """
+    if "budget" not in kwargs:
+        limits = (
+            int(os.environ.get("MEDSTUDY_REQUESTS_PER_MINUTE", 500)),
+            int(os.environ.get("MEDSTUDY_TOKENS_PER_MINUTE", 30000)),
+            int(os.environ.get("MEDSTUDY_MAX_CONCURRENCY", 8)),
+            int(os.environ.get("MEDSTUDY_RESERVED_INTERACTIVE", 2)),
+        )
+        backend = os.environ.get("MEDSTUDY_SCHEDULER_BACKEND", "sqlite")
+        if backend == "memory":
+            kwargs["budget"] = InMemoryBudget(*limits)
+        elif backend == "sqlite":
+            kwargs["budget"] = SQLiteBudget(*limits, path=path or os.environ.get("MEDSTUDY_SCHEDULER_DB", "scheduler.db"))
+        else:
+            raise ValueError(f"Unknown scheduler backend: {backend}")
+    return ModelCallScheduler(**kwargs)
+
+
+def get_scheduler():
+    """
+    Get the scheduler shared by all model calls in this process.
+
+    Returns:
+        ModelCallScheduler: Shared scheduler
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = create_scheduler()
+        return _scheduler
+
+
+def set_scheduler(scheduler):
+    """
+    Replace the scheduler used by all model calls in this process.
+
+    Args:
+        scheduler (ModelCallScheduler): New scheduler, or None to create the
+            configured one on next use
+    """
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
@@ -0,0 +1,278 @@
+import heapq
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_community.vectorstores import Chroma
+from langchain.schema.vectorstore import VectorStore
+
+from embedding_backends import get_backend, check_collection_backend
+
+MANIFEST_FILE = "shards.json"
+
+# Store new collections as shards
+SHARDED_COLLECTIONS = os.environ.get("MEDSTUDY_SHARDED_COLLECTIONS", "0") == "1"
+
+# "document" keeps each document in one shard, "size" fills shards chunk by chunk
+SHARD_BY = os.environ.get("MEDSTUDY_SHARD_BY", "document")
+
+# Shards that documents are spread over in "document" mode
+SHARD_COUNT = int(os.environ.get("MEDSTUDY_SHARD_COUNT", 4))
+
+# Chunks per shard before a new shard is started
+SHARD_MAX_CHUNKS = int(os.environ.get("MEDSTUDY_SHARD_MAX_CHUNKS", 5000))
+
+# Threads searching shards at the same time
+SHARD_SEARCH_WORKERS = int(os.environ.get("MEDSTUDY_SHARD_SEARCH_WORKERS", 8))
+
+# Threads writing shards at the same time
+SHARD_WRITE_WORKERS = int(os.environ.get("MEDSTUDY_SHARD_WRITE_WORKERS", 4))
+
+# Separate pools, so searches never queue behind a long ingestion
+_search_pool = ThreadPoolExecutor(max_workers=SHARD_SEARCH_WORKERS, thread_name_prefix="shard-search")
+_write_pool = ThreadPoolExecutor(max_workers=SHARD_WRITE_WORKERS, thread_name_prefix="shard-write")
+_manifest_locks = {}
+_manifest_locks_lock = threading.Lock()
+
+
+def _manifest_path(session_id):
+    return f"chroma_db/{session_id}/{MANIFEST_FILE}"
+
+
+def _manifest_lock(session_id):
+    with _manifest_locks_lock:
+        return _manifest_locks.setdefault(session_id, threading.Lock())
+
+
+def is_sharded(session_id):
+    """
+    Check whether a session's documents are stored in shards.
+
+    Args:
+        session_id (str): Unique session identifier
+
+    Returns:
+        bool: True if the collection has a shard manifest
+    """
+    return os.path.exists(_manifest_path(session_id))
+
+
+def _sources_in_filter(search_filter):
+    """
+    Find the documents a Chroma filter restricts the search to.
+
+    Returns:
+        set: Document names, or None if the filter does not restrict documents
+    """
+    if not search_filter:
+        return None
+    conditions = search_filter.get("$and", [search_filter])
+    for condition in conditions:
+        source = condition.get("source")
+        if isinstance(source, dict) and "$in" in source:
+            return set(source["$in"])
+        if isinstance(source, str):
+            return {source}
+    return None
+
+
+class ShardedVectorStore(VectorStore):
+    """
+    A session's document collection split across several Chroma collections.
+
+    Shards live in the session directory next to each other and are listed
+    in a manifest with the documents each one holds. Writes to different
+    shards run in parallel, and a search embeds the query once, searches
+    the shards concurrently and merges their results into one top k. Shards
+    that cannot hold a document named in the filter are skipped.
+    """
+
+    def __init__(self, session_id, embeddings, shard_by=SHARD_BY, max_chunks=SHARD_MAX_CHUNKS,
+                 shard_count=SHARD_COUNT):
+        self.session_id = session_id
+        self._embeddings = embeddings
+        self._shards = {}
+        self._shards_lock = threading.Lock()
+        self._lock = _manifest_lock(session_id)
+
+        with self._lock:
+            if is_sharded(session_id):
+                self._load_manifest()
+            else:
+                os.makedirs(f"chroma_db/{session_id}", exist_ok=True)
+                self.manifest = {
+                    "shard_by": shard_by,
+                    "max_chunks": max_chunks,
+                    "shard_count": shard_count,
+                    "shards": []
+                }
+                self._save_manifest()
+
+    @property
+    def embeddings(self):
+        return self._embeddings
+
+    def _load_manifest(self):
+        with open(_manifest_path(self.session_id), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+
+    def _save_manifest(self):
+        path = _manifest_path(self.session_id)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(temp_path, path)
+
+    def _shard(self, name):
+        with self._shards_lock:
+            if name not in self._shards:
+                shard = Chroma(
+                    collection_name=name,
+                    embedding_function=self._embeddings,
+                    persist_directory=f"chroma_db/{self.session_id}"
+                )
+                check_collection_backend(shard._collection, get_backend())
+                self._shards[name] = shard
+            return self._shards[name]
+
+    def _new_shard(self):
+        entry = {"name": f"medical_documents_{len(self.manifest['shards']):03d}", "sources": [], "chunks": 0}
+        self.manifest["shards"].append(entry)
+        return entry
+
+    def _assign(self, metadatas):
+        """
+        Pick a shard for each chunk and update the manifest.
+
+        Returns:
+            dict: Mapping of shard name to the indexes of its chunks
+        """
+        assigned = {}
+        max_chunks = self.manifest["max_chunks"]
+        shards = self.manifest["shards"]
+
+        if self.manifest["shard_by"] == "document":
+            shard_count = self.manifest["shard_count"]
+            by_source = {}
+            for i, metadata in enumerate(metadatas):
+                by_source.setdefault(metadata.get("source"), []).append(i)
+            for source, indexes in by_source.items():
+                # Documents are spread over shard_count shards; after that a
+                # document goes to the emptiest shard it fits in, or a new one
+                open_shards = [entry for entry in shards if entry["chunks"] + len(indexes) <= max_chunks]
+                if len(shards) < shard_count or not open_shards:
+                    entry = self._new_shard()
+                else:
+                    entry = min(open_shards, key=lambda e: e["chunks"])
+                assigned.setdefault(entry["name"], []).extend(indexes)
+                entry["chunks"] += len(indexes)
+                if source not in entry["sources"]:
+                    entry["sources"].append(source)
+        else:
+            entry = shards[-1] if shards else self._new_shard()
+            for i, metadata in enumerate(metadatas):
+                if entry["chunks"] >= max_chunks:
+                    entry = self._new_shard()
+                assigned.setdefault(entry["name"], []).append(i)
+                entry["chunks"] += 1
+                if metadata.get("source") not in entry["sources"]:
+                    entry["sources"].append(metadata.get("source"))
+
+        return assigned
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+
+        with self._lock:
+            # Another store object may have added shards since this one was opened
+            self._load_manifest()
+            assigned = self._assign(metadatas)
+            self._save_manifest()
+
+        def write(name):
+            indexes = assigned[name]
+            return self._shard(name).add_texts(
+                [texts[i] for i in indexes],
+                metadatas=[metadatas[i] for i in indexes],
+                ids=[ids[i] for i in indexes]
+            )
+
+        # Each shard embeds and indexes its own chunks
+        list(_write_pool.map(write, assigned))
+        return ids
+
+    def _search_shards(self, search_filter):
+        sources = _sources_in_filter(search_filter)
+        return [
+            entry["name"] for entry in self.manifest["shards"]
+            if entry["chunks"] and (sources is None or sources & set(entry["sources"]))
+        ]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, filter=None, **kwargs):
+        names = self._search_shards(filter)
+
+        def search(name):
+            return self._shard(name).similarity_search_by_vector_with_relevance_scores(
+                embedding, k=k, filter=filter, **kwargs
+            )
+
+        # Scores are distances, so the k smallest across shards are the top k
+        results = [result for shard_results in _search_pool.map(search, names) for result in shard_results]
+        return heapq.nsmallest(k, results, key=lambda result: result[1])
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        embedding = self._embeddings.embed_query(query)
+        return self.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=filter, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        results = self.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=filter, **kwargs)
+        return [doc for doc, _ in results]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        results = self.similarity_search_with_score(query, k=k, filter=filter, **kwargs)
+        return [doc for doc, _ in results]
+
+    def _select_relevance_score_fn(self):
+        shards = self.manifest["shards"]
+        if not shards:
+            return self._euclidean_relevance_score_fn
+        return self._shard(shards[0]["name"])._select_relevance_score_fn()
+
+    def get(self, where=None, include=None, **kwargs):
+        """
+        Get chunks from every shard, like Chroma.get.
+
+        Returns:
+            dict: Concatenated "ids" and the included fields of all shards
+        """
+        names = self._search_shards(where)
+        merged = {"ids": []}
+        for result in _search_pool.map(lambda name: self._shard(name).get(where=where, include=include, **kwargs), names):
+            for key, values in result.items():
+                if key != "included" and values is not None:
+                    merged.setdefault(key, []).extend(values)
+        for key in include or ["documents", "metadatas"]:
+            merged.setdefault(key, [])
+        return merged
+
+    def delete(self, ids=None, **kwargs):
+        for entry in self.manifest["shards"]:
+            self._shard(entry["name"]).delete(ids=ids, **kwargs)
+
+    def persist(self):
+        # Chroma persists every write; only the manifest is kept here
+        with self._lock:
+            self._save_manifest()
+
+    def __len__(self):
+        return sum(len(self._shard(entry["name"])) for entry in self.manifest["shards"])
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, session_id=None, **kwargs):
+        store = cls(session_id or str(uuid.uuid4()), embedding, **kwargs)
+        store.add_texts(texts, metadatas)
+        return store
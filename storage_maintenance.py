@@ -0,0 +1,322 @@
+import argparse
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+CHROMA_ROOT = "chroma_db"
+ACCESS_MARKER = ".last_access"
+CHROMA_SQLITE_FILE = "chroma.sqlite3"
+
+# Collections used more recently than this are never expired
+MIN_IDLE_SECONDS = 3600
+
+
+def touch_collection(session_id, root=CHROMA_ROOT):
+    """
+    Record that a collection was just used.
+
+    Args:
+        session_id (str): Collection (session) identifier
+        root (str): Directory holding all collections
+    """
+    path = os.path.join(root, session_id)
+    if not os.path.isdir(path):
+        return
+
+    marker = os.path.join(path, ACCESS_MARKER)
+    try:
+        with open(marker, "a"):
+            os.utime(marker, None)
+    except OSError:
+        # Access tracking must never break serving
+        pass
+
+
+def _directory_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+def get_collection_size(session_id, root=CHROMA_ROOT):
+    """
+    Get the disk usage of a collection.
+
+    Args:
+        session_id (str): Collection (session) identifier
+        root (str): Directory holding all collections
+
+    Returns:
+        int: Size in bytes
+    """
+    return _directory_size(os.path.join(root, session_id))
+
+
+def _protected_sessions():
+    # The fixed session written by the loader scripts is always kept
+    if os.path.exists("session_id.txt"):
+        with open("session_id.txt", "r") as f:
+            return {f.read().strip()}
+    return set()
+
+
+def list_collections(root=CHROMA_ROOT):
+    """
+    List all collections with their disk usage and last access time.
+
+    Args:
+        root (str): Directory holding all collections
+
+    Returns:
+        list: Dicts with session_id, path, size_bytes, last_access and protected
+    """
+    if not os.path.isdir(root):
+        return []
+
+    protected = _protected_sessions()
+    collections = []
+    for session_id in os.listdir(root):
+        path = os.path.join(root, session_id)
+        if not os.path.isdir(path):
+            continue
+
+        marker = os.path.join(path, ACCESS_MARKER)
+        last_access = os.path.getmtime(marker if os.path.exists(marker) else path)
+        collections.append({
+            "session_id": session_id,
+            "path": path,
+            "size_bytes": _directory_size(path),
+            "last_access": last_access,
+            "protected": session_id in protected
+        })
+
+    return sorted(collections, key=lambda collection: collection["last_access"])
+
+
+def expire_collections(max_age_days=7, max_total_bytes=None, root=CHROMA_ROOT, dry_run=False):
+    """
+    Delete idle collections according to an age and size policy.
+
+    Collections idle for longer than max_age_days are removed first. If the
+    remaining collections still use more than max_total_bytes, the least
+    recently used ones are removed until they fit. Protected collections and
+    collections used within the last hour are always kept.
+
+    Args:
+        max_age_days (float): Maximum idle time before a collection expires
+        max_total_bytes (int): Maximum total size of all collections, or None
+        root (str): Directory holding all collections
+        dry_run (bool): Only report what would be removed
+
+    Returns:
+        list: Collection dicts that were (or would be) removed
+    """
+    now = time.time()
+    collections = list_collections(root)
+    removable = [
+        collection for collection in collections
+        if not collection["protected"] and now - collection["last_access"] > MIN_IDLE_SECONDS
+    ]
+
+    expired = [
+        collection for collection in removable
+        if now - collection["last_access"] > max_age_days * 86400
+    ]
+
+    if max_total_bytes is not None:
+        total = sum(collection["size_bytes"] for collection in collections)
+        total -= sum(collection["size_bytes"] for collection in expired)
+        # removable is ordered least recently used first
+        for collection in removable:
+            if total <= max_total_bytes:
+                break
+            if collection not in expired:
+                expired.append(collection)
+                total -= collection["size_bytes"]
+
+    if not dry_run:
+        for collection in expired:
+            shutil.rmtree(collection["path"], ignore_errors=True)
+
+    return expired
+
+
+def compact_collection(path):
+    """
+    Compact a collection's storage.
+
+    Removes index segment directories no longer referenced by the Chroma
+    database and vacuums the SQLite file.
+
+    Args:
+        path (str): Collection directory
+
+    Returns:
+        int: Bytes reclaimed
+    """
+    database = os.path.join(path, CHROMA_SQLITE_FILE)
+    if not os.path.exists(database):
+        return 0
+
+    size_before = _directory_size(path)
+
+    conn = sqlite3.connect(database, timeout=30)
+    try:
+        segment_ids = {row[0] for row in conn.execute("SELECT id FROM segments")}
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    # Each vector index segment lives in a directory named after its id
+    for entry in os.listdir(path):
+        entry_path = os.path.join(path, entry)
+        if os.path.isdir(entry_path) and entry not in segment_ids:
+            shutil.rmtree(entry_path, ignore_errors=True)
+
+    return max(0, size_before - _directory_size(path))
+
+
+def compact_collections(root=CHROMA_ROOT, min_idle_seconds=MIN_IDLE_SECONDS):
+    """
+    Compact every collection that is not currently in use.
+
+    Args:
+        root (str): Directory holding all collections
+        min_idle_seconds (float): Skip collections used more recently than this
+
+    Returns:
+        int: Total bytes reclaimed
+    """
+    now = time.time()
+    reclaimed = 0
+    for collection in list_collections(root):
+        if now - collection["last_access"] < min_idle_seconds:
+            continue
+        try:
+            reclaimed += compact_collection(collection["path"])
+        except sqlite3.Error as e:
+            print(f"Error compacting {collection['session_id']}: {str(e)}")
+    return reclaimed
+
+
+def run_maintenance(max_age_days=7, max_total_bytes=None, root=CHROMA_ROOT):
+    """
+    Expire idle collections and compact the remaining ones.
+
+    Args:
+        max_age_days (float): Maximum idle time before a collection expires
+        max_total_bytes (int): Maximum total size of all collections, or None
+        root (str): Directory holding all collections
+
+    Returns:
+        dict: Number of expired collections and bytes reclaimed by compaction
+    """
+    expired = expire_collections(max_age_days, max_total_bytes, root)
+    reclaimed = compact_collections(root)
+    return {"expired": len(expired), "compacted_bytes": reclaimed}
+
+
+_background_thread = None
+_background_lock = threading.Lock()
+
+
+def start_background_maintenance(interval_seconds=3600, max_age_days=None, max_total_bytes=None, root=CHROMA_ROOT):
+    """
+    Run maintenance periodically in a daemon thread, once per process.
+
+    The policy defaults to the MEDSTUDY_COLLECTION_MAX_AGE_DAYS (default 7)
+    and MEDSTUDY_STORAGE_MAX_MB (default unlimited) environment variables.
+
+    Args:
+        interval_seconds (float): Time between maintenance runs
+        max_age_days (float): Maximum idle time before a collection expires
+        max_total_bytes (int): Maximum total size of all collections, or None
+        root (str): Directory holding all collections
+    """
+    global _background_thread
+    if max_age_days is None:
+        max_age_days = float(os.environ.get("MEDSTUDY_COLLECTION_MAX_AGE_DAYS", 7))
+    if max_total_bytes is None and os.environ.get("MEDSTUDY_STORAGE_MAX_MB"):
+        max_total_bytes = int(float(os.environ["MEDSTUDY_STORAGE_MAX_MB"]) * 1024 * 1024)
+
+    with _background_lock:
+        if _background_thread is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    run_maintenance(max_age_days, max_total_bytes, root)
+                except Exception as e:
+                    print(f"Error during storage maintenance: {str(e)}")
+
+        _background_thread = threading.Thread(target=loop, name="storage-maintenance", daemon=True)
+        _background_thread.start()
+
+
+def format_size(size_bytes):
+    """
+    Format a byte count for display.
+
+    Args:
+        size_bytes (int): Number of bytes
+
+    Returns:
+        str: Human readable size
+    """
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size_bytes < 1024 or unit == "GB":
+            return f"{size_bytes:.1f} {unit}" if unit != "B" else f"{size_bytes} B"
+        size_bytes /= 1024
+
+
+def print_report(root=CHROMA_ROOT):
+    """
+    Print disk usage and last access time of every collection.
+
+    Args:
+        root (str): Directory holding all collections
+    """
+    collections = list_collections(root)
+    now = time.time()
+    for collection in collections:
+        idle_hours = (now - collection["last_access"]) / 3600
+        flag = " (protected)" if collection["protected"] else ""
+        print(f"{collection['session_id']:<40} {format_size(collection['size_bytes']):>10}  idle {idle_hours:8.1f}h{flag}")
+    total = sum(collection["size_bytes"] for collection in collections)
+    print(f"{len(collections)} collections, {format_size(total)} total")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain per-session Chroma collections")
+    parser.add_argument("command", choices=["report", "gc", "compact"])
+    parser.add_argument("--root", default=CHROMA_ROOT, help="Directory holding all collections")
+    parser.add_argument("--max-age-days", type=float, default=7, help="Expire collections idle for longer than this")
+    parser.add_argument("--max-total-mb", type=float, default=None, help="Expire least recently used collections above this total size")
+    parser.add_argument("--dry-run", action="store_true", help="Only show what would be removed")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        print_report(args.root)
+    elif args.command == "gc":
+        max_total_bytes = int(args.max_total_mb * 1024 * 1024) if args.max_total_mb is not None else None
+        expired = expire_collections(args.max_age_days, max_total_bytes, args.root, args.dry_run)
+        action = "Would remove" if args.dry_run else "Removed"
+        for collection in expired:
+            print(f"{action} {collection['session_id']} ({format_size(collection['size_bytes'])})")
+        print(f"{action} {len(expired)} collections")
+    elif args.command == "compact":
+        reclaimed = compact_collections(args.root)
+        print(f"Reclaimed {format_size(reclaimed)}")
+
+
+if __name__ == "__main__":
+    main()
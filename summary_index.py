@@ -0,0 +1,326 @@
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain.schema.document import Document
+from langchain.schema.messages import HumanMessage, SystemMessage
+
+from context_packer import count_tokens
+from embedding_manager import (
+    get_embeddings,
+    load_existing_vectorstore,
+    open_collection,
+    collection_exists,
+    refresh_chroma_client
+)
+from query_cache import get_generation, invalidate_session
+from scheduler import get_scheduler, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+
+SUMMARY_COLLECTION = "medical_summaries"
+
+LEVEL_SECTION = "section"
+LEVEL_DOCUMENT = "document"
+LEVEL_CHUNK = "chunk"
+
+# Consecutive chunks summarized together
+MAX_CHUNKS_PER_SUMMARY = 6
+# Section summaries combined in one reduction step
+MAX_SUMMARIES_PER_REDUCTION = 12
+
+SECTION_PROMPT = (
+    "Summarize this part of a medical student's study material in at most 150 words. "
+    "Keep key terms, mechanisms, numbers and clinical points."
+)
+DOCUMENT_PROMPT = (
+    "Combine these section summaries of one document into an overview of at most 300 words. "
+    "Cover every major topic in the order it appears."
+)
+
+_BROAD_TERMS = re.compile(
+    r"\b(summari[sz]e|summary|overview|outline|main (points|ideas|topics)|key (points|takeaways|concepts)"
+    r"|what (is|are) (this|these|the) .{0,30}about|recap|tl;?dr)\b",
+    re.IGNORECASE
+)
+# A reference to the study material as a whole; "chapter 3" names a section
+_DOCUMENT_REFERENCE = re.compile(
+    r"\b(lecture|chapter(?!\s+\d)|document|book|textbook|notes|pdf|file|slide|handout|whole|entire|everything)s?\b",
+    re.IGNORECASE
+)
+# Words that phrase a summary request without naming a topic
+_REQUEST_WORDS = {
+    "a", "about", "all", "an", "and", "are", "brief", "can", "concise", "concepts", "could",
+    "cover", "covers", "do", "does", "dr", "entire", "everything", "for", "from", "general",
+    "give", "i", "ideas", "in", "is", "it", "its", "key", "main", "me", "my", "of", "on",
+    "our", "outline", "overall", "overview", "please", "points", "provide", "quick", "recap",
+    "say", "says", "short", "summarise", "summarize", "summary", "takeaways", "that", "the",
+    "these", "this", "those", "tl", "tldr", "to", "topics", "what", "whole", "would", "write",
+    "you"
+}
+_WORD = re.compile(r"[a-z0-9]+")
+
+# Summary stores by (session_id, priority), with the generation they were
+# opened at, so a reset or re-created collection is opened again
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def route_query(question):
+    """
+    Decide which level of the index should answer a question.
+
+    Only questions about the material as a whole ("summarize this lecture",
+    "give me an overview of my notes") are answered from summaries alone.
+    Broad questions that name a topic ("summarize what the lecture says
+    about ACE inhibitors", "summarize chapter 3") still need the chunk-level
+    detail, so their section summaries are added to the retrieved chunks.
+
+    Args:
+        question (str): Standalone question
+
+    Returns:
+        str: LEVEL_DOCUMENT for whole-document questions, LEVEL_SECTION for
+            other broad questions, LEVEL_CHUNK for specific questions
+    """
+    if not _BROAD_TERMS.search(question):
+        return LEVEL_CHUNK
+    if not _DOCUMENT_REFERENCE.search(question):
+        return LEVEL_SECTION
+
+    # Anything left besides the request and the document is the topic
+    remainder = _DOCUMENT_REFERENCE.sub(" ", question).lower()
+    if all(word in _REQUEST_WORDS for word in _WORD.findall(remainder)):
+        return LEVEL_DOCUMENT
+    return LEVEL_SECTION
+
+
+def get_summary_store(session_id, priority=PRIORITY_INTERACTIVE, create=False):
+    """
+    Open the summary layer of a collection.
+
+    Args:
+        session_id (str): Unique session identifier
+        priority (int): Scheduler priority for embeddings
+        create (bool): Create the summary layer if it does not exist
+
+    Returns:
+        Chroma: Summary vector store, or None if no summaries were built
+    """
+    path = f"chroma_db/{session_id}"
+    if not os.path.exists(path):
+        return None
+
+    key = (session_id, priority)
+    generation = get_generation(session_id)
+    with _stores_lock:
+        cached = _stores.get(key)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        refresh_chroma_client(session_id)
+        if not create and not collection_exists(session_id, SUMMARY_COLLECTION):
+            return None
+        store = open_collection(session_id, get_embeddings(priority, session_id), SUMMARY_COLLECTION)
+        _stores[key] = (generation, store)
+        return store
+
+
+def _summarize(llm, instructions, text, session_id):
+    messages = [SystemMessage(content=instructions), HumanMessage(content=text)]
+    tokens = count_tokens(instructions + text) + 400
+    with get_scheduler().slot(tokens, PRIORITY_BACKGROUND, session_id):
+        return llm.invoke(messages).content.strip()
+
+
+def _group_chunks(chunks):
+    """
+    Group a document's chunks into consecutive runs within one section.
+    """
+    groups = []
+    for chunk in chunks:
+        section = chunk.metadata.get("section", "")
+        current = groups[-1] if groups else None
+        if current and current["section"] == section and len(current["chunks"]) < MAX_CHUNKS_PER_SUMMARY:
+            current["chunks"].append(chunk)
+        elif current and len(current["chunks"]) == 1 and len(current["chunks"][0].page_content) < 500:
+            # A heading-only section is folded into the next one
+            current["chunks"].append(chunk)
+            current["section"] = section
+        else:
+            groups.append({"section": section, "chunks": [chunk]})
+    return groups
+
+
+def _span_metadata(source, level, documents):
+    metadata = {
+        "source": source,
+        "level": level,
+        "chunk_start": min(doc.metadata.get("chunk_start", doc.metadata.get("chunk", 0)) for doc in documents),
+        "chunk_end": max(doc.metadata.get("chunk_end", doc.metadata.get("chunk", 0)) for doc in documents),
+    }
+    pages = [doc.metadata for doc in documents if "page_start" in doc.metadata]
+    if pages:
+        metadata["page_start"] = min(page["page_start"] for page in pages)
+        metadata["page_end"] = max(page["page_end"] for page in pages)
+    return metadata
+
+
+def summarize_document(llm, source, chunks, session_id, parallelism=4):
+    """
+    Build the summary tree of one document.
+
+    Runs of chunks within a section are summarized first, then section
+    summaries are reduced level by level into one document summary.
+
+    Args:
+        llm (ChatOpenAI): Language model
+        source (str): Document name
+        chunks (list): The document's chunk Documents in order
+        session_id (str): Unique session identifier
+        parallelism (int): Maximum concurrent model calls
+
+    Returns:
+        list: Section and document summary Documents
+    """
+    groups = _group_chunks(chunks)
+
+    def summarize_group(group):
+        text = "\n\n".join(chunk.page_content for chunk in group["chunks"])
+        metadata = _span_metadata(source, LEVEL_SECTION, group["chunks"])
+        metadata["section"] = group["section"]
+        return Document(page_content=_summarize(llm, SECTION_PROMPT, text, session_id), metadata=metadata)
+
+    with ThreadPoolExecutor(max_workers=parallelism) as pool:
+        sections = list(pool.map(summarize_group, groups))
+
+        level = sections
+        while len(level) > 1:
+            batches = [
+                level[i:i + MAX_SUMMARIES_PER_REDUCTION]
+                for i in range(0, len(level), MAX_SUMMARIES_PER_REDUCTION)
+            ]
+
+            def reduce_batch(batch):
+                text = "\n\n".join(
+                    f"{doc.metadata.get('section') or 'Section'}:\n{doc.page_content}" for doc in batch
+                )
+                return Document(
+                    page_content=_summarize(llm, DOCUMENT_PROMPT, text, session_id),
+                    metadata=_span_metadata(source, LEVEL_DOCUMENT, batch)
+                )
+
+            level = list(pool.map(reduce_batch, batches))
+
+    if len(sections) == 1:
+        document = Document(
+            page_content=sections[0].page_content,
+            metadata=_span_metadata(source, LEVEL_DOCUMENT, sections)
+        )
+    else:
+        document = level[0]
+
+    for doc in sections + [document]:
+        doc.page_content = f"[{doc.metadata['level'].capitalize()} summary of {source}] {doc.page_content}"
+    return sections + [document]
+
+
+def build_summary_index(session_id, parallelism=4):
+    """
+    Build section and document summaries for every document of a collection
+    that does not have them yet.
+
+    Args:
+        session_id (str): Unique session identifier
+        parallelism (int): Maximum concurrent model calls
+
+    Returns:
+        int: Number of summaries added
+    """
+    # Imported here because chat_handler routes queries through this module
+    from chat_handler import get_llm
+
+    vectorstore = load_existing_vectorstore(session_id, priority=PRIORITY_BACKGROUND)
+    summary_store = get_summary_store(session_id, priority=PRIORITY_BACKGROUND, create=True)
+    if vectorstore is None or summary_store is None:
+        return 0
+
+    summarized = {
+        metadata.get("source")
+        for metadata in summary_store.get(where={"level": LEVEL_DOCUMENT}, include=["metadatas"])["metadatas"]
+    }
+
+    stored = vectorstore.get(include=["documents", "metadatas"])
+    by_source = {}
+    for content, metadata in zip(stored["documents"], stored["metadatas"]):
+        source = metadata.get("source")
+        if source is not None and source not in summarized:
+            by_source.setdefault(source, []).append(Document(page_content=content, metadata=metadata))
+
+    llm = get_llm()
+    added = 0
+    for source, chunks in by_source.items():
+        chunks.sort(key=lambda chunk: chunk.metadata.get("chunk", 0))
+        print(f"Summarizing {source} ({len(chunks)} chunks)...")
+        try:
+            summaries = summarize_document(llm, source, chunks, session_id, parallelism)
+        except Exception as e:
+            print(f"Error summarizing {source}: {str(e)}")
+            continue
+
+        # The whole tree is stored at once, so an interrupted build redoes
+        # the source on the next run instead of leaving it half summarized
+        summary_store.add_documents(summaries)
+        added += len(summaries)
+
+    if added:
+        # Broad questions are now answered from the summaries
+        invalidate_session(session_id)
+
+    return added
+
+
+def start_summary_build(session_id):
+    """
+    Build the summary index in a background thread.
+
+    Args:
+        session_id (str): Unique session identifier
+    """
+    threading.Thread(
+        target=build_summary_index,
+        args=(session_id,),
+        name=f"summaries-{session_id}",
+        daemon=True
+    ).start()
+
+
+def retrieve_summaries(session_id, question, level, search_filter=None, k=3, priority=PRIORITY_INTERACTIVE):
+    """
+    Retrieve summaries of one level for a broad question.
+
+    Args:
+        session_id (str): Unique session identifier
+        question (str): Standalone question
+        level (str): LEVEL_SECTION or LEVEL_DOCUMENT
+        search_filter (dict): Chroma filter restricting the search scope
+        k (int): Number of summaries to retrieve
+        priority (int): Scheduler priority for the query embedding
+
+    Returns:
+        list: Summary Documents, empty if no summaries exist
+    """
+    summary_store = get_summary_store(session_id, priority=priority)
+    if summary_store is None or len(summary_store) == 0:
+        return []
+
+    level_filter = {"level": level}
+    where = level_filter if search_filter is None else {"$and": [level_filter, search_filter]}
+    return summary_store.similarity_search(question, k=k, filter=where)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python summary_index.py <session_id>")
+        sys.exit(1)
+
+    print(f"Added {build_summary_index(sys.argv[1])} summaries")
@@ -0,0 +1,149 @@
+import json
+import re
+
+import pytest
+from langchain.schema.document import Document
+
+import batch_qa
+import context_packer
+from batch_qa import _parse_results, group_by_context, items_from_prompts, load_checkpoint, run_batch
+from scheduler import InMemoryBudget, ModelCallScheduler
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeLLM:
+    """Answers every request of a call with its number, failing on demand."""
+
+    def __init__(self, fail_after=None):
+        self.calls = 0
+        self.fail_after = fail_after
+
+    def invoke(self, messages):
+        self.calls += 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            raise RuntimeError("interrupted")
+        count = int(re.search(r"Answer these (\d+) requests", messages[1].content).group(1))
+        return FakeResponse(json.dumps([{"answer": str(i)} for i in range(count)]))
+
+
+class FakeEmbeddings:
+    def __init__(self, topics):
+        self.topics = topics
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [self.topics[text] for text in texts]
+
+
+class FakeVectorStore:
+    """Returns the chunks listed for a topic vector."""
+
+    def __init__(self, topics, chunks):
+        self.embeddings = FakeEmbeddings(topics)
+        self.chunks = chunks
+
+    def similarity_search_by_vector(self, vector, k=5):
+        return [
+            Document(page_content=f"chunk {index} text", metadata={"source": "notes.pdf", "chunk": index})
+            for index in self.chunks[vector][:k]
+        ]
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    monkeypatch.setattr(context_packer, "_get_encoding", lambda model: None)
+    scheduler = ModelCallScheduler(budget=InMemoryBudget(6000, 1000000, 4, 1))
+    monkeypatch.setattr(batch_qa, "get_scheduler", lambda: scheduler)
+
+
+def single_item_groups(prompts):
+    return [
+        {"items": [item], "docs": [Document(page_content=item["prompt"], metadata={})]}
+        for item in items_from_prompts(prompts, "answer")
+    ]
+
+
+def test_checkpoint_skips_truncated_last_line(tmp_path):
+    path = tmp_path / "out.jsonl"
+    path.write_text(
+        json.dumps({"id": "a", "result": 1}) + "\n\n"
+        + json.dumps({"id": "b", "result": 2}) + "\n"
+        + '{"id": "c", "res'
+    )
+    assert sorted(load_checkpoint(str(path))) == ["a", "b"]
+    assert load_checkpoint(str(tmp_path / "missing.jsonl")) == {}
+
+
+def test_interrupted_run_resumes(tmp_path, monkeypatch, offline):
+    path = str(tmp_path / "out.jsonl")
+    groups = single_item_groups([f"What is drug {i}?" for i in range(4)])
+
+    monkeypatch.setattr(batch_qa, "get_llm", lambda: FakeLLM(fail_after=2))
+    first = run_batch(groups, "answer", path, parallelism=1)
+    assert (first["generated"], first["failed"]) == (2, 2)
+
+    # A crash mid-write leaves a partial record behind
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"id": "partial"')
+
+    llm = FakeLLM()
+    monkeypatch.setattr(batch_qa, "get_llm", lambda: llm)
+    second = run_batch(groups, "answer", path, parallelism=1)
+    assert (second["generated"], second["skipped"], second["failed"]) == (2, 2, 0)
+    assert llm.calls == 2
+
+    done = load_checkpoint(path)
+    assert sorted(done) == sorted(group["items"][0]["id"] for group in groups)
+
+
+def test_parse_results_accepts_fenced_json():
+    text = '```json\n[{"answer": "a"}, {"answer": "b"}]\n```'
+    assert _parse_results(text, 2) == [{"answer": "a"}, {"answer": "b"}]
+    assert _parse_results('  [{"answer": "a"}]  ', 1) == [{"answer": "a"}]
+
+
+def test_parse_results_rejects_wrong_length():
+    with pytest.raises(ValueError):
+        _parse_results('[{"answer": "a"}]', 2)
+    with pytest.raises(ValueError):
+        _parse_results('{"answer": "a"}', 1)
+
+
+def test_group_by_context_deduplicates_and_groups():
+    topics = {
+        "what do ace inhibitors do": (1.0, 0.0),
+        "side effects of ace inhibitors": (0.9, 0.1),
+        "how do beta blockers work": (0.0, 1.0),
+    }
+    chunks = {(1.0, 0.0): [1, 2, 3], (0.9, 0.1): [1, 2, 3, 4], (0.0, 1.0): [7, 8, 9]}
+    vectorstore = FakeVectorStore(topics, chunks)
+    items = [
+        {"id": "1", "prompt": "What do ACE inhibitors do?"},
+        {"id": "2", "prompt": "what do ace inhibitors do?"},
+        {"id": "3", "prompt": "Side effects of ACE inhibitors?"},
+        {"id": "4", "prompt": "How do beta blockers work?"},
+    ]
+
+    groups = group_by_context(items, vectorstore, max_group_size=5, min_overlap=0.6)
+
+    # Identical prompts are embedded once, in a single batched call
+    assert vectorstore.embeddings.calls == [list(topics)]
+    assert [[item["id"] for item in group["items"]] for group in groups] == [["1", "2", "3"], ["4"]]
+    # Shared chunks appear once in the group's context
+    assert [doc.metadata["chunk"] for doc in groups[0]["docs"]] == [1, 2, 3, 4]
+    assert all("keys" not in group for group in groups)
+
+
+def test_group_by_context_respects_group_size():
+    topics = {"q": (1.0,)}
+    vectorstore = FakeVectorStore(topics, {(1.0,): [1, 2]})
+    items = [{"id": str(i), "prompt": "q"} for i in range(5)]
+
+    groups = group_by_context(items, vectorstore, max_group_size=2)
+
+    assert [len(group["items"]) for group in groups] == [2, 2, 1]
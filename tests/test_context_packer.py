@@ -0,0 +1,37 @@
+from langchain.schema.document import Document
+
+import context_packer
+from context_packer import merge_adjacent_chunks, count_tokens, truncate_to_tokens
+
+
+def overlapping_chunks(count):
+    body = "".join(f"sentence number {i:03d} of the lecture. " for i in range(count * 4))
+    return [
+        Document(page_content=body[i * 100:i * 100 + 130], metadata={"source": "notes.pdf", "chunk": i})
+        for i in range(count)
+    ], body
+
+
+def test_out_of_order_run_is_merged_once():
+    docs, body = overlapping_chunks(6)
+    for order in ([3, 5, 4], [3, 1, 2]):
+        merged = merge_adjacent_chunks([docs[i] for i in order])
+        first, last = min(order), max(order)
+        assert len(merged) == 1
+        assert merged[0].page_content == body[first * 100:last * 100 + 130]
+        assert (merged[0].metadata["chunk"], merged[0].metadata["chunk_end"]) == (first, last)
+
+
+def test_runs_are_ranked_by_best_member():
+    docs, _ = overlapping_chunks(10)
+    other = Document(page_content="unrelated", metadata={"source": "other.pdf", "chunk": 4})
+    merged = merge_adjacent_chunks([docs[8], other, docs[1], docs[7], docs[2]])
+    assert [(doc.metadata["source"], doc.metadata["chunk"]) for doc in merged] == [
+        ("notes.pdf", 7), ("other.pdf", 4), ("notes.pdf", 1)
+    ]
+
+
+def test_token_counts_fall_back_without_tokenizer(monkeypatch):
+    monkeypatch.setattr(context_packer, "_get_encoding", lambda model: None)
+    assert count_tokens("x" * 40) == 11
+    assert count_tokens(truncate_to_tokens("x" * 400, 20)) <= 20
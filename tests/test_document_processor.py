@@ -0,0 +1,64 @@
+import pytest
+
+from document_processor import detect_section_heading, split_pages_into_chunks
+
+
+@pytest.mark.parametrize("line", [
+    "2.3 Cardiac Output",
+    "1.2.4 Mechanism of action",
+    "3. Heart Failure",
+    "4. Drugs for Heart Failure",
+    "Chapter 3",
+    "CHAPTER 12: Renal Physiology",
+    "Section 2.1 ACE Inhibitors",
+    "PHARMACOLOGY",
+])
+def test_headings_are_detected(line):
+    assert detect_section_heading(line) == line
+
+
+@pytest.mark.parametrize("line", [
+    "120 mg twice daily for 7 days",
+    "3 patients developed hypokalaemia",
+    "2017 guidelines recommend ACE inhibitors",
+    "2.5 mg once daily",
+    "1.5 L/min at rest",
+    "3. patients developed hypokalaemia",
+    "3. Patients developed hypokalaemia",
+    "4. Give 40 mg furosemide",
+    "chapter 3 covers the basics",
+    "2.3 Cardiac output is the product of heart rate and stroke volume.",
+    "",
+])
+def test_text_lines_are_not_headings(line):
+    assert detect_section_heading(line) is None
+
+
+def test_chunks_map_to_pages_and_sections():
+    filler = "The heart pumps blood through the body. " * 20
+    pages = [
+        "1.1 Cardiac Cycle\n" + filler,
+        "120 mg twice daily for 7 days\n" + filler,
+        "1.2 Heart Failure\n" + filler,
+    ]
+
+    chunks = split_pages_into_chunks(pages, chunk_size=300, chunk_overlap=0)
+
+    assert chunks[0]["page_start"] == 1
+    assert chunks[-1]["page_end"] == 3
+    assert all(chunk["page_start"] <= chunk["page_end"] for chunk in chunks)
+    for chunk in chunks:
+        expected = "1.2 Heart Failure" if chunk["page_start"] == 3 else "1.1 Cardiac Cycle"
+        assert chunk["section"] == expected
+    # Every page's text ends up in a chunk labelled with that page
+    for page_number, page in enumerate(pages, start=1):
+        first_line = page.splitlines()[0]
+        owner = next(chunk for chunk in chunks if first_line in chunk["text"])
+        assert owner["page_start"] <= page_number <= owner["page_end"]
+
+
+def test_text_before_the_first_heading_has_no_section():
+    chunks = split_pages_into_chunks(["Introductory text without a heading.", "2.1 Diuretics\nLoop diuretics."])
+    assert chunks[0]["section"] == ""
+    assert chunks[0]["page_start"] == 1
+    assert chunks[0]["page_end"] == 2
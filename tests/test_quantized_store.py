@@ -0,0 +1,139 @@
+import os
+
+import chromadb
+import numpy as np
+import pytest
+
+from quantized_store import CHUNKS_FILE, INDEX_FILE, VECTORS_FILE, QuantizedVectorStore, matches_filter
+
+
+def clustered_vectors(count, dimensions=64, latent=12, seed=0):
+    # Embeddings vary along far fewer directions than they have dimensions
+    rng = np.random.default_rng(seed)
+    basis = rng.normal(size=(latent, dimensions))
+    return (rng.normal(size=(count, latent)) @ basis + 0.05 * rng.normal(size=(count, dimensions))).astype(np.float32)
+
+
+def make_store(session_id="quantized", dimensions=16, rescore_factor=10):
+    return QuantizedVectorStore(session_id, None, dimensions, "pca", rescore_factor)
+
+
+def add_chunks(store, vectors, start=0):
+    return store.add_embeddings(
+        [f"chunk {i}" for i in range(start, start + len(vectors))],
+        vectors,
+        [{"source": "notes.pdf", "chunk": i} for i in range(start, start + len(vectors))],
+        [f"id-{i}" for i in range(start, start + len(vectors))]
+    )
+
+
+@pytest.fixture(autouse=True)
+def collections_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("chroma_db")
+
+
+def test_recall_matches_exact_search():
+    vectors = clustered_vectors(2000)
+    store = make_store()
+    add_chunks(store, vectors)
+
+    queries = clustered_vectors(20, seed=1)
+    recalls = []
+    for query in queries:
+        exact = np.argsort(np.square(vectors - query).sum(axis=1))[:10]
+        results = store.similarity_search_by_vector_with_relevance_scores(query, k=10)
+        found = [doc.metadata["chunk"] for doc, _ in results]
+        recalls.append(len(set(found) & set(exact.tolist())) / 10)
+        # Returned distances are exact squared L2, in ascending order
+        distances = [distance for _, distance in results]
+        assert distances == sorted(distances)
+        assert np.allclose(distances, np.square(vectors[found] - query).sum(axis=1), rtol=1e-4)
+
+    assert np.mean(recalls) >= 0.95
+
+
+@pytest.mark.parametrize("where", [
+    {"source": "a.pdf"},
+    {"source": {"$ne": "a.pdf"}},
+    {"page_start": {"$gte": 3}},
+    {"page_end": {"$lt": 5}},
+    {"source": {"$in": ["a.pdf", "c.pdf"]}},
+    {"source": {"$nin": ["a.pdf"]}},
+    {"$and": [{"source": "b.pdf"}, {"page_start": {"$lte": 4}}]},
+    {"$or": [{"section": "Renal"}, {"page_end": {"$gt": 6}}]},
+])
+def test_filters_match_chroma(where):
+    metadatas = [
+        {"source": "a.pdf", "page_start": 1, "page_end": 2, "section": "Cardiology"},
+        {"source": "a.pdf", "page_start": 3, "page_end": 4},
+        {"source": "b.pdf", "page_start": 2, "page_end": 3, "section": "Renal"},
+        {"source": "b.pdf", "page_start": 5, "page_end": 7, "section": "Renal"},
+        {"source": "c.pdf", "page_start": 6, "page_end": 8, "section": "Gut"},
+        {"source": "c.pdf"},
+    ]
+    ids = [str(i) for i in range(len(metadatas))]
+    collection = chromadb.EphemeralClient().get_or_create_collection("filters", embedding_function=None)
+    collection.upsert(ids=ids, embeddings=[[float(i), 0.0] for i in range(len(ids))], metadatas=metadatas)
+
+    expected = sorted(collection.get(where=where)["ids"])
+    assert sorted(chunk_id for chunk_id, metadata in zip(ids, metadatas) if matches_filter(metadata, where)) == expected
+
+
+def test_interrupted_write_is_cut_off():
+    vectors = clustered_vectors(30)
+    store = make_store()
+    add_chunks(store, vectors[:10])
+
+    # A crash after half a vector and half a chunk line were written
+    with open(os.path.join(store.path, VECTORS_FILE), "ab") as f:
+        f.write(vectors[10].tobytes()[:100])
+    with open(os.path.join(store.path, CHUNKS_FILE), "ab") as f:
+        f.write(b'{"id": "id-10", "te')
+
+    reopened = make_store()
+    assert len(reopened) == 10
+
+    add_chunks(reopened, vectors[10:20], start=10)
+    assert len(make_store()) == 20
+    for i in (0, 9, 10, 19):
+        doc, distance = reopened.similarity_search_by_vector_with_relevance_scores(vectors[i], k=1)[0]
+        assert doc.metadata["chunk"] == i
+        assert distance == pytest.approx(0.0, abs=1e-4)
+
+
+def test_vectors_without_chunks_are_dropped():
+    vectors = clustered_vectors(20)
+    store = make_store()
+    add_chunks(store, vectors[:10])
+
+    # Vectors are written before their chunks, so a crash can leave extra ones
+    with open(os.path.join(store.path, VECTORS_FILE), "ab") as f:
+        f.write(vectors[10:13].tobytes())
+
+    # The same store object notices the grown file before appending
+    add_chunks(store, vectors[13:20], start=13)
+    reopened = make_store()
+    assert len(reopened) == 17
+    for i in (9, 13, 19):
+        doc, distance = reopened.similarity_search_by_vector_with_relevance_scores(vectors[i], k=1)[0]
+        assert doc.metadata["chunk"] == i
+        assert distance == pytest.approx(0.0, abs=1e-4)
+
+
+def test_reopen_after_persist_uses_saved_index():
+    vectors = clustered_vectors(500)
+    store = make_store()
+    add_chunks(store, vectors)
+    store.persist()
+    assert os.path.exists(os.path.join(store.path, INDEX_FILE))
+
+    reopened = make_store()
+    assert reopened._index is not None
+    assert len(reopened) == 500
+
+    query = clustered_vectors(1, seed=2)[0]
+    before = store.similarity_search_by_vector_with_relevance_scores(query, k=5)
+    after = reopened.similarity_search_by_vector_with_relevance_scores(query, k=5)
+    assert [doc.metadata for doc, _ in after] == [doc.metadata for doc, _ in before]
+    assert reopened.get(where={"chunk": 7})["documents"] == ["chunk 7"]
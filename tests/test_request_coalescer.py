@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+
+from request_coalescer import RequestCoalescer
+
+
+def slow_stream(release, tokens):
+    def producer():
+        for i, token in enumerate(tokens):
+            if i == 2:
+                release.wait(timeout=5)
+            yield token
+    return producer
+
+
+def test_follower_completes_when_leader_disconnects():
+    coalescer = RequestCoalescer()
+    release = threading.Event()
+    tokens = ["a", "b", "c", "d", "e"]
+
+    leader = coalescer.stream("key", slow_stream(release, tokens))
+    assert [next(leader), next(leader)] == ["a", "b"]
+
+    follower = coalescer.stream("key", slow_stream(release, ["unused"]))
+    assert [next(follower), next(follower)] == ["a", "b"]
+
+    # The leader's consumer goes away, e.g. a Streamlit rerun or a closed connection
+    leader.close()
+    release.set()
+
+    assert list(follower) == ["c", "d", "e"]
+    assert coalescer.get_summary()["executions"] == 1
+    assert coalescer.get_summary()["coalesced"] == 1
+
+
+def test_producer_error_reaches_every_caller():
+    coalescer = RequestCoalescer()
+    release = threading.Event()
+
+    def producer():
+        yield "a"
+        release.wait(timeout=5)
+        raise ValueError("model failed")
+
+    leader = coalescer.stream("key", producer)
+    follower = coalescer.stream("key", producer)
+    release.set()
+
+    for stream in (leader, follower):
+        with pytest.raises(ValueError):
+            list(stream)
+
+
+def test_stats_are_bounded():
+    coalescer = RequestCoalescer(max_tracked_keys=3)
+    for i in range(10):
+        coalescer.do(i, lambda: i)
+
+    assert len(coalescer.get_stats()) == 3
+    assert coalescer.get_summary()["requests"] == 10
+
+
+
+def test_top_keys_are_ordered_by_coalesced_calls():
+    coalescer = RequestCoalescer()
+    for key, callers in (("rare", 2), ("never", 1), ("common", 4)):
+        release = threading.Event()
+        requests = coalescer.get_summary()["requests"]
+        threads = [
+            threading.Thread(target=coalescer.do, args=(key, lambda: release.wait(5)))
+            for _ in range(callers)
+        ]
+        for thread in threads:
+            thread.start()
+        while coalescer.get_summary()["requests"] < requests + callers:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+    assert [key for key, _ in coalescer.get_top_keys()] == ["common", "rare"]
+    assert coalescer.get_top_keys(limit=1)[0][1] == {"requests": 4, "executions": 1, "coalesced": 3}
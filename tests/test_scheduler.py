@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import (
+    ModelCallScheduler,
+    SQLiteBudget,
+    SchedulerTimeout,
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE
+)
+
+
+def shared_schedulers(path, count=2, **limits):
+    limits = dict({"requests_per_minute": 6000, "tokens_per_minute": 100000,
+                   "max_concurrency": 2, "reserved_interactive": 1}, **limits)
+    return [ModelCallScheduler(budget=SQLiteBudget(path=str(path), **limits)) for _ in range(count)]
+
+
+def test_concurrency_is_shared_between_schedulers(tmp_path):
+    first, second = shared_schedulers(tmp_path / "scheduler.db")
+
+    held = [first.acquire(), second.acquire()]
+    with pytest.raises(SchedulerTimeout):
+        second.acquire(timeout=0.3)
+
+    first.release(held[0])
+    second.release(second.acquire(timeout=1))
+    second.release(held[1])
+
+
+def test_background_yields_to_interactive_in_another_scheduler(tmp_path):
+    app, script = shared_schedulers(tmp_path / "scheduler.db")
+    order = []
+
+    held = app.acquire(priority=PRIORITY_INTERACTIVE)
+    other = app.acquire(priority=PRIORITY_INTERACTIVE)
+
+    def call(scheduler, priority, name):
+        with scheduler.slot(priority=priority, user_id=name):
+            order.append(name)
+
+    background = threading.Thread(target=call, args=(script, PRIORITY_BACKGROUND, "ingestion"))
+    interactive = threading.Thread(target=call, args=(app, PRIORITY_INTERACTIVE, "chat"))
+    background.start()
+    time.sleep(0.2)
+    interactive.start()
+    time.sleep(0.2)
+
+    app.release(held)
+    app.release(other)
+    background.join(5)
+    interactive.join(5)
+
+    assert order == ["chat", "ingestion"]
+
+
+def test_rate_budget_is_shared_between_schedulers(tmp_path):
+    first, second = shared_schedulers(tmp_path / "scheduler.db", requests_per_minute=60)
+
+    for _ in range(30):
+        first.release(first.acquire())
+        second.release(second.acquire())
+
+    started = time.monotonic()
+    second.release(second.acquire(timeout=5))
+    assert time.monotonic() - started >= 0.5
@@ -0,0 +1,90 @@
+import os
+import sqlite3
+import time
+
+from storage_maintenance import (
+    ACCESS_MARKER,
+    CHROMA_SQLITE_FILE,
+    MIN_IDLE_SECONDS,
+    compact_collection,
+    expire_collections
+)
+
+
+def make_collection(root, session_id, idle_seconds, size_bytes=1000):
+    path = root / session_id
+    path.mkdir(parents=True)
+    (path / "data.bin").write_bytes(b"x" * size_bytes)
+    marker = path / ACCESS_MARKER
+    marker.touch()
+    last_access = time.time() - idle_seconds
+    os.utime(marker, (last_access, last_access))
+    return path
+
+
+def removed(expired):
+    return sorted(collection["session_id"] for collection in expired)
+
+
+def test_old_collections_expire(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    root = tmp_path / "chroma_db"
+    make_collection(root, "old", idle_seconds=8 * 86400)
+    make_collection(root, "recent", idle_seconds=2 * 86400)
+
+    assert removed(expire_collections(max_age_days=7, root=str(root))) == ["old"]
+    assert sorted(os.listdir(root)) == ["recent"]
+
+
+def test_size_limit_removes_least_recently_used_first(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    root = tmp_path / "chroma_db"
+    make_collection(root, "oldest", idle_seconds=5 * 86400)
+    make_collection(root, "older", idle_seconds=4 * 86400)
+    make_collection(root, "newer", idle_seconds=3 * 86400)
+
+    expired = expire_collections(max_age_days=7, max_total_bytes=1500, root=str(root), dry_run=True)
+
+    assert removed(expired) == ["older", "oldest"]
+    # A dry run only reports
+    assert len(os.listdir(root)) == 3
+
+
+def test_protected_collection_is_kept(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    root = tmp_path / "chroma_db"
+    make_collection(root, "loader-session", idle_seconds=30 * 86400)
+    make_collection(root, "other", idle_seconds=30 * 86400)
+    (tmp_path / "session_id.txt").write_text("loader-session\n")
+
+    assert removed(expire_collections(max_age_days=7, max_total_bytes=0, root=str(root))) == ["other"]
+    assert os.listdir(root) == ["loader-session"]
+
+
+def test_recently_used_collections_are_never_removed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    root = tmp_path / "chroma_db"
+    make_collection(root, "in-use", idle_seconds=MIN_IDLE_SECONDS - 60)
+    make_collection(root, "idle", idle_seconds=MIN_IDLE_SECONDS + 60)
+
+    # Even a zero age and size limit leaves collections used within the hour
+    assert removed(expire_collections(max_age_days=0, max_total_bytes=0, root=str(root))) == ["idle"]
+
+
+def test_compaction_keeps_live_segment_directories(tmp_path):
+    path = tmp_path / "collection"
+    path.mkdir()
+    conn = sqlite3.connect(str(path / CHROMA_SQLITE_FILE))
+    conn.execute("CREATE TABLE segments (id TEXT PRIMARY KEY)")
+    conn.execute("INSERT INTO segments VALUES ('live-segment')")
+    conn.commit()
+    conn.close()
+    for segment in ["live-segment", "stale-segment"]:
+        (path / segment).mkdir()
+        (path / segment / "data_level0.bin").write_bytes(b"x" * 4096)
+
+    reclaimed = compact_collection(str(path))
+
+    assert (path / "live-segment" / "data_level0.bin").exists()
+    assert not (path / "stale-segment").exists()
+    assert reclaimed >= 4096
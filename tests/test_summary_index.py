@@ -0,0 +1,27 @@
+import pytest
+
+from summary_index import route_query, LEVEL_CHUNK, LEVEL_DOCUMENT, LEVEL_SECTION
+
+
+@pytest.mark.parametrize("question, level", [
+    # The material as a whole
+    ("Summarize this lecture", LEVEL_DOCUMENT),
+    ("Can you summarise my notes?", LEVEL_DOCUMENT),
+    ("Give me an overview of the whole document", LEVEL_DOCUMENT),
+    ("What are the main points of the lecture?", LEVEL_DOCUMENT),
+    ("What is this chapter about?", LEVEL_DOCUMENT),
+    ("Write a short summary of the slides", LEVEL_DOCUMENT),
+    ("Summarize everything", LEVEL_DOCUMENT),
+    # Broad questions about a topic
+    ("Summarize what the lecture says about ACE inhibitors", LEVEL_SECTION),
+    ("Give me an overview of the beta blockers section in my notes", LEVEL_SECTION),
+    ("Summarize chapter 3", LEVEL_SECTION),
+    ("What are the key points about heart failure in the textbook?", LEVEL_SECTION),
+    ("Summarize the mechanism of ACE inhibitors", LEVEL_SECTION),
+    ("Key takeaways on renal physiology from this lecture", LEVEL_SECTION),
+    # Specific questions
+    ("What is the starting dose of furosemide?", LEVEL_CHUNK),
+    ("Which lecture mentions hypokalaemia?", LEVEL_CHUNK),
+])
+def test_route_query(question, level):
+    assert route_query(question) == level
@@ -0,0 +1,207 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from chat_handler import get_conversation_chain, retrieve_documents, answer_standalone_question
+from query_cache import (
+    embedding_cache,
+    retrieval_cache,
+    answer_cache,
+    cache_key,
+    get_cache_stats,
+    get_generation,
+    load_answers,
+    save_answers
+)
+from request_coalescer import normalize_question
+from scheduler import PRIORITY_BACKGROUND
+from summary_index import build_summary_index
+
+# Shown in the app and always warmed up
+EXAMPLE_QUESTIONS = [
+    "What are the key symptoms of Crohn's disease?",
+    "Explain the cardiac conduction system step by step.",
+    "Compare and contrast Type 1 and Type 2 diabetes.",
+    "Summarize the mechanism of action for ACE inhibitors.",
+]
+
+# Common questions from the logs, one per line
+WARMUP_QUESTIONS_FILE = os.environ.get("MEDSTUDY_WARMUP_QUESTIONS", "warmup_questions.txt")
+
+# Warm up at all, and also generate answers (costs one model call per question)
+WARMUP_ENABLED = os.environ.get("MEDSTUDY_WARMUP", "1") == "1"
+WARMUP_ANSWERS = os.environ.get("MEDSTUDY_WARMUP_ANSWERS", "1") == "1"
+
+# Collections the HTTP API warms up when it starts, comma-separated
+WARMUP_SESSIONS = [session for session in os.environ.get("MEDSTUDY_WARMUP_SESSIONS", "").split(",") if session]
+
+_started = set()
+_started_lock = threading.Lock()
+
+
+def load_warmup_questions(path=WARMUP_QUESTIONS_FILE):
+    """
+    Get the questions to warm up: the app's examples plus the question file.
+
+    Args:
+        path (str): Question file, skipped if it does not exist
+
+    Returns:
+        list: Questions, without duplicates
+    """
+    questions = list(EXAMPLE_QUESTIONS)
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            questions.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+
+    unique = {}
+    for question in questions:
+        unique.setdefault(normalize_question(question), question)
+    return list(unique.values())
+
+
+def warm_up(session_id, questions=None, answers=WARMUP_ANSWERS, parallelism=2):
+    """
+    Replay questions against a collection to fill the caches.
+
+    Opens the shared vector store, then embeds, retrieves and (optionally)
+    answers every question as a first-turn question in the default scope,
+    which is how the first students after a deploy ask them. All of it runs
+    as background work, and students asking the same question meanwhile get
+    their own interactive call instead of waiting on the warm-up. Answers saved
+    by an earlier warm-up of the same documents are reused, and new ones
+    are saved for the next start.
+
+    Args:
+        session_id (str): Unique session identifier
+        questions (list): Questions to replay, defaults to load_warmup_questions()
+        answers (bool): Whether to generate answers as well
+        parallelism (int): Questions warmed up at the same time
+
+    Returns:
+        dict: Warm-up time, cache coverage and any failures
+    """
+    questions = questions if questions is not None else load_warmup_questions()
+    started = time.perf_counter()
+
+    chain = get_conversation_chain(session_id, priority=PRIORITY_BACKGROUND)
+    if chain is None:
+        return {"session_id": session_id, "error": "No vector store found"}
+    open_seconds = time.perf_counter() - started
+    loaded = load_answers(session_id)
+
+    failures = []
+
+    def warm(question):
+        try:
+            retrieve_documents(chain, question, session_id, priority=PRIORITY_BACKGROUND)
+            if answers:
+                answer_standalone_question(chain, question, session_id, priority=PRIORITY_BACKGROUND)
+        except Exception as e:
+            failures.append(f"{question}: {str(e)}")
+
+    with ThreadPoolExecutor(max_workers=parallelism) as pool:
+        list(pool.map(warm, questions))
+
+    if answers:
+        save_answers(session_id)
+
+    embedding_id = chain.retriever.vectorstore.embeddings.backend_id
+    keys = [cache_key(session_id, None, question) for question in questions]
+    count = max(len(questions), 1)
+    return {
+        "session_id": session_id,
+        "generation": get_generation(session_id),
+        "questions": len(questions),
+        "seconds": round(time.perf_counter() - started, 2),
+        "open_seconds": round(open_seconds, 2),
+        "answers_loaded": loaded,
+        "embedding_coverage": sum(embedding_cache.contains((embedding_id, q)) for q in questions) / count,
+        "retrieval_coverage": sum(retrieval_cache.contains(key) for key in keys) / count,
+        "answer_coverage": sum(answer_cache.contains(key) for key in keys) / count,
+        "failures": failures,
+    }
+
+
+def print_report(report):
+    """
+    Print a warm-up report.
+
+    Args:
+        report (dict): Result of warm_up
+    """
+    if "error" in report:
+        print(f"Warm-up of {report['session_id']} skipped: {report['error']}")
+        return
+
+    print(
+        f"Warmed up {report['questions']} questions for {report['session_id']} in {report['seconds']}s "
+        f"(vector store opened in {report['open_seconds']}s, {report['answers_loaded']} saved answers reused)"
+    )
+    print(
+        f"Coverage: embeddings {report['embedding_coverage']:.0%}, retrievals {report['retrieval_coverage']:.0%}, "
+        f"answers {report['answer_coverage']:.0%}"
+    )
+    for failure in report["failures"]:
+        print(f"Failed: {failure}")
+
+
+def start_warmup(session_id, build_summaries=False):
+    """
+    Warm up a collection in a background thread, once per version of its
+    documents in this process.
+
+    Args:
+        session_id (str): Unique session identifier
+        build_summaries (bool): Build the summary index first, so broad
+            questions are warmed up from the summaries
+    """
+    if not build_summaries:
+        if not WARMUP_ENABLED:
+            return
+        with _started_lock:
+            if (session_id, get_generation(session_id)) in _started:
+                return
+
+    def run():
+        if build_summaries:
+            build_summary_index(session_id)
+        if not WARMUP_ENABLED:
+            return
+        with _started_lock:
+            key = (session_id, get_generation(session_id))
+            if key in _started:
+                return
+            _started.add(key)
+        print_report(warm_up(session_id))
+
+    threading.Thread(target=run, name=f"warmup-{session_id}", daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill the caches of a collection and save answers for the next start")
+    parser.add_argument("session_id", help="Session whose collection is warmed up")
+    parser.add_argument("--questions", default=WARMUP_QUESTIONS_FILE, help="File with one question per line")
+    parser.add_argument("--no-answers", action="store_true", help="Only warm up embeddings and retrieval")
+    parser.add_argument("--parallelism", type=int, default=2, help="Questions warmed up at the same time")
+    args = parser.parse_args()
+
+    if not os.environ.get("OPENAI_API_KEY"):
+        print("Error: OPENAI_API_KEY environment variable must be set")
+        sys.exit(1)
+
+    report = warm_up(
+        args.session_id,
+        load_warmup_questions(args.questions),
+        answers=not args.no_answers,
+        parallelism=args.parallelism
+    )
+    print_report(report)
+    print(f"Caches: {get_cache_stats()}")
+
+
+if __name__ == "__main__":
+    main()